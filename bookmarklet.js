@@ -1,10 +1,148 @@
-javascript:(async () => {
+javascript:((run) => {
+    // The worker installs this script once per page load (install-only) and then
+    // calls window.__chatgptBookmarkletRun(options) for every job. Clicking the
+    // bookmarklet manually still runs it straight away.
+    // A job stopped through window.__chatgptBookmarkletCancel() resolves with
+    // { cancelled: true } instead of its answer, and one the script gave up on
+    // with { failed: true, error, code } naming the step that failed. Anything
+    // else thrown is a bug and rejects as is.
+    window.__chatgptBookmarkletRun = (options) => run(options)
+      .catch((error) => {
+        if (error && error.cancelled) {
+          return { cancelled: true, url: window.location.href };
+        }
+        if (error && error.code) {
+          return { failed: true, error: error.message, code: error.code, url: window.location.href };
+        }
+        throw error;
+      })
+      .finally(() => {
+        delete window.__chatgptBookmarkletCancel;
+      });
+    if (Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletInstallOnly")) {
+      delete window.__chatgptBookmarkletInstallOnly;
+      return undefined;
+    }
+    return run();
+  })(async (options = null) => {
     const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    // The worker cancels a running job by calling this: generation is stopped
+    // and whatever the job is waiting on rejects, freeing the tab at once
+    let cancelled = false;
+    const cancelWaiters = new Set();
+    const cancelledError = () => Object.assign(new Error("Job cancelled"), { cancelled: true });
+    // Errors the worker can classify: the code says whether to try again
+    const jobError = (code, message) => Object.assign(new Error(message), { code });
+    window.__chatgptBookmarkletCancel = () => {
+      cancelled = true;
+      const stopButton = document.querySelector('button[data-testid="stop-button"]');
+      if (stopButton) {
+        stopButton.click();
+      }
+      cancelWaiters.forEach((cancelWait) => cancelWait());
+      return true;
+    };
+
+    // Resolve with the first truthy value of check(), re-evaluating it on DOM
+    // mutations instead of polling: on every one, or with intervalMs at most
+    // once per interval for checks too costly to run per streamed token.
+    // Resolves null once timeoutMs has passed and rejects if the job is cancelled.
+    const waitForCondition = (check, timeoutMs, intervalMs = 0) => new Promise((resolve, reject) => {
+      if (cancelled) {
+        reject(cancelledError());
+        return;
+      }
+      const initial = check();
+      if (initial) {
+        resolve(initial);
+        return;
+      }
+      let observer = null;
+      let timer = null;
+      let scheduled = null;
+      const cleanup = () => {
+        observer.disconnect();
+        clearTimeout(timer);
+        clearTimeout(scheduled);
+        cancelWaiters.delete(cancelWait);
+      };
+      const finish = (value) => {
+        cleanup();
+        resolve(value);
+      };
+      const cancelWait = () => {
+        cleanup();
+        reject(cancelledError());
+      };
+      cancelWaiters.add(cancelWait);
+      const recheck = () => {
+        scheduled = null;
+        const value = check();
+        if (value) {
+          finish(value);
+        }
+      };
+      observer = new MutationObserver(() => {
+        if (intervalMs <= 0) {
+          recheck();
+        } else if (scheduled === null) {
+          scheduled = setTimeout(recheck, intervalMs);
+        }
+      });
+      observer.observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        characterData: true,
+      });
+      timer = setTimeout(() => finish(check() || null), timeoutMs);
+    });
+
+    // Jobs from the worker arrive as a single options object. Older callers
+    // (cdp_send_prompt.py) still set window.__chatgptBookmarklet* globals.
+    const hasLegacyGlobal = (name) => typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, name);
+    const takeLegacyGlobal = (name) => {
+      if (!hasLegacyGlobal(name)) {
+        return null;
+      }
+      const value = window[name];
+      delete window[name];
+      return value;
+    };
+    const isAutomated = options !== null || hasLegacyGlobal("__chatgptBookmarkletPrompt");
+
+    // Upper bounds (ms) for each wait on the page; the worker can override them per job
+    const timeouts = {
+      composer: 10000,
+      uploadTrigger: 2000,
+      imageUpload: 60000,
+      modeMenu: 1500,
+      modeActivation: 3000,
+      sendButton: 5000,
+      submit: 10000,
+      chatUrl: 15000,
+      response: 1800000,
+      renderQuiet: 300,
+      renderSettle: 2000,
+      streamInterval: 250,
+      responseCheck: 250,
+      ...((options && options.timeouts) || {}),
+    };
+
+    // Duration of each phase, returned with the response payload
+    const timings = {};
+    const timed = async (phase, fn) => {
+      const started = performance.now();
+      try {
+        return await fn();
+      } finally {
+        timings[`${phase}_ms`] = Math.round(performance.now() - started);
+      }
+    };
   
     const showToast = (message, type = "success") => {
       // For automated worker usage, reduce toast visibility and duration
-      const isAutomated = typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPrompt");
-      
       // Log for debugging in automated mode
       if (isAutomated) {
         console.log(`[AUTOMATED] Toast: ${message} (${type})`);
@@ -113,19 +251,30 @@ javascript:(async () => {
     }
 
   
-    const promptTextSource = typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPrompt")
-      ? window.__chatgptBookmarkletPrompt
-      : prompt("Prompt to send to ChatGPT:");
-    
-    const promptMode = typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPromptMode")
-      ? window.__chatgptBookmarkletPromptMode
-      : null;
-    
-    const imageUrl = typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletImageUrl")
-      ? window.__chatgptBookmarkletImageUrl
-      : null;
-    
-    const isAutomated = typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPrompt");
+    let promptTextSource;
+    let promptMode;
+    let imageUrl;
+    let imageAttached = false;
+    let detach = false;
+    let harvest = false;
+    let deadline = null;
+    if (options !== null) {
+      promptTextSource = options.prompt;
+      promptMode = options.promptMode || null;
+      imageUrl = options.imageUrl || null;
+      // Set when the worker already attached the file with DOM.setFileInputFiles
+      imageAttached = Boolean(options.imageAttached);
+      detach = Boolean(options.detach);
+      harvest = Boolean(options.harvest);
+      // Epoch ms after which the worker has given up on the answer
+      deadline = Number.isFinite(options.deadline) ? options.deadline : null;
+    } else {
+      promptTextSource = isAutomated
+        ? takeLegacyGlobal("__chatgptBookmarkletPrompt")
+        : prompt("Prompt to send to ChatGPT:");
+      promptMode = takeLegacyGlobal("__chatgptBookmarkletPromptMode");
+      imageUrl = takeLegacyGlobal("__chatgptBookmarkletImageUrl");
+    }
     
     if (isAutomated) {
       console.log(`[AUTOMATED] Prompt received: ${promptTextSource}`);
@@ -135,15 +284,6 @@ javascript:(async () => {
       }
     }
     
-    if (typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPrompt")) {
-      delete window.__chatgptBookmarkletPrompt;
-    }
-    if (typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletPromptMode")) {
-      delete window.__chatgptBookmarkletPromptMode;
-    }
-    if (typeof window !== "undefined" && Object.prototype.hasOwnProperty.call(window, "__chatgptBookmarkletImageUrl")) {
-      delete window.__chatgptBookmarkletImageUrl;
-    }
     const promptText =
       promptTextSource !== null && promptTextSource !== undefined
         ? String(promptTextSource)
@@ -179,7 +319,7 @@ javascript:(async () => {
           // Handle regular URL - fetch it
           const response = await fetch(url);
           if (!response.ok) {
-            throw new Error(`Failed to fetch image: ${response.statusText}`);
+            throw jobError("image_fetch", `Failed to fetch image: ${response.statusText}`);
           }
           blob = await response.blob();
         }
@@ -294,16 +434,19 @@ javascript:(async () => {
           if (uploadButton) {
             // Click the upload button to reveal file input
             uploadButton.click();
-            await sleep(1000);
             
-            // Now look for the file input again
-            const newInputs = document.querySelectorAll('input[type="file"]');
-            for (const input of newInputs) {
-              if (!input.disabled && (input.accept.includes('image') || input.accept === '*' || input.accept === '')) {
-                fileInput = input;
-                console.log('[IMAGE] Found file input after button click:', input);
-                break;
+            // Now wait for the file input to show up
+            fileInput = await waitForCondition(() => {
+              const newInputs = document.querySelectorAll('input[type="file"]');
+              for (const input of newInputs) {
+                if (!input.disabled && (input.accept.includes('image') || input.accept === '*' || input.accept === '')) {
+                  return input;
+                }
               }
+              return null;
+            }, timeouts.uploadTrigger);
+            if (fileInput) {
+              console.log('[IMAGE] Found file input after button click:', fileInput);
             }
           }
           
@@ -319,7 +462,7 @@ javascript:(async () => {
         }
         
         if (!fileInput) {
-          throw new Error('Could not find or create file upload input');
+          throw jobError("image_input_missing", 'Could not find or create file upload input');
         }
         
         // Create a DataTransfer object to simulate file selection
@@ -339,15 +482,7 @@ javascript:(async () => {
         const clickEvent = new Event('click', { bubbles: true });
         fileInput.dispatchEvent(clickEvent);
         
-        console.log('[IMAGE] File uploaded, waiting for processing...');
-        
-        // Wait for upload to be processed
-        await sleep(3000);
-        
-        if (isAutomated) {
-          console.log('[AUTOMATED] Image upload completed');
-        }
-        showToast("Image uploaded successfully", "success");
+        console.log('[IMAGE] File handed to ChatGPT, waiting for processing...');
       } catch (error) {
         console.error('[IMAGE] Failed to upload image:', error);
         showToast(`Image upload failed: ${error.message}`, "error");
@@ -355,78 +490,249 @@ javascript:(async () => {
       }
     };
     
-    // Handle image upload if provided
-    if (imageUrl) {
-      try {
-        const imageFile = await imageUrlToFile(imageUrl);
-        await uploadImage(imageFile);
-        
-        // Wait a bit longer for ChatGPT to process the image
-        if (isAutomated) {
-          console.log('[AUTOMATED] Waiting for ChatGPT to process the uploaded image...');
+    // Wait until the attachment preview is rendered and no upload progress
+    // indicator is left in the composer
+    const waitForImageUpload = async () => {
+      const isUploaded = () => {
+        const container = document.querySelector('form') || document.body;
+        const preview = container.querySelector(
+          'img[src^="blob:"], [data-testid*="attachment"], [data-testid*="file-preview"]'
+        );
+        if (!preview) {
+          return false;
+        }
+        const busy = container.querySelector('[role="progressbar"], [aria-busy="true"], .animate-spin');
+        return !busy;
+      };
+      const uploaded = await waitForCondition(isUploaded, timeouts.imageUpload);
+      if (!uploaded) {
+        throw jobError("image_upload_timeout", `Image upload did not finish within ${timeouts.imageUpload} ms`);
+      }
+    };
+    
+    // Usage caps and rate limits are shown as banners, toasts or an error in
+    // place of the answer. Returns the message and the cooldown it mentions.
+    const throttleSelectors = [
+      '[role="alert"]',
+      '[role="status"]',
+      '[data-testid*="toast"]',
+      '[data-testid*="limit"]',
+      '.text-token-text-error',
+      '.text-red-500',
+    ];
+    const throttlePatterns = [
+      /you['’]ve (reached|hit) (our|the|your)\b.*\blimit/i,
+      /usage (cap|limit)/i,
+      /too many requests/i,
+      /rate limit/i,
+      /limit resets/i,
+    ];
+    const parseCooldownSeconds = (text) => {
+      const relative = text.match(/in (\d+)\s*(second|minute|hour|day)s?/i);
+      if (relative) {
+        const unit = { second: 1, minute: 60, hour: 3600, day: 86400 }[relative[2].toLowerCase()];
+        return Number(relative[1]) * unit;
+      }
+      const clock = text.match(/(?:after|at|until)\s+(\d{1,2}):(\d{2})\s*([AP]M)?/i);
+      if (clock) {
+        let hours = Number(clock[1]);
+        const meridiem = (clock[3] || "").toUpperCase();
+        if (meridiem === "PM" && hours < 12) {
+          hours += 12;
+        } else if (meridiem === "AM" && hours === 12) {
+          hours = 0;
+        }
+        const resetAt = new Date();
+        resetAt.setHours(hours, Number(clock[2]), 0, 0);
+        if (resetAt <= new Date()) {
+          resetAt.setDate(resetAt.getDate() + 1);
         }
-        await sleep(5000); // Wait 5 seconds for image processing
+        return Math.round((resetAt - new Date()) / 1000);
+      }
+      return null;
+    };
+    const detectThrottle = () => {
+      for (const node of document.querySelectorAll(throttleSelectors.join(", "))) {
+        // Answer prose and the composer may legitimately talk about limits
+        if (node.closest(".markdown") || node.querySelector('[contenteditable="true"], textarea')) {
+          continue;
+        }
+        const text = (node.textContent || "").trim();
+        if (text && throttlePatterns.some((pattern) => pattern.test(text))) {
+          return { throttled: true, message: text.slice(0, 500), retry_after_seconds: parseCooldownSeconds(text) };
+        }
+      }
+      return null;
+    };
+    const throttledResult = (throttle) => {
+      if (isAutomated) {
+        console.log(`[AUTOMATED] ChatGPT is throttling this account: ${throttle.message}`);
+      }
+      showToast(throttle.message, "warning");
+      return { ...throttle, timings, url: window.location.href };
+    };
+
+    const pastDeadline = () => deadline !== null && Date.now() >= deadline;
+    const expiredResult = () => {
+      if (isAutomated) {
+        console.log("[AUTOMATED] Deadline passed, abandoning the request");
+      }
+      return { expired: true, timings, url: window.location.href };
+    };
+
+    // Answers already on the page (follow-up chats) must not be mistaken for the new one
+    const assistantSelector = '[data-message-author-role="assistant"]';
+    let assistantCountBefore = 0;
+
+    // A harvest revisits a chat submitted earlier and only collects its answer
+    if (!harvest) {
+      if (pastDeadline()) {
+        return expiredResult();
+      }
+
+      // A cap banner shown before we start means the prompt cannot be sent at all
+      const throttledBefore = detectThrottle();
+      if (throttledBefore) {
+        return throttledResult(throttledBefore);
+      }
+
+      // Handle image upload if provided
+      if (imageAttached || imageUrl) {
+        try {
+          await timed("image_upload", async () => {
+            if (imageAttached) {
+              if (isAutomated) {
+                console.log('[AUTOMATED] Image attached by worker, waiting for ChatGPT to process it...');
+              }
+              showToast("Uploading image...", "info");
+            } else {
+              const imageFile = await imageUrlToFile(imageUrl);
+              await uploadImage(imageFile);
+            }
+          
+            await waitForImageUpload();
+          });
         
-      } catch (error) {
-        if (isAutomated) {
-          console.log(`[AUTOMATED] ERROR: Image upload failed - ${error.message}`);
-          throw new Error(`Image upload failed: ${error.message}`);
+          if (isAutomated) {
+            console.log('[AUTOMATED] Image upload completed');
+          }
+          showToast("Image uploaded successfully", "success");
+        } catch (error) {
+          if (error && error.cancelled) {
+            throw error;
+          }
+          if (isAutomated) {
+            console.log(`[AUTOMATED] ERROR: Image upload failed - ${error.message}`);
+            // Coded errors keep their code so the worker classifies them as thrown
+            if (error && error.code) {
+              throw error;
+            }
+            throw jobError("image_upload_failed", `Image upload failed: ${error.message}`);
+          }
+          alert(`Failed to upload image: ${error.message}`);
+          return;
         }
-        alert(`Failed to upload image: ${error.message}`);
-        return;
       }
-    }
   
-    const waitForComposer = async () => {
-      for (let i = 0; i < 40; i += 1) {
-        // Try multiple selectors for the current ChatGPT interface
-        const selectors = [
-          'div[contenteditable="true"].ProseMirror#prompt-textarea', // Current ChatGPT interface
-          'div[contenteditable="true"].ProseMirror',                 // Fallback to any ProseMirror
-          'textarea[name="prompt-textarea"]',                        // Fallback textarea
-          'div[contenteditable="true"]',                             // Any contenteditable div
-          'textarea[placeholder*="Ask"]',                            // Textarea with "Ask" placeholder
-          'textarea[data-virtualkeyboard="true"]'                    // Textarea with virtual keyboard
-        ];
-        
-        for (const selector of selectors) {
+      const composerSelectors = [
+        'div[contenteditable="true"].ProseMirror#prompt-textarea', // Current ChatGPT interface
+        'div[contenteditable="true"].ProseMirror',                 // Fallback to any ProseMirror
+        'textarea[name="prompt-textarea"]',                        // Fallback textarea
+        'div[contenteditable="true"]',                             // Any contenteditable div
+        'textarea[placeholder*="Ask"]',                            // Textarea with "Ask" placeholder
+        'textarea[data-virtualkeyboard="true"]'                    // Textarea with virtual keyboard
+      ];
+  
+      const findComposer = () => {
+        for (const selector of composerSelectors) {
           const node = document.querySelector(selector);
           if (node) {
             console.log(`Composer found using selector: ${selector}`);
             return node;
           }
         }
-        await sleep(250);
-      }
-      return null;
-    };
+        return null;
+      };
   
-    const composer = await waitForComposer();
-    if (!composer) {
-      if (isAutomated) {
-        console.log("[AUTOMATED] ERROR: Could not locate the ChatGPT composer");
-        throw new Error("Could not locate the ChatGPT composer. Try refreshing the page.");
+      const waitForComposer = () => waitForCondition(findComposer, timeouts.composer);
+  
+      const composer = await timed("composer", waitForComposer);
+      if (!composer) {
+        if (isAutomated) {
+          console.log("[AUTOMATED] ERROR: Could not locate the ChatGPT composer");
+          throw jobError("composer_missing", "Could not locate the ChatGPT composer. Try refreshing the page.");
+        }
+        alert(
+          "Could not locate the ChatGPT composer. Try refreshing the page."
+        );
+        return;
       }
-      alert(
-        "Could not locate the ChatGPT composer. Try refreshing the page."
-      );
-      return;
-    }
     
-    if (isAutomated) {
-      console.log("[AUTOMATED] Composer found, inserting prompt");
-    }
+      if (isAutomated) {
+        console.log("[AUTOMATED] Composer found, inserting prompt");
+      }
   
-    composer.focus();
+      composer.focus();
   
-    // Handle special prompt modes
-    if (promptMode && (promptMode === "search" || promptMode === "study" || promptMode === "deep")) {
-      const modeCommand = promptMode === "search" ? "/sear" : (promptMode === "study" ? "/stu" : "/deep");
+      // Handle special prompt modes
+      if (promptMode && (promptMode === "search" || promptMode === "study" || promptMode === "deep")) {
+        const modeCommand = promptMode === "search" ? "/sear" : (promptMode === "study" ? "/stu" : "/deep");
       
-      if (isAutomated) {
-        console.log(`[AUTOMATED] Applying prompt mode: ${promptMode} (typing: ${modeCommand})`);
-      }
+        if (isAutomated) {
+          console.log(`[AUTOMATED] Applying prompt mode: ${promptMode} (typing: ${modeCommand})`);
+        }
       
+        await timed("mode", async () => {
+          try {
+            const range = document.createRange();
+            range.selectNodeContents(composer);
+            range.deleteContents();
+            const selection = window.getSelection();
+            selection.removeAllRanges();
+            selection.addRange(range);
+            document.execCommand("insertText", false, modeCommand);
+          } catch (error) {
+            composer.innerHTML = "";
+            composer.textContent = modeCommand;
+            const inputEvent = new InputEvent("input", {
+              data: modeCommand,
+              bubbles: true,
+              composed: true,
+            });
+            composer.dispatchEvent(inputEvent);
+          }
+        
+          // Wait for the slash-command menu to offer the mode
+          await waitForCondition(
+            () => document.querySelector('[role="listbox"], [role="menu"], [role="option"], [cmdk-item]'),
+            timeouts.modeMenu
+          );
+        
+          // Press Enter to activate the mode
+          const enterEvent = new KeyboardEvent("keydown", {
+            key: "Enter",
+            code: "Enter",
+            keyCode: 13,
+            which: 13,
+            bubbles: true,
+            composed: true,
+          });
+          composer.dispatchEvent(enterEvent);
+        
+          // The mode is active once the command text has been turned into a pill
+          const activated = await waitForCondition(
+            () => !(composer.textContent || composer.value || "").includes(modeCommand),
+            timeouts.modeActivation
+          );
+          if (!activated && isAutomated) {
+            console.log(`[AUTOMATED] Mode command ${modeCommand} still in composer after ${timeouts.modeActivation} ms, continuing`);
+          }
+        });
+      }
+
+      // Send the prompt as-is without markdown formatting instruction
+      // This allows ChatGPT to respond naturally and we'll use the copy button to get the full response
+      const insertStarted = performance.now();
       try {
         const range = document.createRange();
         range.selectNodeContents(composer);
@@ -434,214 +740,341 @@ javascript:(async () => {
         const selection = window.getSelection();
         selection.removeAllRanges();
         selection.addRange(range);
-        document.execCommand("insertText", false, modeCommand);
+        document.execCommand("insertText", false, promptText);
       } catch (error) {
         composer.innerHTML = "";
-        composer.textContent = modeCommand;
+        composer.textContent = promptText;
         const inputEvent = new InputEvent("input", {
-          data: modeCommand,
+          data: promptText,
           bubbles: true,
           composed: true,
         });
         composer.dispatchEvent(inputEvent);
       }
-      
-      // Wait a moment for the mode command to be processed
-      await sleep(200);
-      
-      // Press Enter to activate the mode
-      const enterEvent = new KeyboardEvent("keydown", {
-        key: "Enter",
-        code: "Enter",
-        keyCode: 13,
-        which: 13,
-        bubbles: true,
-        composed: true,
-      });
-      composer.dispatchEvent(enterEvent);
-      
-      // Wait for the mode to be activated
-      await sleep(500);
-    }
-
-    // Send the prompt as-is without markdown formatting instruction
-    // This allows ChatGPT to respond naturally and we'll use the copy button to get the full response
-    try {
-      const range = document.createRange();
-      range.selectNodeContents(composer);
-      range.deleteContents();
-      const selection = window.getSelection();
-      selection.removeAllRanges();
-      selection.addRange(range);
-      document.execCommand("insertText", false, promptText);
-    } catch (error) {
-      composer.innerHTML = "";
-      composer.textContent = promptText;
-      const inputEvent = new InputEvent("input", {
-        data: promptText,
-        bubbles: true,
-        composed: true,
-      });
-      composer.dispatchEvent(inputEvent);
-    }
   
-    await sleep(150);
-  
-    const sendButtonSelectors = [
-      'button[data-testid="composer-send-button"]',
-      'button[data-testid="send-button"]',
-      'button[aria-label*="Send"]',
-      'button[type="submit"]',
-      'button[class*="composer"]', // ChatGPT composer buttons
-      'button[class*="send"]',     // Any button with "send" in class
-      'form button:not([type="button"])', // Submit button in form
-      'button:not([type="button"])'       // Any button that's not explicitly type="button"
-    ];
+      timings.insert_ms = Math.round(performance.now() - insertStarted);
   
-    let sendButton = null;
-    for (const selector of sendButtonSelectors) {
-      sendButton = document.querySelector(selector);
-      if (sendButton) {
-        break;
-      }
-    }
+      const sendButtonSelectors = [
+        'button[data-testid="composer-send-button"]',
+        'button[data-testid="send-button"]',
+        'button[aria-label*="Send"]',
+        'button[type="submit"]',
+        'button[class*="composer"]', // ChatGPT composer buttons
+        'button[class*="send"]',     // Any button with "send" in class
+        'form button:not([type="button"])', // Submit button in form
+        'button:not([type="button"])'       // Any button that's not explicitly type="button"
+      ];
   
-    if (!sendButton) {
-      if (isAutomated) {
-        console.log("[AUTOMATED] ERROR: No send button found");
-        throw new Error("Prompt inserted, but no send button was found. Press Enter manually.");
+      const findSendButton = () => {
+        for (const selector of sendButtonSelectors) {
+          const button = document.querySelector(selector);
+          if (button) {
+            return button;
+          }
+        }
+        return null;
+      };
+  
+      // Wait until the composer has registered the text and enabled the send button
+      const sendButton = await timed("send_button", () => waitForCondition(() => {
+        const button = findSendButton();
+        return button && !button.disabled ? button : null;
+      }, timeouts.sendButton)) || findSendButton();
+  
+      if (!sendButton) {
+        if (isAutomated) {
+          console.log("[AUTOMATED] ERROR: No send button found");
+          throw jobError("send_button_missing", "Prompt inserted, but no send button was found. Press Enter manually.");
+        }
+        alert(
+          "Prompt inserted, but no send button was found. Press Enter manually."
+        );
+        return;
       }
-      alert(
-        "Prompt inserted, but no send button was found. Press Enter manually."
-      );
-      return;
-    }
 
-    if (isAutomated) {
-      console.log("[AUTOMATED] Send button found, clicking");
-    }
-    sendButton.click();
+      // Count the answers already on the page right before sending
+      assistantCountBefore = document.querySelectorAll(assistantSelector).length;
+
+      if (isAutomated) {
+        console.log("[AUTOMATED] Send button found, clicking");
+      }
+      sendButton.click();
   
-    showToast("Prompt sent! Waiting for response...", "info");
+      showToast("Prompt sent! Waiting for response...", "info");
     
-    // Add a delay before starting to monitor the submit button
-    await sleep(1000);
-  
-    const waitForResponseMarker = async () => {
-      let noStopButtonCount = 0;
-      const requiredNoStopButtonCount = 4; // Wait for 4 consecutive checks without stop button
-      
-      while (true) {
-        // Check for the stop button (square icon) - indicates still processing
-        const stopButton = document.querySelector('button[data-testid="stop-button"]');
-        
-        // If we still have the stop button, ChatGPT is still processing
-        if (stopButton) {
-          console.log("ChatGPT still processing - stop button detected");
-          noStopButtonCount = 0; // Reset counter
-          await sleep(250);
-          continue;
-        }
-        
-        // No stop button found - increment counter
-        noStopButtonCount++;
-        
-        if (noStopButtonCount >= requiredNoStopButtonCount) {
-          console.log(`ChatGPT finished processing - stop button absent for ${noStopButtonCount} checks`);
-          return true;
-        }
-        
-        // Check for the voice mode button (sound waves icon) as confirmation
-        const voiceButton = document.querySelector('button[data-testid="composer-speech-button"]');
-        if (voiceButton) {
-          console.log("ChatGPT finished processing - voice button detected");
-          return voiceButton;
+      // Wait until ChatGPT has accepted the prompt before monitoring for completion
+      const submitted = await timed("submit", () => waitForCondition(
+        () => detectThrottle()
+          || document.querySelector('button[data-testid="stop-button"]')
+          || (!document.contains(sendButton) && document.querySelector('[data-message-author-role="user"]')),
+        timeouts.submit,
+        timeouts.responseCheck
+      ));
+      if (submitted && submitted.throttled) {
+        return throttledResult(submitted);
+      }
+      if (!submitted && isAutomated) {
+        console.log(`[AUTOMATED] No sign of generation after ${timeouts.submit} ms, monitoring anyway`);
+      }
+
+      // Long-running jobs are handed back as soon as the conversation has a
+      // URL; the worker revisits the chat later with options.harvest
+      if (detach) {
+        const chatUrl = await timed("chat_url", () => waitForCondition(
+          () => (/\/c\/[\w-]+/.test(window.location.pathname) ? window.location.href : null),
+          timeouts.chatUrl
+        ));
+        if (chatUrl) {
+          if (isAutomated) {
+            console.log(`[AUTOMATED] Prompt submitted, detaching from ${chatUrl}`);
+          }
+          showToast("Prompt submitted, answer will be collected later", "info");
+          return {
+            detached: true,
+            prompt: promptText,
+            timings,
+            timestamp: new Date().toISOString(),
+            url: chatUrl,
+          };
         }
-        
         if (isAutomated) {
-          console.log(`Waiting for response completion (no stop button count: ${noStopButtonCount}/${requiredNoStopButtonCount})`);
+          console.log(`[AUTOMATED] No conversation URL after ${timeouts.chatUrl} ms, waiting for the answer instead`);
         }
-        
-        await sleep(250);
       }
+    }
+  
+    const getLastAssistantMessage = () => {
+      const messages = document.querySelectorAll(assistantSelector);
+      return messages.length > assistantCountBefore ? messages[messages.length - 1] : null;
     };
+    const isStreaming = () => Boolean(document.querySelector('button[data-testid="stop-button"]'));
   
-    const copyButton = await waitForResponseMarker();
-    
-    if (isAutomated) {
-      console.log("[AUTOMATED] Response detected, waiting for text to load");
-    }
+    // The new answer is complete once generation has stopped, its turn has
+    // rendered text and ChatGPT shows that turn's own action buttons (copy,
+    // feedback), which only appear after the answer finished streaming.
+    // Page-wide signals such as the composer's voice button are not enough:
+    // they can show up while the new turn is still partial.
+    const getCompletedMessage = () => {
+      if (isStreaming()) {
+        return null;
+      }
+      const message = getLastAssistantMessage();
+      if (!message) {
+        return null;
+      }
+      const turn = message.closest('article, [data-testid^="conversation-turn"]');
+      if (!turn || turn.querySelector(".result-streaming")) {
+        return null;
+      }
+      const content = message.querySelector(".markdown") || message;
+      if (!(content.textContent || "").trim()) {
+        return null;
+      }
+      const actions = turn.querySelector('button[data-testid="copy-turn-action-button"], button[aria-label*="Copy"]');
+      return actions ? message : null;
+    };
   
-    showToast("Response detected! Waiting for copy button...", "info");
-    await sleep(2000); // Increased wait time for response to fully render
+    // Resolve once `node` has gone quietMs without mutations, or after maxMs
+    const waitForQuiet = (node, quietMs, maxMs) => new Promise((resolve) => {
+      let quietTimer = null;
+      let maxTimer = null;
+      let observer = null;
+      const finish = () => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(maxTimer);
+        resolve();
+      };
+      observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(finish, quietMs);
+      });
+      observer.observe(node, { childList: true, subtree: true, characterData: true });
+      quietTimer = setTimeout(finish, quietMs);
+      maxTimer = setTimeout(finish, maxMs);
+    });
   
-    // Find and click the copy button to get the response text
-    const findAndClickCopyButton = async () => {
-      if (isAutomated) {
-        console.log("[AUTOMATED] Looking for copy button...");
+    // Convert the rendered answer back into the markdown the copy button produces
+    const renderInline = (node) => {
+      if (node.nodeType === Node.TEXT_NODE) {
+        return node.textContent;
       }
-      
-      for (let i = 0; i < 40; i += 1) {
-        // Try multiple selectors for the copy button
-        const copyButtonSelectors = [
-          'button[data-testid="copy-turn-action-button"]',  // Primary selector
-          'button[aria-label="Copy"]',                      // Fallback by aria-label
-          'button[aria-label*="Copy"]',                     // Partial match
-          'button:has(svg):not([data-testid="stop-button"])', // Button with SVG (but not stop button)
-        ];
+      if (node.nodeType !== Node.ELEMENT_NODE) {
+        return "";
+      }
+      const tag = node.tagName.toLowerCase();
+      const inner = Array.from(node.childNodes).map(renderInline).join("");
+      switch (tag) {
+        case "strong":
+        case "b":
+          return inner.trim() ? `**${inner}**` : inner;
+        case "em":
+        case "i":
+          return inner.trim() ? `*${inner}*` : inner;
+        case "code":
+          return `\`${node.textContent}\``;
+        case "a": {
+          const href = node.getAttribute("href") || "";
+          return /^https?:/.test(href) ? `[${inner.trim() || href}](${href})` : inner;
+        }
+        case "br":
+          return "\n";
+        case "button":
+        case "svg":
+        case "img":
+          return "";
+        default:
+          return inner;
+      }
+    };
+  
+    const blockTags = /^(P|H[1-6]|UL|OL|PRE|BLOCKQUOTE|TABLE|HR|DIV|SECTION)$/;
+  
+    const renderBlock = (node, indent = "") => {
+      if (node.nodeType === Node.TEXT_NODE) {
+        return node.textContent.trim() ? `${node.textContent.trim()}\n\n` : "";
+      }
+      if (node.nodeType !== Node.ELEMENT_NODE) {
+        return "";
+      }
+      const tag = node.tagName.toLowerCase();
+      if (/^h[1-6]$/.test(tag)) {
+        return `${"#".repeat(Number(tag[1]))} ${renderInline(node).trim()}\n\n`;
+      }
+      if (tag === "p") {
+        return `${indent}${renderInline(node).trim()}\n\n`;
+      }
+      if (tag === "hr") {
+        return "---\n\n";
+      }
+      if (tag === "pre") {
+        const code = node.querySelector("code") || node;
+        const language = ((code.className || "").match(/language-([\w+-]+)/) || [])[1] || "";
+        return `\`\`\`${language}\n${code.textContent.replace(/\n$/, "")}\n\`\`\`\n\n`;
+      }
+      if (tag === "blockquote") {
+        const body = Array.from(node.childNodes).map((child) => renderBlock(child)).join("").trim();
+        return `${body.split("\n").map((line) => `> ${line}`).join("\n")}\n\n`;
+      }
+      if (tag === "ul" || tag === "ol") {
+        let number = Number(node.getAttribute("start") || 1);
+        const items = Array.from(node.children).filter((child) => child.tagName === "LI").map((item) => {
+          const marker = tag === "ol" ? `${number++}.` : "-";
+          const body = Array.from(item.childNodes).map((child) => {
+            if (child.nodeType === Node.ELEMENT_NODE && /^(UL|OL|PRE)$/.test(child.tagName)) {
+              return `\n${renderBlock(child, `${indent}   `).trimEnd()}`;
+            }
+            if (child.nodeType === Node.ELEMENT_NODE && child.tagName === "P") {
+              return renderInline(child).trim();
+            }
+            return renderInline(child);
+          }).join("").trim();
+          return `${indent}${marker} ${body}`;
+        });
+        return `${items.join("\n")}\n\n`;
+      }
+      if (tag === "table") {
+        const rows = Array.from(node.querySelectorAll("tr")).map((row) =>
+          `| ${Array.from(row.children).map((cell) => renderInline(cell).trim().replace(/\|/g, "\\|")).join(" | ")} |`
+        );
+        if (rows.length > 0) {
+          const columns = node.querySelector("tr").children.length;
+          rows.splice(1, 0, `|${" --- |".repeat(columns)}`);
+        }
+        return `${rows.join("\n")}\n\n`;
+      }
+      if (tag === "button" || tag === "svg" || tag === "img") {
+        return "";
+      }
+      const children = Array.from(node.childNodes);
+      if (children.some((child) => child.nodeType === Node.ELEMENT_NODE && blockTags.test(child.tagName))) {
+        return children.map((child) => renderBlock(child, indent)).join("");
+      }
+      const text = renderInline(node).trim();
+      return text ? `${indent}${text}\n\n` : "";
+    };
+  
+    const domToMarkdown = (root) => renderBlock(root).replace(/\n{3,}/g, "\n\n").trim();
+  
+    // Cited pages are rendered as external links inside the answer
+    const extractSources = (root) => {
+      const sources = [];
+      const seen = new Set();
+      for (const link of root.querySelectorAll('a[href^="http"]')) {
+        const url = link.href;
+        if (seen.has(url)) {
+          continue;
+        }
+        seen.add(url);
+        sources.push({
+          number: sources.length + 1,
+          url,
+          title: (link.getAttribute("title") || link.textContent || url).trim(),
+        });
+      }
+      return sources;
+    };
+  
+    // Fallback: click the copy button and read the answer back from the clipboard
+    const readResponseFromClipboard = async () => {
+      const findAndClickCopyButton = async () => {
+        if (isAutomated) {
+          console.log("[AUTOMATED] Looking for copy button...");
+        }
         
-        for (const selector of copyButtonSelectors) {
-          const buttons = document.querySelectorAll(selector);
+        for (let i = 0; i < 40; i += 1) {
+          // Try multiple selectors for the copy button
+          const copyButtonSelectors = [
+            'button[data-testid="copy-turn-action-button"]',  // Primary selector
+            'button[aria-label="Copy"]',                      // Fallback by aria-label
+            'button[aria-label*="Copy"]',                     // Partial match
+            'button:has(svg):not([data-testid="stop-button"])', // Button with SVG (but not stop button)
+          ];
           
-          // Get the last (most recent) copy button
-          if (buttons.length > 0) {
-            const copyButton = buttons[buttons.length - 1];
-            
-            if (isAutomated) {
-              console.log(`[AUTOMATED] Found copy button using selector: ${selector}`);
-            }
-            
-            // Click the copy button
-            copyButton.click();
+          for (const selector of copyButtonSelectors) {
+            const buttons = document.querySelectorAll(selector);
             
-            if (isAutomated) {
-              console.log("[AUTOMATED] Copy button clicked, waiting for clipboard...");
+            // Get the last (most recent) copy button
+            if (buttons.length > 0) {
+              const copyButton = buttons[buttons.length - 1];
+              
+              if (isAutomated) {
+                console.log(`[AUTOMATED] Found copy button using selector: ${selector}`);
+              }
+              
+              // Click the copy button
+              copyButton.click();
+              
+              if (isAutomated) {
+                console.log("[AUTOMATED] Copy button clicked, waiting for clipboard...");
+              }
+              
+              // Wait for the clipboard operation to complete
+              await sleep(1500);
+              
+              return true;
             }
-            
-            // Wait for the clipboard operation to complete
-            await sleep(1500); // Increased wait time for clipboard to populate
-            
-            return true;
           }
+          
+          if (isAutomated && i % 5 === 0) {
+            console.log(`[AUTOMATED] Copy button not found yet... attempt ${i}/40`);
+          }
+          
+          await sleep(250);
         }
         
-        if (isAutomated && i % 5 === 0) {
-          console.log(`[AUTOMATED] Copy button not found yet... attempt ${i}/40`);
+        if (isAutomated) {
+          console.log("[AUTOMATED] ERROR: Copy button not found after waiting");
         }
-        
-        await sleep(250);
-      }
-      
-      if (isAutomated) {
-        console.log("[AUTOMATED] ERROR: Copy button not found after waiting");
-      }
-      return false;
-    };
-  
-    const copyButtonClicked = await findAndClickCopyButton();
+        return false;
+      };
     
-    if (!copyButtonClicked) {
-      if (isAutomated) {
-        console.log("[AUTOMATED] ERROR: Could not find copy button");
-        throw new Error("Could not find copy button to get response");
+      const copyButtonClicked = await findAndClickCopyButton();
+      
+      if (!copyButtonClicked) {
+        throw jobError("copy_button_missing", "Could not find copy button to get response");
       }
-      showToast("Could not find copy button", "error");
-      return;
-    }
-    
-    // Read from clipboard
-    let responseText = null;
-    try {
+      
       if (isAutomated) {
         console.log("[AUTOMATED] Reading from clipboard...");
       }
@@ -650,31 +1083,131 @@ javascript:(async () => {
       window.focus();
       await new Promise(resolve => setTimeout(resolve, 100)); // Brief delay to ensure focus takes effect
       
-      responseText = await navigator.clipboard.readText();
+      let text;
+      try {
+        text = await navigator.clipboard.readText();
+      } catch (error) {
+        throw jobError("clipboard_unreadable", `Failed to read clipboard: ${error.message}`);
+      }
       
-      if (isAutomated) {
-        console.log(`[AUTOMATED] Successfully read ${responseText.length} characters from clipboard`);
+      if (!text || text.trim().length === 0) {
+        if (isAutomated) {
+          console.log(`[AUTOMATED] ERROR: Clipboard is empty or contains only whitespace. Length: ${text ? text.length : 0}`);
+        }
+        throw jobError("empty_response", "Clipboard is empty or response text not found");
       }
-    } catch (error) {
+      
       if (isAutomated) {
-        console.log(`[AUTOMATED] ERROR: Failed to read clipboard: ${error.message}`);
-        throw new Error(`Failed to read clipboard: ${error.message}`);
+        console.log(`[AUTOMATED] Response text captured from clipboard (${text.length} characters)`);
       }
-      showToast(`Failed to read clipboard: ${error.message}`, "error");
-      return;
+      return text;
+    };
+  
+    // Forward the answer to the worker while it streams, through the CDP
+    // binding the worker registers. Each chunk carries the text appended since
+    // the last one, or the full text with reset=true if earlier text changed.
+    const startStreaming = () => {
+      const emit = window.__chatgptRelayChunk;
+      if (!(options && options.stream) || typeof emit !== "function") {
+        return () => {};
+      }
+      let sent = "";
+      let seq = 0;
+      let scheduled = null;
+      const flush = () => {
+        scheduled = null;
+        const message = getLastAssistantMessage();
+        if (!message) {
+          return;
+        }
+        const text = domToMarkdown(message.querySelector(".markdown") || message);
+        if (text === sent) {
+          return;
+        }
+        const chunk = text.startsWith(sent)
+          ? { seq, delta: text.slice(sent.length), reset: false }
+          : { seq, delta: text, reset: true };
+        seq += 1;
+        sent = text;
+        emit(JSON.stringify(chunk));
+      };
+      const observer = new MutationObserver(() => {
+        if (scheduled === null) {
+          scheduled = setTimeout(flush, timeouts.streamInterval);
+        }
+      });
+      observer.observe(document.documentElement, { childList: true, subtree: true, characterData: true });
+      return () => {
+        observer.disconnect();
+        clearTimeout(scheduled);
+      };
+    };
+  
+    const stopStreaming = startStreaming();
+    let responseMessage;
+    try {
+      responseMessage = await timed("response", () => waitForCondition(
+        () => getCompletedMessage() || (!harvest && detectThrottle()) || (pastDeadline() && { expired: true }),
+        // A quiet page triggers no re-check, so stop waiting at the deadline too
+        deadline === null ? timeouts.response : Math.min(timeouts.response, Math.max(0, deadline - Date.now())),
+        // The throttle scan covers the whole page; once per interval is plenty
+        // while every streamed token mutates the DOM
+        timeouts.responseCheck
+      ));
+    } finally {
+      stopStreaming();
     }
-    if (!responseText || responseText.trim().length === 0) {
+    if (responseMessage && responseMessage.throttled) {
+      return throttledResult(responseMessage);
+    }
+    if (responseMessage && responseMessage.expired) {
+      return expiredResult();
+    }
+    if (!responseMessage && harvest) {
+      // Still working on a detached job; the worker checks back later
+      return { pending: true, timings, url: window.location.href };
+    }
+    if (!responseMessage) {
       if (isAutomated) {
-        console.log(`[AUTOMATED] ERROR: Clipboard is empty or contains only whitespace. Length: ${responseText ? responseText.length : 0}, Trimmed: ${responseText ? responseText.trim().length : 0}`);
-        console.log(`[AUTOMATED] Clipboard content: "${responseText}"`);
-        throw new Error("Clipboard is empty or response text not found");
+        console.log(`[AUTOMATED] ERROR: No complete response within ${timeouts.response} ms`);
+        throw jobError("response_timeout", `Timed out after ${timeouts.response} ms waiting for ChatGPT to finish responding`);
       }
-      showToast("Clipboard is empty or response text not found", "warning");
+      showToast("Timed out waiting for the response", "error");
       return;
     }
     
     if (isAutomated) {
-      console.log(`[AUTOMATED] Response text captured from clipboard (${responseText.length} characters)`);
+      console.log("[AUTOMATED] Response complete, extracting it from the page");
+    }
+    showToast("Response detected! Extracting text...", "info");
+  
+    // Let the final render (code highlighting, citations) settle
+    await waitForQuiet(responseMessage, timeouts.renderQuiet, timeouts.renderSettle);
+  
+    let responseText = null;
+    let domSources = null;
+    await timed("extract", async () => {
+      const markdownRoot = responseMessage.querySelector(".markdown") || responseMessage;
+      responseText = domToMarkdown(markdownRoot);
+      domSources = extractSources(markdownRoot);
+      if (!responseText) {
+        if (isAutomated) {
+          console.log("[AUTOMATED] Answer not readable from the page, falling back to the clipboard");
+        }
+        domSources = null;
+        try {
+          responseText = await readResponseFromClipboard();
+        } catch (error) {
+          if (isAutomated) {
+            console.log(`[AUTOMATED] ERROR: ${error.message}`);
+            throw error;
+          }
+          showToast(error.message, "error");
+        }
+      }
+    });
+    if (!responseText) {
+      return;
     }
     
     // Parse sources from the response if present
@@ -733,31 +1266,49 @@ javascript:(async () => {
       !responseText.includes("async()=>{") &&
       !responseText.includes("const sleep=")
     ) {
-      // Parse response and sources separately
-      const parsed = parseSourcesFromResponse(responseText);
+      // Parse response and sources separately (the clipboard text carries its
+      // sources as a trailing reference list)
+      const parsed = domSources !== null
+        ? { content: responseText, sources: domSources }
+        : parseSourcesFromResponse(responseText);
       
       const responsePayload = {
         prompt: promptText, // Store original prompt without markdown instruction
         response: parsed.content,
         sources: parsed.sources.length > 0 ? parsed.sources : null,
+        timings,
         timestamp: new Date().toISOString(),
         url: window.location.href,
       };
   
       await sendToApi(responsePayload);
   
+      if (options !== null) {
+        // Worker jobs get the answer back from the run itself; keeping a copy
+        // in localStorage would only fill it up, job after job
+        showToast("Response captured", "success");
+        console.log("[AUTOMATED] SUCCESS: Response captured");
+        return responsePayload;
+      }
+
       const timestamp = new Date().toISOString().replace(/[:.]/g, "-");
       const filename = `chatgpt-response-${timestamp}.json`;
       const jsonData = JSON.stringify(responsePayload, null, 2);
   
-      localStorage.setItem(filename, jsonData);
-      const existingFiles = JSON.parse(
-        localStorage.getItem("chatgpt-files") || "[]"
-      );
-      existingFiles.push(filename);
-      localStorage.setItem("chatgpt-files", JSON.stringify(existingFiles));
+      try {
+        localStorage.setItem(filename, jsonData);
+        const existingFiles = JSON.parse(
+          localStorage.getItem("chatgpt-files") || "[]"
+        );
+        existingFiles.push(filename);
+        localStorage.setItem("chatgpt-files", JSON.stringify(existingFiles));
+      } catch (error) {
+        // Storage full (QuotaExceededError): the answer was already sent
+        console.warn(`Could not save ${filename} to localStorage:`, error);
+        showToast("Response sent, but localStorage is full", "warning");
+        return responsePayload;
+      }
   
-      // For automated worker usage, just show a brief success message
       showToast(`Response saved as ${filename}`, "success");
       
       // Log completion for worker detection
@@ -765,8 +1316,12 @@ javascript:(async () => {
         console.log(`[AUTOMATED] SUCCESS: Response saved as ${filename}`);
       }
       console.log(`ChatGPT bookmarklet completed: ${filename}`);
+      return responsePayload;
     } else {
+      if (isAutomated) {
+        throw jobError("empty_response", "No valid response text found");
+      }
       showToast("No valid response text found", "warning");
     }
-  })();
+  });
 
@@ -10,7 +10,7 @@ import argparse
 import json
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 try:
     import requests
@@ -91,7 +91,13 @@ def choose_target(targets: List[Target], args: argparse.Namespace) -> Target:
         print(f"Index must be between 0 and {len(matches) - 1}.")
 
 
-def call_cdp(ws: websocket.WebSocket, method: str, params: Dict[str, Any] | None, message_id: int) -> Dict[str, Any]:
+def call_cdp(
+    ws: websocket.WebSocket,
+    method: str,
+    params: Dict[str, Any] | None,
+    message_id: int,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
     payload: Dict[str, Any] = {"id": message_id, "method": method}
     if params:
         payload["params"] = params
@@ -99,6 +105,9 @@ def call_cdp(ws: websocket.WebSocket, method: str, params: Dict[str, Any] | None
     while True:
         raw = ws.recv()
         data = json.loads(raw)
+        if on_event is not None and "method" in data and "id" not in data:
+            on_event(data)
+            continue
         if data.get("id") != message_id:
             continue
         if "error" in data:
@@ -0,0 +1,167 @@
+"""
+Admission control for new requests
+
+The fleet drains the queue at a rate limited by browser time, so accepting
+everything lets the queue (and every client's wait) grow without bound. The
+server tracks the pending depth and the recent drain rate per prompt mode,
+estimates when a new request would start, and turns new work away with 429
+and a Retry-After once that wait passes the configured limit. A queue that
+has work waiting but finished nothing within the rate window is stalled and
+turns new work away too.
+"""
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from . import database_supabase as database
+
+# Key for requests without a prompt mode
+DEFAULT_MODE = "default"
+
+
+def _parse_limits(value: str) -> Dict[str, float]:
+    """Parse ADMISSION_MAX_WAIT_BY_MODE, e.g. '{"deep": 14400}'."""
+    if not value:
+        return {}
+    limits = json.loads(value)
+    return {str(mode): float(seconds) for mode, seconds in limits.items()}
+
+
+# Longest estimated wait (seconds) a new request may face before it is
+# rejected; 0 disables admission control. Per-mode limits override it.
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "0"))
+ADMISSION_MAX_WAIT_BY_MODE = _parse_limits(os.getenv("ADMISSION_MAX_WAIT_BY_MODE", ""))
+# Window the drain rate is measured over
+ADMISSION_RATE_WINDOW_MINUTES = float(os.getenv("ADMISSION_RATE_WINDOW_MINUTES", "15"))
+
+
+class QueueFull(Exception):
+    """The estimated wait for a new request is over the limit, or the queue is stalled (wait_seconds None)."""
+
+    def __init__(self, mode: str, wait_seconds: Optional[float], retry_after: int) -> None:
+        if wait_seconds is None:
+            message = f"Queue for {mode} requests has work waiting but finished nothing recently"
+        else:
+            message = f"Queue for {mode} requests is about {wait_seconds / 60:.0f} minutes behind"
+        super().__init__(message)
+        self.mode = mode
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+
+
+@dataclass
+class QueueEstimate:
+    mode: str
+    pending: int
+    # Requests finished per minute over the rate window
+    drain_rate: float
+    # "mode" when the rate is this mode's own; "fleet" when the mode has no
+    # recent history and the estimate uses all pending work and the whole
+    # fleet's rate instead
+    rate_scope: str
+    # Seconds until a request queued now would start; None without drain history
+    wait_seconds: Optional[float]
+    max_wait_seconds: Optional[float]
+
+
+class AdmissionController:
+    """Estimates queue wait per prompt mode and decides whether to take new work."""
+
+    def __init__(
+        self,
+        max_wait: float,
+        max_wait_by_mode: Dict[str, float],
+        window_minutes: float,
+        cache_seconds: float = 5.0,
+    ) -> None:
+        self.max_wait = max_wait
+        self.max_wait_by_mode = max_wait_by_mode
+        self.window = timedelta(minutes=window_minutes)
+        # Stats are re-read at most this often; requests admitted in between
+        # are counted locally so a burst cannot slip through a stale snapshot
+        self.cache_seconds = cache_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Tuple[float, Dict[str, int], Dict[str, int]]] = None
+
+    def limit(self, mode: str) -> Optional[float]:
+        limit = self.max_wait_by_mode.get(mode, self.max_wait)
+        return limit if limit > 0 else None
+
+    def estimate(self, prompt_mode: Optional[str]) -> QueueEstimate:
+        mode = prompt_mode or DEFAULT_MODE
+        pending, finished = self._refresh()
+        window_seconds = self.window.total_seconds()
+        depth = pending.get(mode, 0)
+        rate = finished.get(mode, 0) / window_seconds
+        scope = "mode"
+        queued = depth
+        if rate == 0:
+            # No recent history for this mode: the fleet's overall pace only
+            # says something about the whole queue, so estimate against all
+            # pending work (an upper bound for this mode)
+            rate = sum(finished.values()) / window_seconds
+            scope = "fleet"
+            queued = sum(pending.values())
+        return QueueEstimate(
+            mode=mode,
+            pending=depth,
+            drain_rate=rate * 60,
+            rate_scope=scope,
+            wait_seconds=queued / rate if rate > 0 else None,
+            max_wait_seconds=self.limit(mode),
+        )
+
+    def admit(self, prompt_mode: Optional[str]) -> Optional[datetime]:
+        """
+        Take a new request or raise QueueFull.
+
+        Returns the estimated start time (UTC), or None when there is no
+        recent drain history to estimate from. With a limit configured, a
+        queue that has work pending but finished nothing within the rate
+        window is stalled and rejects new work for about a window.
+        """
+        estimate = self.estimate(prompt_mode)
+        wait = estimate.wait_seconds
+        if estimate.max_wait_seconds is not None:
+            if wait is None and estimate.pending > 0:
+                raise QueueFull(estimate.mode, None, max(1, math.ceil(self.window.total_seconds())))
+            if wait is not None and wait > estimate.max_wait_seconds:
+                # Come back once the queue has drained below the limit
+                retry_after = max(1, math.ceil(wait - estimate.max_wait_seconds))
+                raise QueueFull(estimate.mode, wait, retry_after)
+        with self._lock:
+            if self._snapshot is not None:
+                pending = self._snapshot[1]
+                pending[estimate.mode] = pending.get(estimate.mode, 0) + 1
+        return datetime.utcnow() + timedelta(seconds=wait) if wait is not None else None
+
+    def estimates(self) -> Dict[str, QueueEstimate]:
+        """Estimates for every mode with pending or recently finished work."""
+        pending, finished = self._refresh()
+        return {mode: self.estimate(None if mode == DEFAULT_MODE else mode) for mode in {*pending, *finished}}
+
+    def _refresh(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._snapshot[0] > self.cache_seconds:
+                pending: Dict[str, int] = {}
+                finished: Dict[str, int] = {}
+                for row in database.get_queue_stats(datetime.utcnow() - self.window):
+                    mode = row.get("prompt_mode") or DEFAULT_MODE
+                    pending[mode] = row["pending"]
+                    finished[mode] = row["finished"]
+                self._snapshot = (now, pending, finished)
+            return self._snapshot[1], self._snapshot[2]
+
+
+# Process-wide controller used by the create endpoint
+controller = AdmissionController(
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_MAX_WAIT_BY_MODE,
+    ADMISSION_RATE_WINDOW_MINUTES,
+)
@@ -3,8 +3,8 @@ Supabase-based database implementation using REST API
 This is a modern alternative to direct PostgreSQL connections
 """
 import os
-from dataclasses import asdict, dataclass
-from typing import Any, Dict, Optional
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, List, Optional
 from supabase import create_client, Client
 from datetime import datetime
 
@@ -34,6 +34,7 @@ class RequestRecord:
     response: Optional[str]
     error: Optional[str]
     worker_id: Optional[str]
+    account: Optional[str]
     webhook_url: Optional[str]
     webhook_delivered: bool
     prompt_mode: Optional[str]
@@ -41,6 +42,12 @@ class RequestRecord:
     image_url: Optional[str]
     chat_url: Optional[str]
     follow_up_chat_url: Optional[str]
+    deadline_at: Optional[str]
+    cancel_requested: bool
+    attempts: int
+    max_attempts: int
+    retry_at: Optional[str]
+    failed_worker_id: Optional[str]
     created_at: str
     updated_at: str
 
@@ -54,6 +61,7 @@ def _row_to_record(row: Dict[str, Any]) -> RequestRecord:
         response=row.get('response'),
         error=row.get('error'),
         worker_id=row.get('worker_id'),
+        account=row.get('account'),
         webhook_url=row.get('webhook_url'),
         webhook_delivered=row.get('webhook_delivered', False),
         prompt_mode=row.get('prompt_mode'),
@@ -61,11 +69,72 @@ def _row_to_record(row: Dict[str, Any]) -> RequestRecord:
         image_url=row.get('image_url'),
         chat_url=row.get('chat_url'),
         follow_up_chat_url=row.get('follow_up_chat_url'),
+        deadline_at=row.get('deadline_at'),
+        cancel_requested=row.get('cancel_requested', False),
+        attempts=row.get('attempts', 0),
+        max_attempts=row.get('max_attempts', 1),
+        retry_at=row.get('retry_at'),
+        failed_worker_id=row.get('failed_worker_id'),
         created_at=row['created_at'],
         updated_at=row['updated_at'],
     )
 
 
+# Columns a client may ask for when reading requests in bulk: the fields of
+# the API's RequestResponse, leaving out bookkeeping such as failed_worker_id
+INTERNAL_REQUEST_FIELDS = ("failed_worker_id",)
+REQUEST_FIELDS = tuple(field.name for field in fields(RequestRecord) if field.name not in INTERNAL_REQUEST_FIELDS)
+
+# IDs per query when reading by ID; keeps the PostgREST URL short
+IDS_PER_QUERY = 200
+
+
+@dataclass
+class WorkerRecord:
+    worker_id: str
+    account: str
+    model_modes: List[str]
+    prompt_modes: List[str]
+    last_idle_at: Optional[str]
+
+
+def _row_to_worker(row: Dict[str, Any]) -> WorkerRecord:
+    """Convert Supabase row to WorkerRecord"""
+    return WorkerRecord(
+        worker_id=row['worker_id'],
+        account=row['account'],
+        model_modes=row.get('model_modes') or [],
+        prompt_modes=row.get('prompt_modes') or [],
+        last_idle_at=row.get('last_idle_at'),
+    )
+
+
+@dataclass
+class OutboxRecord:
+    id: int
+    request_id: int
+    webhook_url: str
+    payload: Dict[str, Any]
+    status: str
+    attempts: int
+    next_attempt_at: str
+    last_error: Optional[str]
+
+
+def _row_to_outbox(row: Dict[str, Any]) -> OutboxRecord:
+    """Convert Supabase row to OutboxRecord"""
+    return OutboxRecord(
+        id=row['id'],
+        request_id=row['request_id'],
+        webhook_url=row['webhook_url'],
+        payload=row['payload'],
+        status=row['status'],
+        attempts=row['attempts'],
+        next_attempt_at=row['next_attempt_at'],
+        last_error=row.get('last_error'),
+    )
+
+
 def init_db() -> None:
     """
     Initialize database schema
@@ -90,7 +159,9 @@ def create_request(
     prompt_mode: Optional[str] = None, 
     model_mode: Optional[str] = None,
     image_url: Optional[str] = None,
-    follow_up_chat_url: Optional[str] = None
+    follow_up_chat_url: Optional[str] = None,
+    deadline_at: Optional[datetime] = None,
+    max_attempts: Optional[int] = None
 ) -> RequestRecord:
     """Create a new request"""
     supabase = get_supabase()
@@ -105,6 +176,10 @@ def create_request(
         'follow_up_chat_url': follow_up_chat_url,
         'webhook_delivered': False
     }
+    if deadline_at is not None:
+        data['deadline_at'] = deadline_at.isoformat()
+    if max_attempts is not None:
+        data['max_attempts'] = max_attempts
     
     result = supabase.table('requests').insert(data).execute()
     return _row_to_record(result.data[0])
@@ -122,39 +197,176 @@ def get_request(request_id: int) -> RequestRecord:
     return _row_to_record(result.data[0])
 
 
-def claim_next_request(worker_id: str) -> Optional[RequestRecord]:
-    """Claim the next pending request"""
+def get_requests(request_ids: List[int], columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Rows of the given requests, limited to `columns` (default: every record field)"""
     supabase = get_supabase()
     
-    # Get oldest pending request
-    result = supabase.table('requests')\
-        .select('*')\
-        .eq('status', 'pending')\
-        .order('created_at')\
-        .limit(1)\
-        .execute()
+    select = ','.join(columns or REQUEST_FIELDS)
+    rows: List[Dict[str, Any]] = []
+    for start in range(0, len(request_ids), IDS_PER_QUERY):
+        result = supabase.table('requests')\
+            .select(select)\
+            .in_('id', request_ids[start:start + IDS_PER_QUERY])\
+            .execute()
+        rows.extend(result.data or [])
+    
+    return rows
+
+
+def claim_next_request(
+    worker_id: str,
+    exclude_prompt_modes: Optional[List[str]] = None,
+    model_modes: Optional[List[str]] = None,
+    prompt_modes: Optional[List[str]] = None,
+    account: Optional[str] = None,
+    prefer_prompt_modes: Optional[List[str]] = None,
+    detach_modes: Optional[List[str]] = None,
+    max_detached: Optional[int] = None,
+) -> Optional[RequestRecord]:
+    """
+    Claim the next pending request, optionally skipping some prompt modes.
+
+    `model_modes` and `prompt_modes` restrict the claim to what the worker's
+    account can serve right now (a missing model mode counts as "auto"; requests
+    without a prompt mode are always allowed). The claim is logged against
+    `account` for usage tracking. With `prefer_prompt_modes`, the oldest request
+    in one of those modes is taken ahead of older requests in other modes.
+    With `detach_modes` and `max_detached`, requests in those modes are skipped
+    once `account` (or the worker, if it has no account) has `max_detached`
+    processing requests with a chat_url, i.e. detached jobs.
+
+    Runs as one database function: pending requests past their deadline are
+    expired first, and concurrent claims never return the same request.
+    """
+    if model_modes is not None and not model_modes:
+        return None
+    supabase = get_supabase()
+    
+    params = {
+        'p_worker_id': worker_id,
+        'p_exclude_prompt_modes': exclude_prompt_modes or None,
+        'p_model_modes': model_modes,
+        'p_prompt_modes': prompt_modes,
+        'p_prefer_prompt_modes': prefer_prompt_modes or None,
+        'p_account': account,
+    }
+    if detach_modes and max_detached is not None:
+        # Only sent when used, so the call works before supabase_migration_add_detached_cap.sql
+        params['p_detach_modes'] = detach_modes
+        params['p_max_detached'] = max_detached
+    
+    result = supabase.rpc('claim_next_request', params).execute()
     
     if not result.data:
         return None
     
-    request = result.data[0]
-    request_id = request['id']
+    return _row_to_record(result.data[0])
+
+
+def register_worker(worker_id: str, account: str, model_modes: List[str], prompt_modes: List[str]) -> WorkerRecord:
+    """Create or update a worker's account and capabilities"""
+    supabase = get_supabase()
     
-    # Update to processing
-    update_result = supabase.table('requests')\
-        .update({
-            'status': 'processing',
-            'worker_id': worker_id,
-            'updated_at': datetime.utcnow().isoformat()
-        })\
-        .eq('id', request_id)\
+    result = supabase.table('workers').upsert({
+        'worker_id': worker_id,
+        'account': account,
+        'model_modes': model_modes,
+        'prompt_modes': prompt_modes,
+        'registered_at': datetime.utcnow().isoformat(),
+        'last_idle_at': None,
+    }).execute()
+    
+    return _row_to_worker(result.data[0])
+
+
+def get_worker(worker_id: str) -> Optional[WorkerRecord]:
+    """Get a registered worker, or None if it never registered"""
+    supabase = get_supabase()
+    
+    result = supabase.table('workers').select('*').eq('worker_id', worker_id).execute()
+    
+    return _row_to_worker(result.data[0]) if result.data else None
+
+
+def get_workers() -> List[WorkerRecord]:
+    """Get all registered workers"""
+    supabase = get_supabase()
+    
+    result = supabase.table('workers').select('*').execute()
+    return [_row_to_worker(row) for row in result.data]
+
+
+def get_idle_workers(since: datetime) -> List[WorkerRecord]:
+    """Get workers that polled without getting work since `since`"""
+    supabase = get_supabase()
+    
+    result = supabase.table('workers').select('*').gte('last_idle_at', since.isoformat()).execute()
+    return [_row_to_worker(row) for row in result.data]
+
+
+def set_worker_idle(worker_id: str, idle: bool) -> None:
+    """Mark a worker as waiting for work (or busy again)"""
+    supabase = get_supabase()
+    
+    supabase.table('workers')\
+        .update({'last_idle_at': datetime.utcnow().isoformat() if idle else None})\
+        .eq('worker_id', worker_id)\
         .execute()
+
+
+def get_account_usage(since: datetime) -> List[Dict[str, Any]]:
+    """Claims per account, model mode and prompt mode since `since`"""
+    supabase = get_supabase()
     
-    return _row_to_record(update_result.data[0])
+    result = supabase.rpc('account_usage', {'since': since.isoformat()}).execute()
+    return result.data or []
 
 
-def complete_request(request_id: int, response: str, chat_url: Optional[str] = None) -> RequestRecord:
-    """Mark a request as completed"""
+def cleanup_account_claims(older_than: datetime) -> int:
+    """Drop claim log entries that have left every usage window"""
+    supabase = get_supabase()
+    
+    result = supabase.table('account_claims')\
+        .delete()\
+        .lt('claimed_at', older_than.isoformat())\
+        .execute()
+    
+    return len(result.data) if result.data else 0
+
+
+def get_queue_stats(since: datetime) -> List[Dict[str, Any]]:
+    """Pending requests and requests finished since `since`, per prompt mode"""
+    supabase = get_supabase()
+    
+    result = supabase.rpc('queue_stats', {'since': since.isoformat()}).execute()
+    return result.data or []
+
+
+def cleanup_request_completions(older_than: datetime) -> int:
+    """Drop completion log entries that have left the drain-rate window"""
+    supabase = get_supabase()
+    
+    result = supabase.table('request_completions')\
+        .delete()\
+        .lt('finished_at', older_than.isoformat())\
+        .execute()
+    
+    return len(result.data) if result.data else 0
+
+
+def complete_request(
+    request_id: int,
+    response: str,
+    chat_url: Optional[str] = None,
+    worker_id: Optional[str] = None,
+) -> Optional[RequestRecord]:
+    """
+    Mark a processing request as completed.
+
+    With `worker_id`, only that worker's attempt is completed. Returns None
+    when the request is no longer processing (by that worker): it finished,
+    went back to the queue for a retry, or another worker claimed it since.
+    """
     supabase = get_supabase()
     
     update_data = {
@@ -168,9 +380,51 @@ def complete_request(request_id: int, response: str, chat_url: Optional[str] = N
     if chat_url:
         update_data['chat_url'] = chat_url
     
-    result = supabase.table('requests')\
+    query = supabase.table('requests')\
         .update(update_data)\
         .eq('id', request_id)\
+        .eq('status', 'processing')
+    if worker_id is not None:
+        query = query.eq('worker_id', worker_id)
+    result = query.execute()
+    
+    if not result.data:
+        # Raises KeyError if the request does not exist at all
+        get_request(request_id)
+        return None
+    
+    return _row_to_record(result.data[0])
+
+
+def report_results(results: List[Dict[str, Any]], retry_delay_seconds: float) -> List[RequestRecord]:
+    """
+    Apply a batch of worker reports in one call, in order.
+
+    Each report has `id`, `worker_id`, `status` and optionally `response`,
+    `chat_url` and `error`. A report only applies while the request is still
+    processing by `worker_id`; a retry waits `retry_delay_seconds` as in
+    fail_attempt. The updated requests are returned.
+    """
+    supabase = get_supabase()
+    
+    result = supabase.rpc('report_results', {
+        'p_results': results,
+        'p_retry_delay_seconds': retry_delay_seconds,
+    }).execute()
+    
+    return [_row_to_record(row) for row in result.data or []]
+
+
+def set_chat_url(request_id: int, chat_url: str) -> RequestRecord:
+    """Record the conversation URL of a request that is still processing"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .update({
+            'chat_url': chat_url,
+            'updated_at': datetime.utcnow().isoformat()
+        })\
+        .eq('id', request_id)\
         .execute()
     
     if not result.data:
@@ -179,6 +433,99 @@ def complete_request(request_id: int, response: str, chat_url: Optional[str] = N
     return _row_to_record(result.data[0])
 
 
+def requeue_request(request_id: int) -> RequestRecord:
+    """Put a processing request back in the queue without counting it as failed"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .update({
+            'status': 'pending',
+            'worker_id': None,
+            'updated_at': datetime.utcnow().isoformat()
+        })\
+        .eq('id', request_id)\
+        .eq('status', 'processing')\
+        .execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found or not processing")
+    
+    return _row_to_record(result.data[0])
+
+
+def expire_request(request_id: int, error: str) -> RequestRecord:
+    """Give up on a processing request whose deadline passed while it ran"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .update({
+            'status': 'expired',
+            'error': error,
+            'updated_at': datetime.utcnow().isoformat()
+        })\
+        .eq('id', request_id)\
+        .eq('status', 'processing')\
+        .execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found or not processing")
+    
+    return _row_to_record(result.data[0])
+
+
+def cancel_request(request_id: int) -> RequestRecord:
+    """
+    Cancel a request on behalf of the client.
+
+    A pending request becomes cancelled right away; a processing one is
+    flagged with cancel_requested for its worker to act on. Finished
+    requests come back unchanged.
+    """
+    supabase = get_supabase()
+    
+    result = supabase.rpc('cancel_request', {'p_request_id': request_id}).execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found")
+    
+    return _row_to_record(result.data[0])
+
+
+def get_request_state(request_id: int) -> Dict[str, Any]:
+    """Status and cancel flag of a request, without its prompt and response"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .select('id,status,worker_id,cancel_requested')\
+        .eq('id', request_id)\
+        .execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found")
+    
+    return result.data[0]
+
+
+def mark_cancelled(request_id: int) -> RequestRecord:
+    """Confirm that the worker stopped a processing request it was asked to cancel"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .update({
+            'status': 'cancelled',
+            'error': 'Cancelled by the client',
+            'updated_at': datetime.utcnow().isoformat()
+        })\
+        .eq('id', request_id)\
+        .eq('status', 'processing')\
+        .execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found or not processing")
+    
+    return _row_to_record(result.data[0])
+
+
 def fail_request(request_id: int, error: str) -> RequestRecord:
     """Mark a request as failed"""
     supabase = get_supabase()
@@ -198,6 +545,29 @@ def fail_request(request_id: int, error: str) -> RequestRecord:
     return _row_to_record(result.data[0])
 
 
+def fail_attempt(request_id: int, error: str, retryable: bool, delay_seconds: float) -> RequestRecord:
+    """
+    Record a failed attempt of a processing request.
+
+    A retryable failure with attempts left returns the request to pending,
+    to be claimed again after `delay_seconds`, doubled for each earlier failed
+    attempt; otherwise the request fails for good.
+    """
+    supabase = get_supabase()
+    
+    result = supabase.rpc('fail_attempt', {
+        'p_request_id': request_id,
+        'p_error': error,
+        'p_retryable': retryable,
+        'p_delay_seconds': delay_seconds,
+    }).execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found or not processing")
+    
+    return _row_to_record(result.data[0])
+
+
 def mark_webhook_delivered(request_id: int) -> None:
     """Mark webhook as delivered"""
     supabase = get_supabase()
@@ -211,6 +581,115 @@ def mark_webhook_delivered(request_id: int) -> None:
         .execute()
 
 
+def claim_webhook_deliveries(batch_size: int, lease_seconds: int) -> List[OutboxRecord]:
+    """Lease up to `batch_size` due webhook deliveries from the outbox"""
+    supabase = get_supabase()
+    
+    result = supabase.rpc('claim_webhook_outbox', {
+        'batch_size': batch_size,
+        'lease_seconds': lease_seconds,
+    }).execute()
+    return [_row_to_outbox(row) for row in result.data or []]
+
+
+def mark_webhook_outbox_delivered(entries: List[OutboxRecord]) -> None:
+    """Close outbox entries after a successful delivery, in one update per table"""
+    supabase = get_supabase()
+    
+    supabase.table('webhook_outbox')\
+        .update({'status': 'delivered', 'locked_until': None, 'last_error': None})\
+        .in_('id', [entry.id for entry in entries])\
+        .execute()
+    supabase.table('requests')\
+        .update({
+            'webhook_delivered': True,
+            'updated_at': datetime.utcnow().isoformat()
+        })\
+        .in_('id', [entry.request_id for entry in entries])\
+        .execute()
+
+
+def reschedule_webhook_deliveries(outbox_ids: List[int], next_attempt_at: datetime, error: str) -> None:
+    """Put failed deliveries back in the outbox for a later attempt"""
+    supabase = get_supabase()
+    
+    supabase.table('webhook_outbox')\
+        .update({
+            'status': 'pending',
+            'next_attempt_at': next_attempt_at.isoformat(),
+            'locked_until': None,
+            'last_error': error,
+        })\
+        .in_('id', outbox_ids)\
+        .execute()
+
+
+def dead_letter_webhooks(outbox_ids: List[int], error: str) -> None:
+    """Stop retrying deliveries until they are replayed"""
+    supabase = get_supabase()
+    
+    supabase.table('webhook_outbox')\
+        .update({'status': 'dead', 'locked_until': None, 'last_error': error})\
+        .in_('id', outbox_ids)\
+        .execute()
+
+
+def replay_webhooks(request_ids: Optional[List[int]] = None) -> int:
+    """Requeue dead-lettered deliveries (all, or those of `request_ids`) for immediate delivery"""
+    supabase = get_supabase()
+    
+    query = supabase.table('webhook_outbox')\
+        .update({
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': datetime.utcnow().isoformat(),
+            'last_error': None,
+        })\
+        .eq('status', 'dead')
+    if request_ids:
+        query = query.in_('request_id', request_ids)
+    result = query.execute()
+    
+    return len(result.data) if result.data else 0
+
+
+def cleanup_webhook_outbox(older_than: datetime) -> int:
+    """Drop delivered outbox entries; dead letters stay until replayed"""
+    supabase = get_supabase()
+    
+    result = supabase.table('webhook_outbox')\
+        .delete()\
+        .eq('status', 'delivered')\
+        .lt('updated_at', older_than.isoformat())\
+        .execute()
+    
+    return len(result.data) if result.data else 0
+
+
+def take_request(request_id: int) -> RequestRecord:
+    """Delete a request and return it as it was, in one round trip"""
+    supabase = get_supabase()
+    
+    result = supabase.table('requests')\
+        .delete()\
+        .eq('id', request_id)\
+        .execute()
+    
+    if not result.data:
+        raise KeyError(f"Request {request_id} not found")
+    
+    return _row_to_record(result.data[0])
+
+
+def ack_requests(request_ids: List[int]) -> List[RequestRecord]:
+    """Delete the finished requests among `request_ids` and return them"""
+    supabase = get_supabase()
+    
+    result = supabase.rpc('ack_requests', {'p_ids': request_ids}).execute()
+    
+    return [_row_to_record(row) for row in result.data or []]
+
+
 def delete_request(request_id: int) -> bool:
     """Delete a request"""
     supabase = get_supabase()
@@ -231,10 +710,10 @@ def cleanup_old_requests(retention_hours: int = 24) -> int:
     from datetime import timedelta
     cutoff = (datetime.utcnow() - timedelta(hours=retention_hours)).isoformat()
     
-    # Delete old completed/failed requests
+    # Delete old finished requests
     result = supabase.table('requests')\
         .delete()\
-        .in_('status', ['completed', 'failed'])\
+        .in_('status', ['completed', 'failed', 'expired', 'cancelled'])\
         .lt('updated_at', cutoff)\
         .execute()
     
@@ -286,6 +765,9 @@ def get_stats():
 
 
 def serialize(record: RequestRecord) -> Dict[str, Any]:
-    """Serialize RequestRecord to dict"""
-    return asdict(record)
+    """Serialize RequestRecord to dict, as clients see it"""
+    row = asdict(record)
+    for name in INTERNAL_REQUEST_FIELDS:
+        del row[name]
+    return row
 
@@ -0,0 +1,189 @@
+"""
+Cross-process request events over Postgres LISTEN/NOTIFY
+
+With several uvicorn workers or server replicas, in-process wake-ups only
+reach the process that made a change. When DATABASE_URL is set (a session
+mode connection: the transaction pooler does not support LISTEN), every
+process listens on two channels:
+
+- `request_events`: lifecycle events (created, claimed, requeued, completed,
+  failed, expired, cancelled, deleted) raised by a trigger on the requests table, see
+  supabase_migration_add_request_events.sql. They finish local answer
+  streams and wake the local webhook dispatcher.
+- `request_stream`: partial answers, so a stream reader connected to one
+  process receives chunks that a worker posted to another.
+
+The listening connection also competes for an advisory lock; the process
+holding it is the leader and runs housekeeping such as periodic cleanup.
+Without DATABASE_URL everything stays in-process and every process leads.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from . import database_supabase as database
+from . import streaming
+from . import webhook
+
+try:
+    import psycopg
+    PSYCOPG_AVAILABLE = True
+except ImportError:
+    PSYCOPG_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+EVENTS_CHANNEL = "request_events"
+STREAM_CHANNEL = "request_stream"
+# Arbitrary key of the advisory lock that elects the housekeeping leader
+LEADER_LOCK_KEY = 7243001
+# Followers retry the leader lock this often, so a new leader takes over
+# soon after the old one's connection goes away
+LEADER_RETRY_SECONDS = 30.0
+RECONNECT_SECONDS = 5.0
+# NOTIFY payloads are capped at 8000 bytes; longer deltas are split into
+# pieces of at most this many characters
+NOTIFY_CHUNK_CHARS = 1000
+
+
+class EventBus:
+    """Publishes and receives request events through Postgres notifications."""
+
+    def __init__(self, dsn: Optional[str]) -> None:
+        self.dsn = dsn
+        self.connected = False
+        self._leader = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional["asyncio.Queue[str]"] = None
+        self._tasks: List[asyncio.Task] = []
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.dsn) and PSYCOPG_AVAILABLE
+
+    async def start(self) -> None:
+        """Connect and start listening; must run on the server's event loop."""
+        if not self.dsn:
+            return
+        if not PSYCOPG_AVAILABLE:
+            logger.warning("DATABASE_URL is set but psycopg is not installed; events stay in-process")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._publish())]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def is_leader(self) -> bool:
+        """Whether this process should run housekeeping."""
+        return self._leader if self.enabled else True
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Call `listener` (on the event loop) with every lifecycle event."""
+        self._listeners.append(listener)
+
+    def publish_chunk(self, request_id: int, delta: str, reset: bool = False) -> None:
+        """Forward a partial answer to stream readers in every process. Thread-safe."""
+        if not self.connected:
+            streaming.hub.publish_chunk(request_id, delta, reset)
+            return
+        pieces = [delta[start:start + NOTIFY_CHUNK_CHARS] for start in range(0, len(delta), NOTIFY_CHUNK_CHARS)] or [""]
+        for index, piece in enumerate(pieces):
+            payload = json.dumps({"id": request_id, "delta": piece, "reset": reset and index == 0}, ensure_ascii=False)
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, payload)
+
+    async def _publish(self) -> None:
+        """Send queued stream chunks in order over a dedicated connection."""
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    while True:
+                        payload = await self._queue.get()
+                        try:
+                            await conn.execute("SELECT pg_notify(%s, %s)", (STREAM_CHANNEL, payload))
+                        except Exception:
+                            # Readers on this process still get it
+                            self._dispatch(STREAM_CHANNEL, payload)
+                            raise
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event publisher connection lost: {e}")
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    await conn.execute(f"LISTEN {STREAM_CHANNEL}")
+                    self.connected = True
+                    logger.info("Listening for request events")
+                    while True:
+                        if not self._leader:
+                            cursor = await conn.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,))
+                            self._leader = bool((await cursor.fetchone())[0])
+                            if self._leader:
+                                logger.info("This process is now the housekeeping leader")
+                        async for notify in conn.notifies(timeout=LEADER_RETRY_SECONDS):
+                            self._dispatch(notify.channel, notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event listener connection lost: {e}")
+            finally:
+                # The advisory lock went away with the connection
+                self.connected = False
+                self._leader = False
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    def _dispatch(self, channel: str, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed notification on {channel}: {payload[:200]}")
+            return
+        if channel == STREAM_CHANNEL:
+            streaming.hub.publish_chunk(data["id"], data["delta"], data["reset"])
+            return
+        for listener in [_on_request_event, *self._listeners]:
+            try:
+                listener(data)
+            except Exception as e:
+                logger.error(f"Request event listener failed for {data}: {e}")
+
+
+def _on_request_event(event: Dict[str, Any]) -> None:
+    """Act on lifecycle changes that may have happened in another process."""
+    if event["type"] in ("completed", "failed", "expired"):
+        webhook.dispatcher.wake()
+    if event["type"] in ("completed", "failed", "expired", "cancelled", "deleted"):
+        # Stop buffering right away, whether or not anyone reads it here
+        streaming.hub.ended(event["id"])
+        if event["type"] != "deleted" and streaming.hub.has_subscribers(event["id"]):
+            asyncio.create_task(_finish_stream(event["id"]))
+
+
+async def _finish_stream(request_id: int) -> None:
+    try:
+        record = await asyncio.to_thread(database.get_request, request_id)
+    except KeyError:
+        return
+    streaming.hub.finish(request_id, database.serialize(record))
+
+
+# Process-wide bus, started and closed with the app
+bus = EventBus(DATABASE_URL)
@@ -1,15 +1,23 @@
 import os
+import json
 import asyncio
-from typing import Optional, Any
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional, Any
 
-from fastapi import FastAPI, HTTPException, Depends, Header, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, HttpUrl
 
 from . import database_supabase as database
 from . import webhook
+from . import streaming
+from . import scheduler
+from . import events
+from . import admission
 
 app = FastAPI(title="ChatGPT Relay Server", version="0.1.0")
 
@@ -33,6 +41,10 @@ if not API_KEY:
 # Get retention period from environment variable (default: 24 hours)
 RETENTION_HOURS = int(os.getenv("RETENTION_HOURS", "24"))
 
+# Delay before a request whose attempt failed with a retryable error may be
+# claimed again; doubles with every failed attempt
+RETRY_DELAY_SECONDS = float(os.getenv("RETRY_DELAY_SECONDS", "10"))
+
 
 def verify_api_key(x_api_key: str = Header(..., alias="X-API-Key")) -> str:
     """Verify API key from header."""
@@ -48,6 +60,9 @@ class CreateRequest(BaseModel):
     model_mode: Optional[str] = Field(None, description="Model mode: auto, thinking, instant - determines which ChatGPT model to use")
     image_url: Optional[str] = Field(None, description="URL or base64-encoded image to send along with the prompt")
     follow_up_chat_url: Optional[str] = Field(None, description="ChatGPT chat URL to continue an existing conversation instead of starting a new chat")
+    max_attempts: Optional[int] = Field(None, ge=1, le=10, description="Attempts before a request that keeps hitting retryable errors fails (default: 3)")
+    ttl_seconds: Optional[int] = Field(None, gt=0, description="Give up on the request if it has not finished this many seconds after creation")
+    deadline: Optional[datetime] = Field(None, description="Give up on the request if it has not finished by this time (UTC unless an offset is given)")
 
 
 class RequestResponse(BaseModel):
@@ -57,6 +72,7 @@ class RequestResponse(BaseModel):
     response: Optional[str]
     error: Optional[str]
     worker_id: Optional[str]
+    account: Optional[str]
     webhook_url: Optional[str]
     webhook_delivered: bool
     prompt_mode: Optional[str]
@@ -64,23 +80,123 @@ class RequestResponse(BaseModel):
     image_url: Optional[str]
     chat_url: Optional[str]
     follow_up_chat_url: Optional[str]
+    deadline_at: Optional[str]
+    cancel_requested: bool
+    attempts: int = Field(..., description="Attempts that ended in an error so far")
+    max_attempts: int
+    retry_at: Optional[str] = Field(..., description="When a request waiting for another attempt may be claimed again")
     created_at: str
     updated_at: str
+    estimated_start_at: Optional[str] = Field(None, description="Estimated time a worker picks the request up (create responses only)")
+
+
+# Most IDs one bulk read or ack may name
+MAX_BULK_IDS = 1000
+
+
+class BulkRequestsResponse(BaseModel):
+    requests: list[dict[str, Any]] = Field(..., description="Requests found, in the order asked for, with the selected fields")
+    missing: list[int] = Field(..., description="IDs that do not exist")
+
+
+class AckRequest(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=MAX_BULK_IDS, description="Requests whose results the client has collected")
+    fields: Optional[list[str]] = Field(None, description="Fields to return for each deleted request (default: all); id is always included")
+
+
+class AckResponse(BaseModel):
+    requests: list[dict[str, Any]] = Field(..., description="Finished requests that were deleted, with the selected fields")
+    remaining: list[int] = Field(..., description="IDs left in place: still pending or processing, or unknown")
+
+
+class WorkerRegistration(BaseModel):
+    worker_id: str = Field(..., min_length=1)
+    account: str = Field(..., min_length=1, description="ChatGPT account (Chrome profile) the worker drives")
+    model_modes: list[str] = Field(default_factory=lambda: list(scheduler.ALL_MODEL_MODES), description="Model modes the account offers")
+    prompt_modes: list[str] = Field(default_factory=lambda: list(scheduler.ALL_PROMPT_MODES), description="Prompt modes the account may use")
+
+
+class AccountUsageResponse(BaseModel):
+    account: str
+    workers: list[str]
+    usage: dict[str, int]
+    headroom: dict[str, Optional[int]]
+
+
+class QueueEstimateResponse(BaseModel):
+    mode: str
+    pending: int
+    drain_rate: float = Field(..., description="Requests finished per minute recently")
+    rate_scope: str = Field(..., description="'mode' for this mode's own rate; 'fleet' when the mode has no recent history and the wait is estimated from all pending work and the fleet-wide rate")
+    wait_seconds: Optional[float]
+    max_wait_seconds: Optional[float]
+
+
+class WebhookReplayRequest(BaseModel):
+    request_ids: Optional[list[int]] = Field(None, description="Only replay dead-lettered webhooks of these requests (default: all)")
 
 
 class ClaimRequest(BaseModel):
     worker_id: str = Field(..., min_length=1)
+    exclude_prompt_modes: Optional[list[str]] = Field(None, description="Prompt modes this worker cannot take right now")
+    prefer_prompt_modes: Optional[list[str]] = Field(None, description="Prompt modes to take ahead of older requests in other modes")
+    detach_modes: Optional[list[str]] = Field(None, description="Prompt modes this worker detaches; skipped once its account has max_detached detached requests")
+    max_detached: Optional[int] = Field(None, ge=0, description="Detached requests allowed per account")
 
 
 class CompletionPayload(BaseModel):
     response: str
     chat_url: Optional[str] = None
+    worker_id: Optional[str] = Field(None, description="Worker whose attempt this is; a completion from any other attempt is rejected")
+
+
+class DetachPayload(BaseModel):
+    chat_url: str = Field(..., min_length=1)
 
 
 class FailurePayload(BaseModel):
     error: str
 
 
+class AttemptFailurePayload(FailurePayload):
+    retryable: bool = Field(False, description="Another attempt may succeed: requeue the request unless it is out of attempts")
+
+
+class WorkerResult(BaseModel):
+    id: int
+    worker_id: str = Field(..., min_length=1, description="Worker whose attempt the report belongs to")
+    status: Literal["completed", "failed", "expired", "cancelled", "retry", "requeued", "detached"]
+    response: Optional[str] = None
+    chat_url: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ResultBatch(BaseModel):
+    results: list[WorkerResult] = Field(..., min_length=1, max_length=500)
+
+
+class ResultBatchResponse(BaseModel):
+    applied: list[int] = Field(..., description="Requests the reports were recorded for")
+    skipped: list[int] = Field(..., description="Requests no longer processing by the reporting worker (finished, requeued, claimed again) or that no longer exist")
+
+
+class HeartbeatResponse(BaseModel):
+    id: int
+    status: str
+    cancel: bool = Field(..., description="Stop working on the request and confirm with /worker/{id}/cancelled")
+
+
+class RequeuePayload(BaseModel):
+    reason: str
+    retry_after_seconds: Optional[float] = Field(None, description="Cooldown the page reported, if any")
+
+
+class ChunkPayload(BaseModel):
+    delta: str
+    reset: bool = Field(False, description="Replace the partial text instead of appending to it")
+    seq: Optional[int] = None
+
+
 class DatabaseStatsResponse(BaseModel):
     status: str
     total_requests: int
@@ -100,15 +216,23 @@ async def periodic_cleanup():
     while True:
         try:
             await asyncio.sleep(3600)  # Run every hour
+            if not events.bus.is_leader():
+                # Another process holds the housekeeping lock
+                continue
             deleted_count = database.cleanup_old_requests(RETENTION_HOURS)
             if deleted_count > 0:
                 print(f"Cleaned up {deleted_count} old requests (retention: {RETENTION_HOURS}h)")
+            database.cleanup_account_claims(datetime.utcnow() - scheduler.scheduler.window)
+            database.cleanup_webhook_outbox(datetime.utcnow() - timedelta(hours=RETENTION_HOURS))
+            database.cleanup_request_completions(datetime.utcnow() - admission.controller.window)
         except Exception as e:
             print(f"Error during periodic cleanup: {e}")
 
 
 @app.on_event("startup")
 async def startup() -> None:
+    await webhook.dispatcher.start()
+    await events.bus.start()
     try:
         database.init_db()
         # Start background cleanup task
@@ -119,6 +243,12 @@ async def startup() -> None:
         print(f"Database initialization deferred: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await events.bus.close()
+    await webhook.dispatcher.close()
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
@@ -175,6 +305,61 @@ def database_stats(api_key: str = Depends(verify_api_key)) -> DatabaseStatsRespo
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
 
 
+@app.get("/admin/accounts", response_model=list[AccountUsageResponse])
+def account_usage(api_key: str = Depends(verify_api_key)) -> list[AccountUsageResponse]:
+    """
+    Usage and remaining headroom per registered account within the usage window.
+    Headroom is null for modes without a cap.
+    """
+    try:
+        workers = database.get_workers()
+        usage = scheduler.scheduler.usage()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    accounts: dict[str, list[str]] = {}
+    for worker in workers:
+        accounts.setdefault(worker.account, []).append(worker.worker_id)
+    return [
+        AccountUsageResponse(
+            account=account,
+            workers=worker_ids,
+            usage=usage.get(account, {}),
+            headroom={
+                mode: max(0, int(scheduler.scheduler.headroom(usage, account, mode)))
+                for mode in scheduler.scheduler.caps
+            },
+        )
+        for account, worker_ids in sorted(accounts.items())
+    ]
+
+
+@app.get("/admin/queue", response_model=list[QueueEstimateResponse])
+def queue_estimates(api_key: str = Depends(verify_api_key)) -> list[QueueEstimateResponse]:
+    """
+    Pending depth, recent drain rate and estimated wait per prompt mode, as
+    used to admit new requests.
+    """
+    try:
+        estimates = admission.controller.estimates()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    return [QueueEstimateResponse(**asdict(estimate)) for estimate in estimates.values()]
+
+
+@app.post("/admin/webhooks/replay")
+def replay_webhooks(payload: WebhookReplayRequest, api_key: str = Depends(verify_api_key)) -> dict[str, Any]:
+    """
+    Retry dead-lettered webhook deliveries right away, with a fresh attempt budget.
+    """
+    try:
+        replayed = database.replay_webhooks(payload.request_ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    if replayed:
+        webhook.dispatcher.wake()
+    return {"status": "success", "replayed": replayed}
+
+
 @app.post("/admin/cleanup")
 def manual_cleanup(
     retention_hours: int = Query(RETENTION_HOURS, description="Hours to retain completed requests"),
@@ -196,6 +381,28 @@ def manual_cleanup(
 
 @app.post("/requests", response_model=RequestResponse, status_code=201)
 def create_request(payload: CreateRequest, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    deadlines = []
+    if payload.deadline is not None:
+        deadline = payload.deadline
+        deadlines.append(deadline if deadline.tzinfo else deadline.replace(tzinfo=timezone.utc))
+    if payload.ttl_seconds is not None:
+        deadlines.append(datetime.now(timezone.utc) + timedelta(seconds=payload.ttl_seconds))
+    deadline_at = min(deadlines) if deadlines else None
+    if deadline_at is not None and deadline_at <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=422, detail="deadline is in the past")
+
+    try:
+        estimated_start = admission.controller.admit(payload.prompt_mode)
+    except admission.QueueFull as exc:
+        raise HTTPException(
+            status_code=429,
+            detail=f"{exc}; retry in {exc.retry_after}s",
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+    except Exception as e:
+        # Queue statistics unavailable: take the request without an estimate
+        print(f"Admission check failed, accepting request: {e}")
+        estimated_start = None
     webhook_url = str(payload.webhook_url) if payload.webhook_url else None
     record = database.create_request(
         payload.prompt, 
@@ -203,9 +410,74 @@ def create_request(payload: CreateRequest, api_key: str = Depends(verify_api_key
         payload.prompt_mode, 
         payload.model_mode, 
         payload.image_url,
-        payload.follow_up_chat_url
+        payload.follow_up_chat_url,
+        deadline_at,
+        payload.max_attempts
+    )
+    return RequestResponse(
+        **database.serialize(record),
+        estimated_start_at=estimated_start.isoformat() if estimated_start else None,
+    )
+
+
+def parse_id_list(value: str) -> list[int]:
+    """Parse the comma-separated `ids` of a bulk read, dropping duplicates."""
+    try:
+        ids = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail="ids must be comma-separated integers") from exc
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=422, detail=f"ids must name between 1 and {MAX_BULK_IDS} requests")
+    return ids
+
+
+def parse_fields(requested: Optional[list[str]]) -> Optional[list[str]]:
+    """Validate a field selection; `id` always comes first."""
+    if not requested:
+        return None
+    unknown = [name for name in requested if name not in database.REQUEST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id", *(name for name in dict.fromkeys(requested) if name != "id")]
+
+
+@app.get("/requests", response_model=BulkRequestsResponse)
+def read_requests(
+    ids: str = Query(..., description=f"Comma-separated request IDs (up to {MAX_BULK_IDS})"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return (default: all); id is always included"),
+    api_key: str = Depends(verify_api_key),
+) -> BulkRequestsResponse:
+    """Read many requests in one call, e.g. to poll a batch for completion with fields=status."""
+    request_ids = parse_id_list(ids)
+    columns = parse_fields([name.strip() for name in fields.split(",") if name.strip()] if fields else None)
+    rows = {row["id"]: row for row in database.get_requests(request_ids, columns)}
+    return BulkRequestsResponse(
+        requests=[rows[request_id] for request_id in request_ids if request_id in rows],
+        missing=[request_id for request_id in request_ids if request_id not in rows],
+    )
+
+
+@app.post("/requests/ack", response_model=AckResponse)
+def ack_requests(payload: AckRequest, api_key: str = Depends(verify_api_key)) -> AckResponse:
+    """
+    Fetch and delete many finished requests at once.
+
+    Completed, failed, expired and cancelled requests among `ids` are deleted
+    and returned by a single DELETE ... RETURNING; the others are left alone
+    and listed in `remaining`, so a client can ack a whole batch repeatedly
+    until nothing remains.
+    """
+    columns = parse_fields(payload.fields)
+    records = database.ack_requests(list(dict.fromkeys(payload.ids)))
+    acked = {record.id for record in records}
+    rows = [database.serialize(record) for record in records]
+    if columns:
+        rows = [{name: row[name] for name in columns} for row in rows]
+    return AckResponse(
+        requests=rows,
+        remaining=[request_id for request_id in dict.fromkeys(payload.ids) if request_id not in acked],
     )
-    return RequestResponse(**database.serialize(record))
 
 
 @app.get("/requests/{request_id}", response_model=RequestResponse)
@@ -215,17 +487,9 @@ def read_request(
     delete_after_fetch: bool = Query(False, description="Delete the request from database after fetching")
 ) -> RequestResponse:
     try:
-        record = database.get_request(request_id)
-        response_data = RequestResponse(**database.serialize(record))
-        
-        # Delete the request if requested
-        if delete_after_fetch:
-            deleted = database.delete_request(request_id)
-            if not deleted:
-                # This shouldn't happen since we just fetched it, but handle gracefully
-                print(f"Warning: Could not delete request {request_id} after fetch")
-        
-        return response_data
+        # The delete returns the row it removed, so fetch-and-delete is one round trip
+        record = database.take_request(request_id) if delete_after_fetch else database.get_request(request_id)
+        return RequestResponse(**database.serialize(record))
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
 
@@ -234,49 +498,299 @@ def read_request(
 def fetch_and_delete_request(request_id: int, api_key: str = Depends(verify_api_key)) -> RequestResponse:
     """
     Fetch the request response and immediately delete it from the database.
-    This is a convenience endpoint that combines fetch and delete operations.
+    This is a convenience endpoint that combines fetch and delete operations
+    in a single DELETE ... RETURNING; use POST /requests/ack for many requests.
     """
     try:
-        record = database.get_request(request_id)
-        response_data = RequestResponse(**database.serialize(record))
-        
-        # Delete the request after fetching
-        deleted = database.delete_request(request_id)
-        if not deleted:
-            # This shouldn't happen since we just fetched it, but handle gracefully
-            raise HTTPException(status_code=500, detail=f"Could not delete request {request_id} after fetch")
-        
-        return response_data
+        record = database.take_request(request_id)
+        return RequestResponse(**database.serialize(record))
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
 
 
+# Statuses a request never leaves
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+@app.post("/requests/{request_id}/cancel", response_model=RequestResponse)
+def cancel_request(request_id: int, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """
+    Cancel a request.
+
+    A pending request is cancelled at once and never reaches a worker. A
+    processing request keeps its status with cancel_requested set until its
+    worker stops generating, within one heartbeat interval, and marks it
+    cancelled. Cancelling a cancelled request again is a no-op.
+    """
+    try:
+        record = database.cancel_request(request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    if record.status in FINISHED_STATUSES and record.status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Request {request_id} already {record.status}")
+    if record.status == "cancelled":
+        streaming.hub.finish(request_id, database.serialize(record))
+    return RequestResponse(**database.serialize(record))
+
+
+# Seconds between keep-alive comments on idle streams; also how often the
+# stream re-checks the database in case the request finished in a process
+# this one hears nothing from (no DATABASE_URL)
+STREAM_KEEPALIVE_SECONDS = 15.0
+
+
+@app.get("/requests/{request_id}/stream")
+async def stream_request(request_id: int, api_key: str = Depends(verify_api_key)) -> StreamingResponse:
+    """
+    Stream a request's answer as server-sent events while ChatGPT writes it.
+
+    Emits `delta` events ({"delta": str, "reset": bool}) with the text added
+    since the previous event, then a single `done` event carrying the same
+    record GET /requests/{id} returns once the request is completed, failed,
+    expired or cancelled. Text written before the first reader connected to
+    this process is not replayed; the `done` record has the whole answer.
+    """
+    try:
+        record = await run_in_threadpool(database.get_request, request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+    subscription = streaming.hub.subscribe(request_id)
+
+    async def event_stream():
+        current = record
+        try:
+            while True:
+                if current is not None and current.status in FINISHED_STATUSES:
+                    yield streaming.format_sse("done", json.dumps(database.serialize(current)))
+                    return
+                current = None
+                event = await subscription.next_event(STREAM_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    current = await run_in_threadpool(database.get_request, request_id)
+                elif event["event"] == "done":
+                    yield streaming.format_sse("done", json.dumps(event["record"]))
+                    return
+                else:
+                    yield streaming.format_sse("delta", json.dumps({"delta": event["delta"], "reset": event["reset"]}))
+        except KeyError:
+            # Deleted while streaming
+            return
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/worker/register")
+def register_worker(payload: WorkerRegistration, api_key: str = Depends(verify_api_key)) -> dict[str, Any]:
+    """
+    Register the account a worker drives and what it can do.
+
+    Claims from registered workers only return requests their account supports
+    and still has headroom for under ACCOUNT_MODEL_CAPS.
+    """
+    worker = database.register_worker(payload.worker_id, payload.account, payload.model_modes, payload.prompt_modes)
+    scheduler.scheduler.invalidate()
+    return {
+        "worker_id": worker.worker_id,
+        "account": worker.account,
+        "model_modes": worker.model_modes,
+        "prompt_modes": worker.prompt_modes,
+    }
+
+
 @app.post("/worker/claim", response_model=RequestResponse, status_code=200)
 def claim_request(payload: ClaimRequest, api_key: str = Depends(verify_api_key)) -> RequestResponse:
-    record = database.claim_next_request(payload.worker_id)
+    worker = database.get_worker(payload.worker_id)
+    if worker is None:
+        # Unregistered workers claim anything, as before accounts existed
+        record = database.claim_next_request(
+            payload.worker_id,
+            payload.exclude_prompt_modes,
+            prefer_prompt_modes=payload.prefer_prompt_modes,
+            detach_modes=payload.detach_modes,
+            max_detached=payload.max_detached,
+        )
+    else:
+        plan = scheduler.scheduler.plan(worker)
+        record = database.claim_next_request(
+            payload.worker_id,
+            payload.exclude_prompt_modes,
+            model_modes=plan.model_modes,
+            prompt_modes=plan.prompt_modes,
+            account=worker.account,
+            prefer_prompt_modes=payload.prefer_prompt_modes,
+            detach_modes=payload.detach_modes,
+            max_detached=payload.max_detached,
+        )
+        database.set_worker_idle(worker.worker_id, record is None)
     if record is None:
         raise HTTPException(status_code=404, detail="No pending requests")
     return RequestResponse(**database.serialize(record))
 
 
 @app.post("/worker/{request_id}/complete", response_model=RequestResponse)
-def complete_request(request_id: int, payload: CompletionPayload, background_tasks: BackgroundTasks, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+def complete_request(request_id: int, payload: CompletionPayload, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """
+    Record a worker's answer.
+
+    Only a processing request is completed, and with `worker_id` only that
+    worker's attempt: a late answer from an attempt that was retried,
+    requeued or finished otherwise gets a 409 and changes nothing.
+    """
     try:
-        record = database.complete_request(request_id, payload.response, payload.chat_url)
-        # Schedule webhook delivery in background
-        background_tasks.add_task(webhook.send_completion_webhook, request_id)
+        record = database.complete_request(request_id, payload.response, payload.chat_url, payload.worker_id)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
+    if record is None:
+        raise HTTPException(status_code=409, detail=f"Request {request_id} is no longer processing by this worker")
+    streaming.hub.finish(request_id, database.serialize(record))
+    webhook.dispatcher.submit(record)
     return RequestResponse(**database.serialize(record))
 
 
 @app.post("/worker/{request_id}/fail", response_model=RequestResponse)
-def fail_request(request_id: int, payload: FailurePayload, background_tasks: BackgroundTasks, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+def fail_request(request_id: int, payload: AttemptFailurePayload, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """
+    Report a failed attempt.
+
+    A retryable failure puts the request back in the queue, at its original
+    position, after RETRY_DELAY_SECONDS (doubled per earlier failed attempt),
+    until it runs out of attempts. Permanent failures are final.
+    """
+    try:
+        record = database.fail_attempt(request_id, payload.error, payload.retryable, RETRY_DELAY_SECONDS)
+        if record.status == "pending" and record.cancel_requested:
+            # Nobody wants it anymore; do not try again
+            record = database.cancel_request(request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    if record.status == "pending":
+        print(f"Request {request_id} failed attempt {record.attempts} of {record.max_attempts}, retrying: {payload.error}")
+        # The next attempt streams the answer from scratch
+        events.bus.publish_chunk(request_id, "", reset=True)
+        return RequestResponse(**database.serialize(record))
+    streaming.hub.finish(request_id, database.serialize(record))
+    webhook.dispatcher.submit(record)
+    return RequestResponse(**database.serialize(record))
+
+
+@app.post("/worker/{request_id}/expire", response_model=RequestResponse)
+def expire_request(request_id: int, payload: FailurePayload, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """The worker abandoned a request because its deadline passed mid-run."""
     try:
-        record = database.fail_request(request_id, payload.error)
-        # Schedule webhook delivery in background
-        background_tasks.add_task(webhook.send_failure_webhook, request_id)
+        record = database.expire_request(request_id, payload.error)
     except KeyError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
+    streaming.hub.finish(request_id, database.serialize(record))
+    webhook.dispatcher.submit(record)
     return RequestResponse(**database.serialize(record))
 
+
+@app.post("/worker/results", response_model=ResultBatchResponse)
+def report_results(payload: ResultBatch, api_key: str = Depends(verify_api_key)) -> ResultBatchResponse:
+    """
+    Record many worker reports at once.
+
+    Workers replay reports the server did not acknowledge the first time
+    through this endpoint: final results, and retries, requeues and detaches.
+    A report only applies while the request is still processing by the
+    worker that sends it; requests that moved on (finished, went back to the
+    queue, were claimed by another worker) or were deleted are skipped rather
+    than overwritten, so replaying a stale report is safe.
+    """
+    records = database.report_results([result.model_dump() for result in payload.results], RETRY_DELAY_SECONDS)
+    for record in records:
+        if record.status in FINISHED_STATUSES:
+            streaming.hub.finish(record.id, database.serialize(record))
+            webhook.dispatcher.submit(record)
+        elif record.status == "pending":
+            # The next attempt streams the answer from scratch
+            events.bus.publish_chunk(record.id, "", reset=True)
+    applied = {record.id for record in records}
+    return ResultBatchResponse(
+        applied=sorted(applied),
+        skipped=sorted({result.id for result in payload.results} - applied),
+    )
+
+
+@app.post("/worker/{request_id}/heartbeat", response_model=HeartbeatResponse)
+def heartbeat_request(request_id: int, api_key: str = Depends(verify_api_key)) -> HeartbeatResponse:
+    """
+    Check in on a request the worker is running.
+
+    `cancel` tells the worker to stop: the client cancelled the request, or
+    it is no longer processing (a 404 means it was deleted).
+    """
+    try:
+        state = database.get_request_state(request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    return HeartbeatResponse(
+        id=state["id"],
+        status=state["status"],
+        cancel=bool(state["cancel_requested"]) or state["status"] != "processing",
+    )
+
+
+@app.post("/worker/{request_id}/cancelled", response_model=RequestResponse)
+def confirm_cancelled(request_id: int, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """The worker stopped a request after a heartbeat told it to cancel."""
+    try:
+        record = database.mark_cancelled(request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    streaming.hub.finish(request_id, database.serialize(record))
+    return RequestResponse(**database.serialize(record))
+
+
+@app.post("/worker/{request_id}/requeue", response_model=RequestResponse)
+def requeue_request(request_id: int, payload: RequeuePayload, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """
+    Hand a request back to the queue because the worker's account is throttled.
+
+    The request returns to pending with its original position, so another
+    worker picks it up next; it is not reported as failed.
+    """
+    try:
+        record = database.requeue_request(request_id)
+        if record.cancel_requested:
+            # Nobody wants it anymore; do not hand it to another worker
+            record = database.cancel_request(request_id)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    if record.status == "cancelled":
+        streaming.hub.finish(request_id, database.serialize(record))
+        return RequestResponse(**database.serialize(record))
+    print(f"Request {request_id} requeued: {payload.reason}")
+    # Whoever claims it next streams the answer from scratch
+    events.bus.publish_chunk(request_id, "", reset=True)
+    return RequestResponse(**database.serialize(record))
+
+
+@app.post("/worker/{request_id}/detach", response_model=RequestResponse)
+def detach_request(request_id: int, payload: DetachPayload, api_key: str = Depends(verify_api_key)) -> RequestResponse:
+    """
+    Record the conversation of a long-running request the worker stopped watching.
+
+    The request stays processing until the worker harvests the answer from
+    that chat and completes it as usual.
+    """
+    try:
+        record = database.set_chat_url(request_id, payload.chat_url)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    return RequestResponse(**database.serialize(record))
+
+
+@app.post("/worker/{request_id}/chunk", status_code=204)
+async def post_chunk(request_id: int, payload: ChunkPayload, api_key: str = Depends(verify_api_key)) -> None:
+    """Receive a partial response from the worker and forward it to stream readers."""
+    events.bus.publish_chunk(request_id, payload.delta, payload.reset)
+
@@ -0,0 +1,139 @@
+"""
+Account-aware routing of worker claims
+
+Each worker drives one ChatGPT account (Chrome profile) and registers which
+model and prompt modes that account offers. ChatGPT caps messages per account,
+so the server counts recent claims per account and only lets a worker claim
+modes its account still has headroom for. An account running low on a mode
+leaves that work to an idle account with more headroom, so usage spreads
+across the fleet instead of one account hitting its cap first.
+"""
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import database_supabase as database
+
+DEFAULT_MODEL_MODE = "auto"
+ALL_MODEL_MODES = ["auto", "thinking", "instant"]
+ALL_PROMPT_MODES = ["search", "study", "deep"]
+
+
+def _parse_caps(value: str) -> Dict[str, int]:
+    """Parse ACCOUNT_MODEL_CAPS, e.g. '{"thinking": 200, "deep": 10}'."""
+    if not value:
+        return {}
+    caps = json.loads(value)
+    return {str(mode): int(limit) for mode, limit in caps.items()}
+
+
+# Messages each account may send per mode within the usage window. Keys are
+# model modes ("auto", "thinking", "instant") or prompt modes ("deep", ...);
+# modes without an entry are unlimited.
+ACCOUNT_MODEL_CAPS = _parse_caps(os.getenv("ACCOUNT_MODEL_CAPS", ""))
+ACCOUNT_USAGE_WINDOW_HOURS = float(os.getenv("ACCOUNT_USAGE_WINDOW_HOURS", "3"))
+# An account whose remaining budget for a mode drops below this fraction of
+# the cap defers that mode to idle accounts with more headroom
+ACCOUNT_LOW_HEADROOM = float(os.getenv("ACCOUNT_LOW_HEADROOM", "0.25"))
+# A worker that polled without getting work this recently counts as idle
+IDLE_WORKER_SECONDS = float(os.getenv("IDLE_WORKER_SECONDS", "15"))
+
+
+@dataclass
+class ClaimPlan:
+    model_modes: List[str]
+    prompt_modes: List[str]
+
+
+class AccountScheduler:
+    """Decides which modes a worker's account may claim right now."""
+
+    def __init__(
+        self,
+        caps: Dict[str, int],
+        window_hours: float,
+        low_headroom: float,
+        idle_seconds: float,
+        cache_seconds: float = 5.0,
+    ) -> None:
+        self.caps = caps
+        self.window = timedelta(hours=window_hours)
+        self.low_headroom = low_headroom
+        self.idle_seconds = idle_seconds
+        # Usage and idle workers are re-read at most this often; a burst of
+        # claims may overshoot a cap by a few messages
+        self.cache_seconds = cache_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Tuple[float, Dict[str, Dict[str, int]], List[database.WorkerRecord]]] = None
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """Claims per account and mode within the usage window."""
+        return self._refresh()[0]
+
+    def plan(self, worker: database.WorkerRecord) -> ClaimPlan:
+        """Model and prompt modes `worker` should claim from."""
+        usage, idle_workers = self._refresh()
+        idle_others = [other for other in idle_workers if other.account != worker.account]
+
+        def allowed(mode: str, capabilities: str) -> bool:
+            headroom = self.headroom(usage, worker.account, mode)
+            if headroom <= 0:
+                return False
+            cap = self.caps.get(mode)
+            if cap is None or headroom >= cap * self.low_headroom:
+                return True
+            # Running low: leave it to an idle account that has more left
+            return not any(
+                mode in getattr(other, capabilities) and self.headroom(usage, other.account, mode) > headroom
+                for other in idle_others
+            )
+
+        return ClaimPlan(
+            model_modes=[mode for mode in worker.model_modes if allowed(mode, "model_modes")],
+            prompt_modes=[mode for mode in worker.prompt_modes if allowed(mode, "prompt_modes")],
+        )
+
+    def headroom(self, usage: Dict[str, Dict[str, int]], account: str, mode: str) -> float:
+        cap = self.caps.get(mode)
+        if cap is None:
+            return math.inf
+        return cap - usage.get(account, {}).get(mode, 0)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+    def _refresh(self) -> Tuple[Dict[str, Dict[str, int]], List[database.WorkerRecord]]:
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._snapshot[0] > self.cache_seconds:
+                usage = database.get_account_usage(datetime.utcnow() - self.window)
+                idle_workers = database.get_idle_workers(datetime.utcnow() - timedelta(seconds=self.idle_seconds))
+                self._snapshot = (now, _usage_by_mode(usage), idle_workers)
+            return self._snapshot[1], self._snapshot[2]
+
+
+def _usage_by_mode(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    """Fold account_usage rows into {account: {mode: claims}} for model and prompt modes."""
+    usage: Dict[str, Dict[str, int]] = {}
+    for row in rows:
+        counts = usage.setdefault(row["account"], {})
+        model_mode = row.get("model_mode") or DEFAULT_MODEL_MODE
+        counts[model_mode] = counts.get(model_mode, 0) + row["requests"]
+        if row.get("prompt_mode"):
+            counts[row["prompt_mode"]] = counts.get(row["prompt_mode"], 0) + row["requests"]
+    return usage
+
+
+# Process-wide scheduler used by the claim endpoint
+scheduler = AccountScheduler(
+    ACCOUNT_MODEL_CAPS,
+    ACCOUNT_USAGE_WINDOW_HOURS,
+    ACCOUNT_LOW_HEADROOM,
+    IDLE_WORKER_SECONDS,
+)
@@ -0,0 +1,146 @@
+"""
+Streaming of partial responses from workers to API clients
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How many finished requests to remember, so chunks that arrive after the
+# end (late posts, or our own chunks looping back through NOTIFY) are dropped
+FINISHED_MEMORY = 10000
+
+
+@dataclass
+class _Subscriber:
+    loop: asyncio.AbstractEventLoop
+    queue: "asyncio.Queue[Dict[str, Any]]"
+
+
+@dataclass
+class _Stream:
+    text: str = ""
+    subscribers: List[_Subscriber] = field(default_factory=list)
+
+
+class StreamHub:
+    """
+    In-process buffer of partial responses, fanned out to stream readers.
+
+    Workers publish text deltas as ChatGPT writes the answer; readers receive
+    the text accumulated since the first of them connected to this process,
+    every later delta, and a final event once the request is finished (its
+    record carries the whole answer). Text is only buffered while someone
+    reads it here, so processes without readers keep nothing. Publishing is
+    thread-safe so the synchronous completion handlers can close streams too.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._streams: Dict[int, _Stream] = {}
+        self._finished: "OrderedDict[int, None]" = OrderedDict()
+
+    def publish_chunk(self, request_id: int, delta: str, reset: bool = False) -> None:
+        """Append (or with reset, replace) the partial text of a request."""
+        with self._lock:
+            stream = self._streams.get(request_id)
+            if stream is None or request_id in self._finished:
+                # Nobody reads this request here, or it already ended
+                return
+            stream.text = delta if reset else stream.text + delta
+            self._fan_out(stream, {"event": "delta", "delta": delta, "reset": reset})
+
+    def finish(self, request_id: int, record: Dict[str, Any]) -> None:
+        """Send the final record to readers and drop the buffered text."""
+        with self._lock:
+            self._mark_finished(request_id)
+            stream = self._streams.pop(request_id, None)
+            if stream is not None:
+                self._fan_out(stream, {"event": "done", "record": record})
+
+    def ended(self, request_id: int) -> None:
+        """
+        Note that a request reached a final status, possibly in another process.
+
+        Later chunks are ignored and the buffered text is dropped; readers
+        still waiting get their final event from finish().
+        """
+        with self._lock:
+            self._mark_finished(request_id)
+            stream = self._streams.get(request_id)
+            if stream is None:
+                return
+            stream.text = ""
+            if not stream.subscribers:
+                del self._streams[request_id]
+
+    def subscribe(self, request_id: int) -> "Subscription":
+        """Start receiving stream events for a request (call from the event loop)."""
+        subscriber = _Subscriber(loop=asyncio.get_running_loop(), queue=asyncio.Queue())
+        with self._lock:
+            stream = self._streams.setdefault(request_id, _Stream())
+            stream.subscribers.append(subscriber)
+            if stream.text:
+                subscriber.queue.put_nowait({"event": "delta", "delta": stream.text, "reset": True})
+        return Subscription(self, request_id, subscriber)
+
+    def has_subscribers(self, request_id: int) -> bool:
+        with self._lock:
+            stream = self._streams.get(request_id)
+            return stream is not None and bool(stream.subscribers)
+
+    def _unsubscribe(self, request_id: int, subscriber: _Subscriber) -> None:
+        with self._lock:
+            stream = self._streams.get(request_id)
+            if stream is not None and subscriber in stream.subscribers:
+                stream.subscribers.remove(subscriber)
+                if not stream.subscribers:
+                    del self._streams[request_id]
+
+    def _mark_finished(self, request_id: int) -> None:
+        self._finished[request_id] = None
+        self._finished.move_to_end(request_id)
+        while len(self._finished) > FINISHED_MEMORY:
+            self._finished.popitem(last=False)
+
+    def _fan_out(self, stream: _Stream, event: Dict[str, Any]) -> None:
+        for subscriber in stream.subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.queue.put_nowait, event)
+
+
+class Subscription:
+    """A reader's view of one request stream."""
+
+    def __init__(self, hub: StreamHub, request_id: int, subscriber: _Subscriber) -> None:
+        self._hub = hub
+        self._request_id = request_id
+        self._subscriber = subscriber
+
+    async def next_event(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, returning None if nothing arrived within `timeout`."""
+        try:
+            return await asyncio.wait_for(self._subscriber.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self._hub._unsubscribe(self._request_id, self._subscriber)
+
+
+# Process-wide hub shared by the worker and client endpoints
+hub = StreamHub()
+
+
+def format_sse(event: str, data: str, event_id: Optional[int] = None) -> str:
+    """Format one server-sent event."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
@@ -1,144 +1,303 @@
 """
 Webhook delivery functionality for ChatGPT relay API
+
+Deliveries are durable: the database writes a `webhook_outbox` row in the
+same transaction that marks a request completed or failed (see
+supabase_migration_add_webhook_outbox.sql). One long-lived dispatcher on the
+server's event loop claims due rows in batches and delivers each one as its
+own task over a single shared HTTP client (HTTP/2 when the `h2` package is
+installed), with a cap on concurrent deliveries per host. It keeps claiming
+while fewer than WEBHOOK_MAX_IN_FLIGHT deliveries are running, so a slow
+destination does not hold up the others. Failed deliveries are retried with
+exponential backoff and jitter; after WEBHOOK_MAX_ATTEMPTS they are
+dead-lettered until replayed through the admin API.
+
+Destinations listed in WEBHOOK_BATCH_URLS opt into batching: their events are
+collected for up to WEBHOOK_BATCH_MAX_ITEMS items or WEBHOOK_BATCH_MAX_WAIT_MS
+and POSTed as one JSON array, and the whole batch is marked delivered at once.
 """
 
 import asyncio
 import logging
-from typing import Dict, Any, Optional
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
 import httpx
-from . import database
+from . import database_supabase as database
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Connections kept open across all destinations, and concurrent deliveries per host
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+WEBHOOK_MAX_PER_HOST = int(os.getenv("WEBHOOK_MAX_PER_HOST", "10"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Outbox rows claimed per round, how long a claim is held, and how often the
+# outbox is polled when nothing wakes the dispatcher
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "60"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "5"))
+# Deliveries running at once across all destinations; each holds its lease
+# until it finishes, so keep this low enough that they finish within it
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# Attempts before a delivery is dead-lettered, and the backoff between them
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+# Webhook URLs that receive events batched into JSON arrays (comma-separated)
+WEBHOOK_BATCH_URLS = {url.strip() for url in os.getenv("WEBHOOK_BATCH_URLS", "").split(",") if url.strip()}
+WEBHOOK_BATCH_MAX_ITEMS = int(os.getenv("WEBHOOK_BATCH_MAX_ITEMS", "100"))
+WEBHOOK_BATCH_MAX_WAIT_MS = int(os.getenv("WEBHOOK_BATCH_MAX_WAIT_MS", "500"))
 
-async def deliver_webhook(webhook_url: str, payload: Dict[str, Any], request_id: int) -> bool:
+
+def retry_delay(attempts: int, base: float = WEBHOOK_RETRY_BASE_SECONDS, maximum: float = WEBHOOK_RETRY_MAX_SECONDS) -> float:
     """
-    Deliver webhook payload to the specified URL with retry logic
-    
-    Args:
-        webhook_url: The URL to deliver the webhook to
-        payload: The data to send in the webhook
-        request_id: The request ID for tracking
-        
-    Returns:
-        bool: True if delivery was successful, False otherwise
+    Seconds to wait after the `attempts`-th failed delivery
+
+    Doubles per attempt up to `maximum`; a random half of the delay is shaved
+    off so deliveries that failed together don't all retry together.
     """
-    max_retries = 3
-    retry_delays = [1, 5, 15]  # seconds
-    
-    for attempt in range(max_retries):
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    webhook_url,
-                    json=payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "User-Agent": "ChatGPT-Relay-API/1.0"
-                    }
-                )
-                
-                # Consider 2xx status codes as successful
-                if 200 <= response.status_code < 300:
-                    logger.info(f"Webhook delivered successfully to {webhook_url} for request {request_id}")
-                    database.mark_webhook_delivered(request_id)
-                    return True
+    delay = min(maximum, base * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class WebhookDispatcher:
+    """Delivers outbox webhooks over a shared HTTP client with per-host concurrency caps."""
+
+    def __init__(
+        self,
+        max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+        max_per_host: int = WEBHOOK_MAX_PER_HOST,
+        timeout: float = WEBHOOK_TIMEOUT_SECONDS,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        lease_seconds: int = WEBHOOK_LEASE_SECONDS,
+        poll_interval: float = WEBHOOK_POLL_SECONDS,
+        max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+        batch_urls: Optional[Set[str]] = None,
+        batch_max_items: int = WEBHOOK_BATCH_MAX_ITEMS,
+        batch_max_wait_ms: int = WEBHOOK_BATCH_MAX_WAIT_MS,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_attempts = max_attempts
+        self.batch_urls = WEBHOOK_BATCH_URLS if batch_urls is None else batch_urls
+        self.batch_max_items = max(1, batch_max_items)
+        # Buffered entries stay leased; flush well before the lease runs out
+        self.batch_max_wait = min(batch_max_wait_ms / 1000, lease_seconds / 2)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._delayed_wake: Optional[asyncio.TimerHandle] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        # Leased entries waiting to be sent to a batching destination, and
+        # when the oldest of them was buffered (time.monotonic())
+        self._batches: Dict[str, List[database.OutboxRecord]] = {}
+        self._batch_started: Dict[str, float] = {}
+
+    async def start(self) -> None:
+        """Create the shared client and start the outbox loop; must run on the server's event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            headers={
+                "Content-Type": "application/json",
+                "User-Agent": "ChatGPT-Relay-API/1.0"
+            },
+        )
+        self._task = asyncio.create_task(self.run())
+        logger.info(f"Webhook dispatcher started (http2={HTTP2_AVAILABLE}, per-host limit={self.max_per_host})")
+
+    async def close(self) -> None:
+        """Stop the outbox loop and close the client; leased rows are retried after their lease."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._in_flight):
+            task.cancel()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, request_record: database.RequestRecord) -> None:
+        """
+        A request with a webhook just finished: deliver it now instead of at the next poll.
+
+        The database already queued the delivery; this only wakes the
+        dispatcher. Safe to call from the threadpool that runs sync endpoints.
+        """
+        if not request_record.webhook_url or request_record.webhook_delivered:
+            return
+        if request_record.webhook_url in self.batch_urls:
+            # Let a burst accumulate and claim it in one go
+            self.wake(delay=self.batch_max_wait)
+        else:
+            self.wake()
+
+    def wake(self, delay: float = 0.0) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._schedule_wake, delay)
+
+    def _schedule_wake(self, delay: float) -> None:
+        if delay <= 0:
+            self._wake.set()
+        elif self._delayed_wake is None:
+            def fire() -> None:
+                self._delayed_wake = None
+                self._wake.set()
+            self._delayed_wake = self._loop.call_later(delay, fire)
+
+    async def run(self) -> None:
+        """Claim and deliver due outbox rows until cancelled."""
+        while True:
+            self._wake.clear()
+            # Claim no more than there is room to start; a finished delivery wakes the loop
+            limit = min(self.batch_size, self.max_in_flight - len(self._in_flight))
+            entries = []
+            if limit > 0:
+                try:
+                    entries = await asyncio.to_thread(database.claim_webhook_deliveries, limit, self.lease_seconds)
+                except Exception as e:
+                    logger.error(f"Could not claim webhook deliveries: {e}")
+
+            for entry in entries:
+                if entry.webhook_url in self.batch_urls:
+                    self._batches.setdefault(entry.webhook_url, []).append(entry)
+                    self._batch_started.setdefault(entry.webhook_url, time.monotonic())
                 else:
-                    logger.warning(
-                        f"Webhook delivery failed with status {response.status_code} "
-                        f"for request {request_id}, attempt {attempt + 1}"
-                    )
-                    
+                    self._start_delivery([entry])
+            for batch in self._due_batches():
+                self._start_delivery(batch)
+            if limit > 0 and len(entries) == limit:
+                # More may be due right away
+                continue
+
+            timeout = self.poll_interval
+            if self._batch_started:
+                oldest = min(self._batch_started.values())
+                timeout = max(0.0, min(timeout, oldest + self.batch_max_wait - time.monotonic()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_delivery(self, entries: List[database.OutboxRecord]) -> None:
+        """Deliver `entries` in a task of their own, so the loop goes on claiming."""
+        task = asyncio.create_task(self.deliver(entries))
+        self._in_flight.add(task)
+        task.add_done_callback(self._delivery_done)
+
+    def _delivery_done(self, task: asyncio.Task) -> None:
+        if len(self._in_flight) >= self.max_in_flight:
+            # The loop stopped claiming for lack of room; there is some now
+            self._wake.set()
+        self._in_flight.discard(task)
+
+    def _due_batches(self) -> List[List[database.OutboxRecord]]:
+        """Take the buffered batches that are full or have waited long enough."""
+        now = time.monotonic()
+        due = []
+        for url in list(self._batches):
+            entries = self._batches[url]
+            if len(entries) < self.batch_max_items and now - self._batch_started[url] < self.batch_max_wait:
+                continue
+            del self._batches[url]
+            del self._batch_started[url]
+            due.extend(
+                entries[start:start + self.batch_max_items]
+                for start in range(0, len(entries), self.batch_max_items)
+            )
+        return due
+
+    def _host_limit(self, webhook_url: str) -> asyncio.Semaphore:
+        host = httpx.URL(webhook_url).netloc.decode("ascii", "replace")
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return limit
+
+    async def deliver(self, entries: List[database.OutboxRecord]) -> bool:
+        """
+        Make one delivery attempt for outbox entries sharing a webhook URL
+
+        Batching destinations always receive a JSON array of payloads, even
+        for a single entry; other destinations receive one payload per POST.
+
+        Args:
+            entries: The leased outbox entries to deliver
+
+        Returns:
+            bool: True if delivery was successful, False otherwise
+        """
+        webhook_url = entries[0].webhook_url
+        request_ids = ", ".join(str(entry.request_id) for entry in entries)
+        body: Any = [entry.payload for entry in entries] if webhook_url in self.batch_urls else entries[0].payload
+        error: Optional[str] = None
+        try:
+            async with self._host_limit(webhook_url):
+                response = await self._client.post(webhook_url, json=body)
+            # Consider 2xx status codes as successful
+            if not 200 <= response.status_code < 300:
+                error = f"HTTP {response.status_code}"
         except httpx.TimeoutException:
-            logger.warning(f"Webhook delivery timeout for request {request_id}, attempt {attempt + 1}")
+            error = "timeout"
         except httpx.RequestError as e:
-            logger.warning(f"Webhook delivery error for request {request_id}, attempt {attempt + 1}: {e}")
+            error = str(e) or type(e).__name__
         except Exception as e:
-            logger.error(f"Unexpected error during webhook delivery for request {request_id}: {e}")
-        
-        # Wait before retry (except on last attempt)
-        if attempt < max_retries - 1:
-            await asyncio.sleep(retry_delays[attempt])
-    
-    logger.error(f"Webhook delivery failed after {max_retries} attempts for request {request_id}")
-    return False
-
+            logger.error(f"Unexpected error during webhook delivery for request(s) {request_ids}: {e}")
+            error = str(e) or type(e).__name__
 
-def create_webhook_payload(request_record: database.RequestRecord) -> Dict[str, Any]:
-    """
-    Create webhook payload from request record
-    
-    Args:
-        request_record: The request record to create payload from
-        
-    Returns:
-        Dict containing webhook payload
-    """
-    payload = {
-        "request_id": request_record.id,
-        "status": request_record.status,
-        "prompt": request_record.prompt,
-        "timestamp": request_record.updated_at,
-        "worker_id": request_record.worker_id,
-    }
-    
-    if request_record.status == "completed":
-        payload["response"] = request_record.response
-    elif request_record.status == "failed":
-        payload["error"] = request_record.error
-    
-    return payload
-
-
-async def send_completion_webhook(request_id: int) -> None:
-    """
-    Send webhook notification for a completed request
-    
-    Args:
-        request_id: The ID of the completed request
-    """
-    try:
-        request_record = database.get_request(request_id)
-        
-        if not request_record.webhook_url:
-            logger.debug(f"No webhook URL configured for request {request_id}")
-            return
-        
-        if request_record.webhook_delivered:
-            logger.debug(f"Webhook already delivered for request {request_id}")
-            return
-        
-        payload = create_webhook_payload(request_record)
-        
-        # Deliver webhook asynchronously
-        await deliver_webhook(request_record.webhook_url, payload, request_id)
-        
-    except Exception as e:
-        logger.error(f"Error sending completion webhook for request {request_id}: {e}")
+        try:
+            if error is None:
+                await asyncio.to_thread(database.mark_webhook_outbox_delivered, entries)
+                logger.info(f"Webhook delivered successfully to {webhook_url} for request(s) {request_ids}")
+                return True
+            # Entries of one batch were usually claimed together; retry them together
+            attempts = max(entry.attempts for entry in entries)
+            if attempts >= self.max_attempts:
+                await asyncio.to_thread(database.dead_letter_webhooks, [entry.id for entry in entries], error)
+                logger.error(f"Webhook delivery failed after {attempts} attempts for request(s) {request_ids}: {error}")
+            else:
+                delay = retry_delay(attempts)
+                next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                await asyncio.to_thread(
+                    database.reschedule_webhook_deliveries, [entry.id for entry in entries], next_attempt_at, error
+                )
+                logger.warning(
+                    f"Webhook delivery failed ({error}) for request(s) {request_ids}, "
+                    f"attempt {attempts}, retrying in {delay:.0f}s"
+                )
+        except Exception as e:
+            # The lease runs out and the rows are claimed again
+            logger.error(f"Could not record webhook outcome for request(s) {request_ids}: {e}")
+        return False
 
 
-async def send_failure_webhook(request_id: int) -> None:
-    """
-    Send webhook notification for a failed request
-    
-    Args:
-        request_id: The ID of the failed request
-    """
-    try:
-        request_record = database.get_request(request_id)
-        
-        if not request_record.webhook_url:
-            logger.debug(f"No webhook URL configured for request {request_id}")
-            return
-        
-        if request_record.webhook_delivered:
-            logger.debug(f"Webhook already delivered for request {request_id}")
-            return
-        
-        payload = create_webhook_payload(request_record)
-        
-        # Deliver webhook asynchronously
-        await deliver_webhook(request_record.webhook_url, payload, request_id)
-        
-    except Exception as e:
-        logger.error(f"Error sending failure webhook for request {request_id}: {e}")
+# Process-wide dispatcher, started and closed with the app
+dispatcher = WebhookDispatcher()
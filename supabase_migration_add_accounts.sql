@@ -0,0 +1,73 @@
+-- Migration: Account-aware scheduling
+-- Workers register the ChatGPT account (Chrome profile) they drive and the
+-- modes it supports; every request an account takes on is logged so the
+-- server can route work to the account with the most headroom under its
+-- message caps
+
+-- Account that served each request
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS account TEXT;
+
+-- Registered workers and their capabilities
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    model_modes TEXT[] NOT NULL DEFAULT '{}',
+    prompt_modes TEXT[] NOT NULL DEFAULT '{}',
+    registered_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    -- Set when the worker last polled without getting a job, cleared when it claims one
+    last_idle_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_workers_last_idle_at ON workers(last_idle_at);
+
+-- One row per account and request it claimed; kept separately from requests
+-- because clients may delete their requests (fetch-and-delete) long before
+-- the usage window has passed. Claiming the same request again (after a
+-- throttle requeue or a retry) adds no row, so it is counted once.
+CREATE TABLE IF NOT EXISTS account_claims (
+    id BIGSERIAL PRIMARY KEY,
+    account TEXT NOT NULL,
+    request_id BIGINT,
+    model_mode TEXT,
+    prompt_mode TEXT,
+    claimed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE account_claims ADD COLUMN IF NOT EXISTS request_id BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_account_claims_claimed_at ON account_claims(claimed_at DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_account_claims_account_request ON account_claims(account, request_id);
+
+-- Claims per account, model and prompt mode since a point in time
+CREATE OR REPLACE FUNCTION account_usage(since TIMESTAMP WITH TIME ZONE)
+RETURNS TABLE (account TEXT, model_mode TEXT, prompt_mode TEXT, requests BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.account, c.model_mode, c.prompt_mode, COUNT(*)
+    FROM account_claims c
+    WHERE c.claimed_at >= since
+    GROUP BY c.account, c.model_mode, c.prompt_mode;
+$$;
+
+ALTER TABLE workers ENABLE ROW LEVEL SECURITY;
+ALTER TABLE account_claims ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Enable full access for service_role" ON workers
+    FOR ALL
+    TO service_role
+    USING (true)
+    WITH CHECK (true);
+
+CREATE POLICY "Enable full access for service_role" ON account_claims
+    FOR ALL
+    TO service_role
+    USING (true)
+    WITH CHECK (true);
+
+GRANT ALL ON workers TO service_role;
+GRANT ALL ON account_claims TO service_role;
+GRANT USAGE, SELECT ON SEQUENCE account_claims_id_seq TO service_role;
+GRANT EXECUTE ON FUNCTION account_usage(TIMESTAMP WITH TIME ZONE) TO service_role;
+
+-- Success message
+SELECT 'Account scheduling migration completed successfully!' as message;
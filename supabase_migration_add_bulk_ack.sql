@@ -0,0 +1,20 @@
+-- Migration: Bulk acknowledgement
+-- POST /requests/ack collects the results of many requests and removes them
+-- in one statement. Only finished requests are deleted; IDs still pending or
+-- processing are left alone for the client to ack later.
+-- Run after supabase_migration_add_cancellation.sql.
+
+CREATE OR REPLACE FUNCTION ack_requests(p_ids BIGINT[])
+RETURNS SETOF requests
+LANGUAGE sql
+AS $$
+    DELETE FROM requests
+    WHERE id = ANY(p_ids)
+      AND status IN ('completed', 'failed', 'expired', 'cancelled')
+    RETURNING *;
+$$;
+
+GRANT EXECUTE ON FUNCTION ack_requests(BIGINT[]) TO service_role;
+
+-- Success message
+SELECT 'Bulk acknowledgement migration completed successfully!' as message;
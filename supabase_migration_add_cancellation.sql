@@ -0,0 +1,35 @@
+-- Migration: Request cancellation
+-- Clients cancel requests with POST /requests/{id}/cancel. A pending request
+-- is cancelled on the spot; a processing one gets cancel_requested, which the
+-- worker running it sees on its next heartbeat, stops the page and confirms.
+
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Cancel in one statement, so a concurrent claim either sees the request
+-- cancelled or hands it to a worker with cancel_requested already set.
+-- Requests that already finished are returned unchanged.
+CREATE OR REPLACE FUNCTION cancel_request(p_request_id BIGINT)
+RETURNS SETOF requests
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE requests
+    SET status = CASE WHEN status = 'pending' THEN 'cancelled' ELSE status END,
+        error = CASE WHEN status = 'pending' THEN 'Cancelled by the client' ELSE error END,
+        cancel_requested = TRUE,
+        updated_at = NOW()
+    WHERE id = p_request_id
+      AND status IN ('pending', 'processing')
+    RETURNING *;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT * FROM requests WHERE id = p_request_id;
+    END IF;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION cancel_request(BIGINT) TO service_role;
+
+-- Success message
+SELECT 'Cancellation migration completed successfully!' as message;
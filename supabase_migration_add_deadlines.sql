@@ -0,0 +1,106 @@
+-- Migration: Request deadlines and atomic claiming
+-- Clients may give a request a deadline; a pending request whose deadline has
+-- passed is marked 'expired' instead of being handed to a worker.
+-- Claiming moves into a single function so that expiring, picking the oldest
+-- eligible request and marking it processing happen in one transaction, and
+-- concurrent workers skip each other's rows instead of claiming the same one.
+-- Run after supabase_migration_add_accounts.sql and
+-- supabase_migration_add_webhook_outbox.sql.
+
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS deadline_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_requests_pending_deadline ON requests(deadline_at)
+    WHERE status = 'pending' AND deadline_at IS NOT NULL;
+
+-- Filters mirror the claim request: prompt modes to skip, model and prompt
+-- modes the worker's account may use (NULL = any; a request without a model
+-- mode counts as 'auto', one without a prompt mode is always allowed), and
+-- prompt modes to take ahead of older requests in other modes
+CREATE OR REPLACE FUNCTION claim_next_request(
+    p_worker_id TEXT,
+    p_exclude_prompt_modes TEXT[] DEFAULT NULL,
+    p_model_modes TEXT[] DEFAULT NULL,
+    p_prompt_modes TEXT[] DEFAULT NULL,
+    p_prefer_prompt_modes TEXT[] DEFAULT NULL,
+    p_account TEXT DEFAULT NULL
+)
+RETURNS SETOF requests
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    claimed requests;
+BEGIN
+    UPDATE requests
+    SET status = 'expired',
+        error = 'Deadline passed before a worker picked the request up'
+    WHERE status = 'pending'
+      AND deadline_at IS NOT NULL
+      AND deadline_at <= NOW();
+
+    SELECT * INTO claimed
+    FROM requests r
+    WHERE r.status = 'pending'
+      AND (p_exclude_prompt_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode <> ALL(p_exclude_prompt_modes))
+      AND (p_prompt_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode = ANY(p_prompt_modes))
+      AND (p_model_modes IS NULL OR COALESCE(r.model_mode, 'auto') = ANY(p_model_modes))
+    ORDER BY COALESCE(r.prompt_mode = ANY(p_prefer_prompt_modes), FALSE) DESC, r.created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE requests
+    SET status = 'processing',
+        worker_id = p_worker_id,
+        account = p_account
+    WHERE id = claimed.id
+    RETURNING * INTO claimed;
+
+    IF p_account IS NOT NULL THEN
+        -- Counted once per account however often the request comes back
+        INSERT INTO account_claims (account, request_id, model_mode, prompt_mode)
+        VALUES (p_account, claimed.id, claimed.model_mode, claimed.prompt_mode)
+        ON CONFLICT (account, request_id) DO NOTHING;
+    END IF;
+
+    RETURN NEXT claimed;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION claim_next_request(TEXT, TEXT[], TEXT[], TEXT[], TEXT[], TEXT) TO service_role;
+
+-- Expired requests notify their webhook like failed ones, with the error
+CREATE OR REPLACE FUNCTION webhook_payload(r requests)
+RETURNS JSONB
+LANGUAGE sql STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'request_id', r.id,
+        'status', r.status,
+        'prompt', r.prompt,
+        'timestamp', r.updated_at,
+        'worker_id', r.worker_id
+    ) || CASE r.status
+        WHEN 'completed' THEN jsonb_build_object('response', r.response)
+        WHEN 'failed' THEN jsonb_build_object('error', r.error)
+        WHEN 'expired' THEN jsonb_build_object('error', r.error)
+        ELSE '{}'::jsonb
+    END;
+$$;
+
+DROP TRIGGER IF EXISTS enqueue_request_webhook ON requests;
+CREATE TRIGGER enqueue_request_webhook
+    AFTER UPDATE OF status ON requests
+    FOR EACH ROW
+    WHEN (
+        NEW.status IN ('completed', 'failed', 'expired')
+        AND OLD.status IS DISTINCT FROM NEW.status
+        AND NEW.webhook_url IS NOT NULL
+        AND NOT NEW.webhook_delivered
+    )
+    EXECUTE FUNCTION enqueue_request_webhook();
+
+-- Success message
+SELECT 'Deadlines migration completed successfully!' as message;
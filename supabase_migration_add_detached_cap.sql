@@ -0,0 +1,91 @@
+-- Migration: Detached jobs capped per account
+-- A worker may submit a long prompt (deep research, ...) and harvest the
+-- answer later instead of waiting on the tab. Several workers can drive the
+-- same ChatGPT account, so the cap on detached jobs is checked here against
+-- every processing request of the claiming account that has a chat_url,
+-- rather than by each worker on its own.
+-- Run after supabase_migration_add_retries.sql.
+
+CREATE INDEX IF NOT EXISTS idx_requests_account_processing ON requests(account) WHERE status = 'processing';
+
+-- Same as in supabase_migration_add_retries.sql, plus: once the account (or,
+-- for a worker that never registered, the worker itself) has p_max_detached
+-- requests detached, requests in p_detach_modes are skipped. A new attempt
+-- starts without a chat_url, so a retried detached request no longer counts.
+DROP FUNCTION IF EXISTS claim_next_request(TEXT, TEXT[], TEXT[], TEXT[], TEXT[], TEXT);
+CREATE OR REPLACE FUNCTION claim_next_request(
+    p_worker_id TEXT,
+    p_exclude_prompt_modes TEXT[] DEFAULT NULL,
+    p_model_modes TEXT[] DEFAULT NULL,
+    p_prompt_modes TEXT[] DEFAULT NULL,
+    p_prefer_prompt_modes TEXT[] DEFAULT NULL,
+    p_account TEXT DEFAULT NULL,
+    p_detach_modes TEXT[] DEFAULT NULL,
+    p_max_detached INTEGER DEFAULT NULL
+)
+RETURNS SETOF requests
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    claimed requests;
+    exclude_modes TEXT[] := p_exclude_prompt_modes;
+    detached INTEGER;
+BEGIN
+    UPDATE requests
+    SET status = 'expired',
+        error = 'Deadline passed before a worker picked the request up'
+    WHERE status = 'pending'
+      AND deadline_at IS NOT NULL
+      AND deadline_at <= NOW();
+
+    IF p_detach_modes IS NOT NULL AND p_max_detached IS NOT NULL THEN
+        SELECT COUNT(*) INTO detached
+        FROM requests
+        WHERE status = 'processing'
+          AND chat_url IS NOT NULL
+          AND (CASE WHEN p_account IS NULL THEN worker_id = p_worker_id ELSE account = p_account END);
+        IF detached >= p_max_detached THEN
+            exclude_modes := COALESCE(exclude_modes, ARRAY[]::TEXT[]) || p_detach_modes;
+        END IF;
+    END IF;
+
+    SELECT * INTO claimed
+    FROM requests r
+    WHERE r.status = 'pending'
+      AND (r.retry_at IS NULL
+           OR r.retry_at <= NOW() - CASE WHEN r.failed_worker_id = p_worker_id THEN INTERVAL '30 seconds' ELSE INTERVAL '0 seconds' END)
+      AND (exclude_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode <> ALL(exclude_modes))
+      AND (p_prompt_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode = ANY(p_prompt_modes))
+      AND (p_model_modes IS NULL OR COALESCE(r.model_mode, 'auto') = ANY(p_model_modes))
+    ORDER BY COALESCE(r.prompt_mode = ANY(p_prefer_prompt_modes), FALSE) DESC, r.created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE requests
+    SET status = 'processing',
+        worker_id = p_worker_id,
+        account = p_account,
+        retry_at = NULL,
+        chat_url = NULL
+    WHERE id = claimed.id
+    RETURNING * INTO claimed;
+
+    IF p_account IS NOT NULL THEN
+        -- Counted once per account however often the request comes back
+        INSERT INTO account_claims (account, request_id, model_mode, prompt_mode)
+        VALUES (p_account, claimed.id, claimed.model_mode, claimed.prompt_mode)
+        ON CONFLICT (account, request_id) DO NOTHING;
+    END IF;
+
+    RETURN NEXT claimed;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION claim_next_request(TEXT, TEXT[], TEXT[], TEXT[], TEXT[], TEXT, TEXT[], INTEGER) TO service_role;
+
+-- Success message
+SELECT 'Detached cap migration completed successfully!' as message;
@@ -0,0 +1,69 @@
+-- Migration: Queue statistics for admission control
+-- The server estimates how long a new request would wait from the pending
+-- depth and the recent drain rate per prompt mode, and turns work away with
+-- 429 once that wait passes its limits
+
+-- One row per request that left the queue for good, in any final status:
+-- expired and cancelled requests free up the queue just like answered or
+-- failed ones. Kept separately from requests because clients may delete
+-- their requests right after completion
+CREATE TABLE IF NOT EXISTS request_completions (
+    id BIGSERIAL PRIMARY KEY,
+    prompt_mode TEXT,
+    status TEXT NOT NULL,
+    finished_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_request_completions_finished_at ON request_completions(finished_at DESC);
+
+CREATE OR REPLACE FUNCTION record_request_completion()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO request_completions (prompt_mode, status) VALUES (NEW.prompt_mode, NEW.status);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS record_request_completion ON requests;
+CREATE TRIGGER record_request_completion
+    AFTER UPDATE OF status ON requests
+    FOR EACH ROW
+    WHEN (NEW.status IN ('completed', 'failed', 'expired', 'cancelled') AND OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION record_request_completion();
+
+-- Pending requests and requests finished since a point in time, per prompt mode
+CREATE OR REPLACE FUNCTION queue_stats(since TIMESTAMP WITH TIME ZONE)
+RETURNS TABLE (prompt_mode TEXT, pending BIGINT, finished BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT s.mode, SUM(s.pending)::BIGINT, SUM(s.finished)::BIGINT
+    FROM (
+        SELECT r.prompt_mode AS mode, COUNT(*) AS pending, 0 AS finished
+        FROM requests r
+        WHERE r.status = 'pending'
+        GROUP BY r.prompt_mode
+        UNION ALL
+        SELECT c.prompt_mode, 0, COUNT(*)
+        FROM request_completions c
+        WHERE c.finished_at >= since
+        GROUP BY c.prompt_mode
+    ) s
+    GROUP BY s.mode;
+$$;
+
+ALTER TABLE request_completions ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Enable full access for service_role" ON request_completions
+    FOR ALL
+    TO service_role
+    USING (true)
+    WITH CHECK (true);
+
+GRANT ALL ON request_completions TO service_role;
+GRANT USAGE, SELECT ON SEQUENCE request_completions_id_seq TO service_role;
+GRANT EXECUTE ON FUNCTION queue_stats(TIMESTAMP WITH TIME ZONE) TO service_role;
+
+-- Success message
+SELECT 'Queue statistics migration completed successfully!' as message;
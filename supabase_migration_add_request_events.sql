@@ -0,0 +1,59 @@
+-- Migration: Request lifecycle events
+-- Publishes every request lifecycle change on the `request_events` channel so
+-- each server process (uvicorn worker or replica) listening with DATABASE_URL
+-- set learns about it, whichever process or client made the change.
+-- Payload: {"type": created|claimed|requeued|completed|failed|deleted,
+--           "id": <request id>, "status": <new status>, "worker_id": ...}
+
+CREATE OR REPLACE FUNCTION notify_request_event()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    r requests;
+    event_type TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        r := OLD;
+        event_type := 'deleted';
+    ELSE
+        r := NEW;
+        event_type := CASE
+            WHEN TG_OP = 'INSERT' THEN 'created'
+            WHEN NEW.status = 'processing' THEN 'claimed'
+            WHEN NEW.status = 'pending' THEN 'requeued'
+            ELSE NEW.status
+        END;
+    END IF;
+
+    PERFORM pg_notify('request_events', json_build_object(
+        'type', event_type,
+        'id', r.id,
+        'status', r.status,
+        'worker_id', r.worker_id
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS notify_request_created ON requests;
+CREATE TRIGGER notify_request_created
+    AFTER INSERT ON requests
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_request_event();
+
+DROP TRIGGER IF EXISTS notify_request_status ON requests;
+CREATE TRIGGER notify_request_status
+    AFTER UPDATE OF status ON requests
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION notify_request_event();
+
+DROP TRIGGER IF EXISTS notify_request_deleted ON requests;
+CREATE TRIGGER notify_request_deleted
+    AFTER DELETE ON requests
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_request_event();
+
+-- Success message
+SELECT 'Request events migration completed successfully!' as message;
@@ -0,0 +1,37 @@
+-- Migration: Batched result reports
+-- Workers journal every result locally and replay the ones the server never
+-- acknowledged through POST /worker/results. One call applies a whole batch.
+-- A result only applies while the request is still processing by the worker
+-- that reports it: requests that finished, went back to the queue, were
+-- claimed by another worker since (or were deleted) are left untouched, so a
+-- replayed result never overwrites a newer outcome or someone else's attempt.
+-- Run after supabase_migration_add_cancellation.sql.
+
+-- p_results: [{"id": 1, "worker_id": "w1", "status": "completed",
+--              "response": "...", "chat_url": "...", "error": null}, ...]
+CREATE OR REPLACE FUNCTION report_results(p_results JSONB)
+RETURNS SETOF requests
+LANGUAGE sql
+AS $$
+    UPDATE requests r
+    SET status = x.status,
+        response = CASE WHEN x.status = 'completed' THEN x.response ELSE r.response END,
+        error = CASE
+            WHEN x.status = 'completed' THEN NULL
+            WHEN x.status = 'cancelled' THEN COALESCE(x.error, 'Cancelled by the client')
+            ELSE x.error
+        END,
+        chat_url = COALESCE(x.chat_url, r.chat_url),
+        updated_at = NOW()
+    FROM jsonb_to_recordset(p_results) AS x(id BIGINT, worker_id TEXT, status TEXT, response TEXT, error TEXT, chat_url TEXT)
+    WHERE r.id = x.id
+      AND r.status = 'processing'
+      AND r.worker_id = x.worker_id
+      AND x.status IN ('completed', 'failed', 'expired', 'cancelled')
+    RETURNING r.*;
+$$;
+
+GRANT EXECUTE ON FUNCTION report_results(JSONB) TO service_role;
+
+-- Success message
+SELECT 'Result batches migration completed successfully!' as message;
@@ -0,0 +1,178 @@
+-- Migration: Automatic retries
+-- A worker reports each failed attempt as retryable (timeouts, a composer
+-- that did not appear, a navigation race) or permanent. A retryable failure
+-- puts the request back in the queue at its original position after a short,
+-- growing delay; only permanent failures and requests out of attempts end up
+-- 'failed'. The worker whose attempt failed waits a little longer before it
+-- may claim the request again, so another tab usually gets the next attempt.
+-- Workers also journal retries, requeues and detaches, so report_results
+-- learns to replay them.
+-- Run after supabase_migration_add_deadlines.sql and
+-- supabase_migration_add_result_batches.sql.
+
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS max_attempts INTEGER NOT NULL DEFAULT 3;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS retry_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS failed_worker_id TEXT;
+
+-- Record a failed attempt of a processing request: back to pending with
+-- retry_at = now + p_delay_seconds * 2^(attempts so far), or failed when the
+-- error is permanent or this was the last attempt
+CREATE OR REPLACE FUNCTION fail_attempt(p_request_id BIGINT, p_error TEXT, p_retryable BOOLEAN, p_delay_seconds DOUBLE PRECISION)
+RETURNS SETOF requests
+LANGUAGE sql
+AS $$
+    UPDATE requests
+    SET attempts = attempts + 1,
+        status = CASE WHEN p_retryable AND attempts + 1 < max_attempts THEN 'pending' ELSE 'failed' END,
+        worker_id = CASE WHEN p_retryable AND attempts + 1 < max_attempts THEN NULL ELSE worker_id END,
+        retry_at = CASE
+            WHEN p_retryable AND attempts + 1 < max_attempts
+            THEN NOW() + make_interval(secs => p_delay_seconds * power(2, attempts))
+        END,
+        failed_worker_id = worker_id,
+        error = p_error,
+        updated_at = NOW()
+    WHERE id = p_request_id
+      AND status = 'processing'
+    RETURNING *;
+$$;
+
+GRANT EXECUTE ON FUNCTION fail_attempt(BIGINT, TEXT, BOOLEAN, DOUBLE PRECISION) TO service_role;
+
+-- Same as in supabase_migration_add_deadlines.sql, plus: requests waiting
+-- for a retry are skipped until retry_at, and the worker whose attempt
+-- failed last waits another 30 seconds
+CREATE OR REPLACE FUNCTION claim_next_request(
+    p_worker_id TEXT,
+    p_exclude_prompt_modes TEXT[] DEFAULT NULL,
+    p_model_modes TEXT[] DEFAULT NULL,
+    p_prompt_modes TEXT[] DEFAULT NULL,
+    p_prefer_prompt_modes TEXT[] DEFAULT NULL,
+    p_account TEXT DEFAULT NULL
+)
+RETURNS SETOF requests
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    claimed requests;
+BEGIN
+    UPDATE requests
+    SET status = 'expired',
+        error = 'Deadline passed before a worker picked the request up'
+    WHERE status = 'pending'
+      AND deadline_at IS NOT NULL
+      AND deadline_at <= NOW();
+
+    SELECT * INTO claimed
+    FROM requests r
+    WHERE r.status = 'pending'
+      AND (r.retry_at IS NULL
+           OR r.retry_at <= NOW() - CASE WHEN r.failed_worker_id = p_worker_id THEN INTERVAL '30 seconds' ELSE INTERVAL '0 seconds' END)
+      AND (p_exclude_prompt_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode <> ALL(p_exclude_prompt_modes))
+      AND (p_prompt_modes IS NULL OR r.prompt_mode IS NULL OR r.prompt_mode = ANY(p_prompt_modes))
+      AND (p_model_modes IS NULL OR COALESCE(r.model_mode, 'auto') = ANY(p_model_modes))
+    ORDER BY COALESCE(r.prompt_mode = ANY(p_prefer_prompt_modes), FALSE) DESC, r.created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    UPDATE requests
+    SET status = 'processing',
+        worker_id = p_worker_id,
+        account = p_account,
+        retry_at = NULL
+    WHERE id = claimed.id
+    RETURNING * INTO claimed;
+
+    IF p_account IS NOT NULL THEN
+        -- Counted once per account however often the request comes back
+        INSERT INTO account_claims (account, request_id, model_mode, prompt_mode)
+        VALUES (p_account, claimed.id, claimed.model_mode, claimed.prompt_mode)
+        ON CONFLICT (account, request_id) DO NOTHING;
+    END IF;
+
+    RETURN NEXT claimed;
+END;
+$$;
+
+-- Replaces the version from supabase_migration_add_result_batches.sql.
+-- Besides final results, a batch may carry the reports that keep a request
+-- alive. Like final results they only apply while the request is still
+-- processing by the reporting worker:
+--   retry    a failed attempt another attempt may get past (see fail_attempt)
+--   requeued the worker's account was throttled; back to the queue as is
+--   detached the worker stopped watching the chat at chat_url
+-- Items are applied in order, so a detach followed by a completion works.
+DROP FUNCTION IF EXISTS report_results(JSONB);
+CREATE OR REPLACE FUNCTION report_results(p_results JSONB, p_retry_delay_seconds DOUBLE PRECISION DEFAULT 10)
+RETURNS SETOF requests
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    x RECORD;
+    updated requests;
+BEGIN
+    FOR x IN
+        SELECT * FROM jsonb_to_recordset(p_results) AS t(id BIGINT, worker_id TEXT, status TEXT, response TEXT, error TEXT, chat_url TEXT)
+    LOOP
+        -- Lock the request if it is still this worker's attempt; otherwise
+        -- the report is stale (retried, requeued, claimed again or finished)
+        PERFORM 1 FROM requests
+        WHERE id = x.id AND status = 'processing' AND worker_id = x.worker_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            CONTINUE;
+        END IF;
+
+        IF x.status = 'retry' THEN
+            SELECT * INTO updated FROM fail_attempt(x.id, x.error, TRUE, p_retry_delay_seconds);
+            IF NOT FOUND THEN
+                CONTINUE;
+            END IF;
+            IF updated.status = 'pending' AND updated.cancel_requested THEN
+                SELECT * INTO updated FROM cancel_request(x.id);
+            END IF;
+            RETURN NEXT updated;
+        ELSIF x.status = 'requeued' THEN
+            RETURN QUERY
+            UPDATE requests
+            SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'pending' END,
+                error = CASE WHEN cancel_requested THEN 'Cancelled by the client' ELSE error END,
+                worker_id = NULL,
+                updated_at = NOW()
+            WHERE id = x.id
+            RETURNING *;
+        ELSIF x.status = 'detached' THEN
+            RETURN QUERY
+            UPDATE requests
+            SET chat_url = x.chat_url,
+                updated_at = NOW()
+            WHERE id = x.id
+            RETURNING *;
+        ELSIF x.status IN ('completed', 'failed', 'expired', 'cancelled') THEN
+            RETURN QUERY
+            UPDATE requests r
+            SET status = x.status,
+                response = CASE WHEN x.status = 'completed' THEN x.response ELSE r.response END,
+                error = CASE
+                    WHEN x.status = 'completed' THEN NULL
+                    WHEN x.status = 'cancelled' THEN COALESCE(x.error, 'Cancelled by the client')
+                    ELSE x.error
+                END,
+                chat_url = COALESCE(x.chat_url, r.chat_url),
+                updated_at = NOW()
+            WHERE r.id = x.id
+            RETURNING r.*;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION report_results(JSONB, DOUBLE PRECISION) TO service_role;
+
+-- Success message
+SELECT 'Retries migration completed successfully!' as message;
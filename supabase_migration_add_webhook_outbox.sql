@@ -0,0 +1,117 @@
+-- Migration: Durable webhook outbox
+-- Every request that reaches completed/failed with a webhook URL gets an
+-- outbox row in the same transaction, so a restart can no longer lose a
+-- delivery; the server's dispatcher claims due rows, retries with backoff and
+-- parks rows that keep failing as dead letters until they are replayed
+
+CREATE TABLE IF NOT EXISTS webhook_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    -- No foreign key: clients may delete the request before delivery
+    request_id BIGINT NOT NULL,
+    webhook_url TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    -- pending, delivering, delivered or dead
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    -- A delivering row whose lease ran out (dispatcher crashed) is claimed again
+    locked_until TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_request_id ON webhook_outbox(request_id);
+
+DROP TRIGGER IF EXISTS update_webhook_outbox_updated_at ON webhook_outbox;
+CREATE TRIGGER update_webhook_outbox_updated_at
+    BEFORE UPDATE ON webhook_outbox
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Same payload the server used to build in Python
+CREATE OR REPLACE FUNCTION webhook_payload(r requests)
+RETURNS JSONB
+LANGUAGE sql STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'request_id', r.id,
+        'status', r.status,
+        'prompt', r.prompt,
+        'timestamp', r.updated_at,
+        'worker_id', r.worker_id
+    ) || CASE r.status
+        WHEN 'completed' THEN jsonb_build_object('response', r.response)
+        WHEN 'failed' THEN jsonb_build_object('error', r.error)
+        ELSE '{}'::jsonb
+    END;
+$$;
+
+CREATE OR REPLACE FUNCTION enqueue_request_webhook()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO webhook_outbox (request_id, webhook_url, payload)
+    VALUES (NEW.id, NEW.webhook_url, webhook_payload(NEW));
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS enqueue_request_webhook ON requests;
+CREATE TRIGGER enqueue_request_webhook
+    AFTER UPDATE OF status ON requests
+    FOR EACH ROW
+    WHEN (
+        NEW.status IN ('completed', 'failed')
+        AND OLD.status IS DISTINCT FROM NEW.status
+        AND NEW.webhook_url IS NOT NULL
+        AND NOT NEW.webhook_delivered
+    )
+    EXECUTE FUNCTION enqueue_request_webhook();
+
+-- Lease up to batch_size due deliveries; concurrent dispatchers skip each
+-- other's rows instead of blocking on them
+CREATE OR REPLACE FUNCTION claim_webhook_outbox(batch_size INTEGER, lease_seconds INTEGER)
+RETURNS SETOF webhook_outbox
+LANGUAGE sql
+AS $$
+    UPDATE webhook_outbox o
+    SET status = 'delivering',
+        attempts = o.attempts + 1,
+        locked_until = NOW() + make_interval(secs => lease_seconds)
+    WHERE o.id IN (
+        SELECT id FROM webhook_outbox
+        WHERE (status = 'pending' AND next_attempt_at <= NOW())
+           OR (status = 'delivering' AND locked_until < NOW())
+        ORDER BY next_attempt_at
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.*;
+$$;
+
+-- Deliveries that were still owed when the migration ran
+INSERT INTO webhook_outbox (request_id, webhook_url, payload)
+SELECT r.id, r.webhook_url, webhook_payload(r)
+FROM requests r
+WHERE r.status IN ('completed', 'failed')
+  AND r.webhook_url IS NOT NULL
+  AND NOT r.webhook_delivered
+  AND NOT EXISTS (SELECT 1 FROM webhook_outbox o WHERE o.request_id = r.id);
+
+ALTER TABLE webhook_outbox ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Enable full access for service_role" ON webhook_outbox
+    FOR ALL
+    TO service_role
+    USING (true)
+    WITH CHECK (true);
+
+GRANT ALL ON webhook_outbox TO service_role;
+GRANT USAGE, SELECT ON SEQUENCE webhook_outbox_id_seq TO service_role;
+GRANT EXECUTE ON FUNCTION claim_webhook_outbox(INTEGER, INTEGER) TO service_role;
+
+-- Success message
+SELECT 'Webhook outbox migration completed successfully!' as message;
@@ -4,18 +4,36 @@
 from __future__ import annotations
 
 import argparse
-import base64
 import json
 import logging
+import queue
+import re
+import threading
 import time
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 import websocket
 
 import cdp_send_prompt as bookmarklet
 
+try:
+    from .image_cache import DEFAULT_CACHE_DIR, CachedImage, ImageCache, ImageFetchError
+    from .detached_jobs import DEFAULT_STATE_DIR, DetachedJob, DetachedJobStore
+    from .chrome_supervisor import DEFAULT_PROFILE_DIR, ChromeSupervisor, close_tab, open_tab
+    from .vpn_rotator import VpnRotator
+    from .result_journal import JournalEntry, ResultJournal
+except ImportError:
+    from image_cache import DEFAULT_CACHE_DIR, CachedImage, ImageCache, ImageFetchError
+    from detached_jobs import DEFAULT_STATE_DIR, DetachedJob, DetachedJobStore
+    from chrome_supervisor import DEFAULT_PROFILE_DIR, ChromeSupervisor, close_tab, open_tab
+    from vpn_rotator import VpnRotator
+    from result_journal import JournalEntry, ResultJournal
+
 logger = logging.getLogger(__name__)
 
 # Import VPN rotation module (optional dependency)
@@ -32,6 +50,24 @@ except ImportError:
         VPN_AVAILABLE = False
         logger.warning("vpn_rotate_min module not available, VPN rotation will be disabled")
 
+# Timeout (seconds) for every call to the relay server
+HTTP_TIMEOUT = 30.0
+
+# Shared keep-alive session for relay server calls
+_http_session: Optional[requests.Session] = None
+
+
+def get_http_session() -> requests.Session:
+    """Get or create the pooled HTTP session used to talk to the relay server"""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="ChatGPT relay worker")
@@ -52,6 +88,37 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--vpn-rotate", action="store_true", help="Enable VPN rotation for search mode requests (requires NordVPN)")
     parser.add_argument("--vpn-region", help="Optional VPN region to prefer (e.g., 'france', 'united_states')")
     parser.add_argument("--vpn-max-retries", type=int, default=2, help="Maximum retry attempts for VPN connection")
+    parser.add_argument("--vpn-max-age", type=float, default=900.0, help="Rotate a VPN exit at the latest this many seconds after connecting, before the next search job")
+    parser.add_argument("--vpn-searches-per-exit", type=int, default=1, help="Search jobs that may share one VPN exit before it is rotated (default: 1)")
+    parser.add_argument("--image-cache-dir", default=str(DEFAULT_CACHE_DIR), help="Directory for the on-disk image cache")
+    parser.add_argument("--image-cache-max-mb", type=int, default=256, help="Maximum size of the image cache in megabytes")
+    parser.add_argument("--image-cache-ttl", type=float, default=300.0, help="Seconds a cached image URL is trusted before it is revalidated with a conditional GET")
+    parser.add_argument("--image-max-dimension", type=int, default=0, help="Downscale images whose longest side exceeds this many pixels (0 disables, requires Pillow)")
+    parser.add_argument("--image-quality", type=int, default=85, help="JPEG quality used when recompressing downscaled images")
+    parser.add_argument("--page-timeouts", type=json.loads, default={}, help='JSON object overriding bookmarklet wait timeouts in ms, e.g. \'{"composer": 15000, "imageUpload": 90000}\'')
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="Forward partial responses to the server while ChatGPT is still writing")
+    parser.add_argument("--spa-navigation", action=argparse.BooleanOptionalAction, default=True, help="Start new chats through ChatGPT's in-app router instead of a full page reload (falls back to a reload on failure; jobs with a model_mode always reload so ?model= applies)")
+    parser.add_argument("--block-traffic", action="store_true", help="Block analytics, fonts, avatars and tracking requests in the worker tab")
+    parser.add_argument("--block-urls", help="Comma-separated URL patterns to block (default: built-in list of non-essential traffic)")
+    parser.add_argument("--allow-urls", help="Comma-separated URL patterns to remove from the block list")
+    parser.add_argument("--manage-chrome", action="store_true", help="Launch and supervise Chrome from the worker instead of attaching to a running instance")
+    parser.add_argument("--chrome-binary", default="chromium-browser", help="Chrome executable used with --manage-chrome")
+    parser.add_argument("--chrome-profile", default=str(DEFAULT_PROFILE_DIR), help="Persistent Chrome profile directory used with --manage-chrome")
+    parser.add_argument("--headless", action="store_true", help="Run the managed Chrome headless (log the profile in once without it)")
+    parser.add_argument("--recycle-after-jobs", type=int, default=50, help="Replace the worker tab with a fresh one after this many jobs (0 disables)")
+    parser.add_argument("--recycle-heap-growth", type=float, default=3.0, help="Replace the worker tab when its JS heap grows past this multiple of the size after its first job (0 disables)")
+    parser.add_argument("--account", help="Label of the ChatGPT account (Chrome profile) this worker drives (default: worker_id)")
+    parser.add_argument("--model-modes", default="auto,thinking,instant", help="Comma-separated model modes the account offers")
+    parser.add_argument("--prompt-modes", default="search,study,deep", help="Comma-separated prompt modes the account may use")
+    parser.add_argument("--throttle-backoff", type=float, default=60.0, help="Initial pause in seconds after ChatGPT throttles the account without saying for how long")
+    parser.add_argument("--throttle-max-backoff", type=float, default=3600.0, help="Upper bound in seconds for the exponential throttle backoff")
+    parser.add_argument("--detach-modes", default="deep", help="Comma-separated prompt modes submitted without waiting for the answer, which is harvested later")
+    parser.add_argument("--max-detached", type=int, default=3, help="Maximum detached jobs outstanding for this worker's account, counted by the server across all its workers (0 waits for every answer)")
+    parser.add_argument("--harvest-interval", type=float, default=60.0, help="Seconds between checks of a detached conversation")
+    parser.add_argument("--detached-max-age", type=float, default=3600.0, help="Fail a detached job that has no answer after this many seconds")
+    parser.add_argument("--heartbeat-interval", type=float, default=5.0, help="Seconds between checks whether the running request was cancelled (0 disables)")
+    parser.add_argument("--result-journal", help="File that keeps results until the server acknowledges them (default: ~/.cache/chatgpt-relay/results-<worker_id>.jsonl)")
+    parser.add_argument("--detached-state", help="File that keeps detached jobs across restarts (default: ~/.cache/chatgpt-relay/detached-<worker_id>.json)")
     return parser.parse_args()
 
 
@@ -65,37 +132,420 @@ def cdp_evaluate(send, expression: str, return_by_value: bool = True, await_prom
     return result.get("result", {})
 
 
-def get_saved_files(send) -> List[str]:
-    result = cdp_evaluate(
-        send,
-        """(() => {
-        try {
-            return JSON.parse(localStorage.getItem('chatgpt-files') || '[]');
-        } catch (err) {
-            return [];
-        }
-    })()""",
+BOOKMARKLET_ENTRYPOINT = "window.__chatgptBookmarkletRun"
+
+# CDP binding the page calls with each streamed response delta
+STREAM_BINDING = "__chatgptRelayChunk"
+
+# Requests the automation never needs; patterns use Network.setBlockedURLs wildcards
+DEFAULT_BLOCKED_URLS = [
+    # Analytics and telemetry
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*datadoghq.com*",
+    "*sentry.io*",
+    "*segment.io*",
+    "*segment.com*",
+    "*intercom.io*",
+    "*intercomcdn.com*",
+    "*chatgpt.com/ces/*",
+    # Tracking beacons
+    "*doubleclick.net*",
+    "*facebook.net*",
+    "*hotjar.com*",
+    "*clarity.ms*",
+    # Avatars
+    "*gravatar.com*",
+    "*googleusercontent.com*",
+    # Web fonts
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+]
+
+
+def parse_url_patterns(value: Optional[str]) -> List[str]:
+    """Split a comma-separated pattern list from the command line."""
+    if not value:
+        return []
+    return [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+
+
+def split_modes(value: str) -> List[str]:
+    """Split a comma-separated list of prompt or model modes."""
+    return [mode.strip() for mode in value.split(",") if mode.strip()]
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """Turn a job's ISO 8601 `deadline_at` into a Unix timestamp."""
+    if not value:
+        return None
+    # Python < 3.11 only parses "+00:00" offsets and 3 or 6 fractional digits
+    text = value.replace("Z", "+00:00")
+    text = re.sub(r"\.(\d+)", lambda match: "." + (match.group(1) + "000000")[:6], text)
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        logger.warning("Ignoring unparseable deadline %r", value)
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def build_blocked_urls(block_urls: Optional[str], allow_urls: Optional[str]) -> List[str]:
+    """Resolve the configured block list, minus anything explicitly allowed."""
+    blocked = parse_url_patterns(block_urls) or list(DEFAULT_BLOCKED_URLS)
+    allowed = set(parse_url_patterns(allow_urls))
+    return [pattern for pattern in blocked if pattern not in allowed]
+
+
+def build_install_script(script: str) -> str:
+    """Wrap the bookmarklet so evaluating it only defines the job entrypoint."""
+    return f"window.__chatgptBookmarkletInstallOnly = true;\n{script}"
+
+
+class TabCrashed(RuntimeError):
+    """The worker tab crashed, was closed or its debugging session was detached."""
+
+
+class CdpError(RuntimeError):
+    """Chrome answered a CDP command with an error, e.g. a context destroyed by a navigation."""
+
+
+# Errors that mean the tab (or the whole browser) went away mid-job
+TAB_LOST_ERRORS = (
+    TabCrashed,
+    websocket.WebSocketConnectionClosedException,
+    websocket.WebSocketBadStatusException,
+    ConnectionError,
+)
+
+
+class JobError(RuntimeError):
+    """The bookmarklet failed a job; `code` names the step that gave up, if it knew."""
+
+    def __init__(self, message: str, code: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+# Bookmarklet error codes for a page that was not ready or too slow; another
+# attempt usually gets past them. Any other code, and uncaught exceptions in
+# the page script (code None), fail the same way every time.
+RETRYABLE_JOB_ERRORS = frozenset({
+    "image_input_missing",
+    "image_upload_timeout",
+    "image_upload_failed",
+    "composer_missing",
+    "send_button_missing",
+    "response_timeout",
+    "copy_button_missing",
+    "clipboard_unreadable",
+    "empty_response",
+    # The evaluate settled without a payload, typically a page that reloaded mid-job
+    "no_result",
+})
+
+
+def is_retryable(exc: Exception) -> bool:
+    """
+    Whether another attempt at a failed job, on this tab or another, may succeed.
+
+    Bookmarklet failures are classified by their code and image failures by
+    what went wrong fetching the image. CDP errors, lost tabs and network
+    timeouts are transient; any other exception in the worker is a bug and
+    permanent.
+    """
+    if isinstance(exc, JobError):
+        return exc.code in RETRYABLE_JOB_ERRORS
+    if isinstance(exc, ImageFetchError):
+        return exc.retryable
+    return isinstance(
+        exc,
+        (CdpError, TabCrashed, TimeoutError, ConnectionError, websocket.WebSocketException, requests.RequestException),
     )
-    return result.get("value", []) if isinstance(result.get("value"), list) else []
 
 
-def get_file_content(send, key: str) -> Optional[str]:
-    result = cdp_evaluate(
-        send,
-        f"localStorage.getItem({json.dumps(key)})",
+class CdpSession:
+    """
+    Long-lived CDP connection to the worker tab.
+
+    The bookmarklet is registered with Page.addScriptToEvaluateOnNewDocument when
+    the session connects, so every page load in the tab already exposes the job
+    entrypoint and the script source is not re-sent for each job.
+
+    Crash and close events for the tab abort the call in progress with
+    TabCrashed, so a job does not wait out its timeout on a dead tab.
+
+    Calls are made from the job loop; other threads may only use notify().
+    """
+
+    def __init__(
+        self,
+        ws_url: str,
+        timeout: float,
+        script: str,
+        blocked_urls: Optional[List[str]] = None,
+        target_id: Optional[str] = None,
+    ) -> None:
+        self.ws_url = ws_url
+        self.timeout = timeout
+        self.install_script = build_install_script(script)
+        self.blocked_urls = blocked_urls
+        self.target_id = target_id
+        self.crashed: Optional[str] = None
+        self._ws: Optional[websocket.WebSocket] = None
+        self._message_id = 0
+        self._id_lock = threading.Lock()
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+    def connect(self) -> None:
+        self._ws = websocket.create_connection(self.ws_url, timeout=self.timeout)
+        self.send("Runtime.enable")
+        self.send("Inspector.enable")
+        self.send("Performance.enable")
+        self.send("Page.addScriptToEvaluateOnNewDocument", {"source": self.install_script})
+        self.send("Runtime.addBinding", {"name": STREAM_BINDING})
+        if self.target_id:
+            try:
+                self.send("Target.setDiscoverTargets", {"discover": True})
+            except RuntimeError as e:
+                logger.debug(f"Target discovery unavailable: {e}")
+        if self.blocked_urls:
+            configure_network(self.send, self.blocked_urls)
+
+    def on(self, method: str, handler: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+        """Register (or with None, remove) the handler for a CDP event."""
+        if handler is None:
+            self._handlers.pop(method, None)
+        else:
+            self._handlers[method] = handler
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        method = message["method"]
+        params = message.get("params", {})
+        if method == "Inspector.targetCrashed":
+            self._lost("tab crashed")
+        elif method == "Inspector.detached":
+            self._lost(f"debugging session detached ({params.get('reason', 'unknown reason')})")
+        elif method in ("Target.targetDestroyed", "Target.targetCrashed") and params.get("targetId") == self.target_id:
+            self._lost("tab closed" if method == "Target.targetDestroyed" else "tab crashed")
+
+        handler = self._handlers.get(method)
+        if handler is None:
+            return
+        try:
+            handler(params)
+        except Exception as e:
+            logger.warning(f"CDP event handler for {message['method']} failed: {e}")
+
+    def _lost(self, reason: str) -> None:
+        self.crashed = reason
+        raise TabCrashed(reason)
+
+    def close(self) -> None:
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
+        self._ws = None
+
+    def send(
+        self,
+        method: str,
+        params: Optional[Dict[str, Any]] = None,
+        read_timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Call a CDP method and wait for its reply.
+
+        `read_timeout` replaces the session timeout for this call: the reply
+        to an awaited job can take minutes with no events in between.
+        """
+        if self.crashed:
+            raise TabCrashed(self.crashed)
+        if self._ws is None:
+            self.connect()
+        ws = self._ws
+        if read_timeout is not None:
+            ws.settimeout(read_timeout)
+        try:
+            return bookmarklet.call_cdp(ws, method, params, self._next_id(), on_event=self._dispatch)
+        except TabCrashed:
+            raise
+        except RuntimeError as e:
+            # call_cdp reports protocol errors as plain RuntimeErrors
+            raise CdpError(str(e)) from e
+        except websocket.WebSocketException:
+            # Drop the connection so the next call starts from a clean session
+            self.close()
+            raise
+        finally:
+            if read_timeout is not None and self._ws is ws:
+                ws.settimeout(self.timeout)
+
+    def notify(self, method: str, params: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Send a command without waiting for its reply.
+
+        Safe to use from another thread while a call is in flight: the reply
+        carries an id nobody waits for and is skipped by whichever call reads it.
+        """
+        ws = self._ws
+        if ws is None or self.crashed:
+            return
+        payload: Dict[str, Any] = {"id": self._next_id(), "method": method}
+        if params:
+            payload["params"] = params
+        ws.send(json.dumps(payload))
+
+    def _next_id(self) -> int:
+        with self._id_lock:
+            self._message_id += 1
+            return self._message_id
+
+
+def configure_network(send, blocked_urls: List[str]) -> None:
+    """Block non-essential requests (analytics, tracking, avatars, web fonts) in the worker tab."""
+    send("Network.enable", {"maxTotalBufferSize": 0, "maxResourceBufferSize": 0})
+    send("Network.setBlockedURLs", {"urls": blocked_urls})
+    logger.info("Blocking %d URL pattern(s) in worker tab", len(blocked_urls))
+
+
+PAGE_LOAD_METRICS_JS = """(() => {
+    const nav = performance.getEntriesByType('navigation')[0];
+    const resources = performance.getEntriesByType('resource');
+    return {
+        load_ms: nav ? Math.round(nav.loadEventEnd || nav.domContentLoadedEventEnd) : null,
+        dom_content_loaded_ms: nav ? Math.round(nav.domContentLoadedEventEnd) : null,
+        resources: resources.length,
+        transfer_kb: Math.round(resources.reduce((total, entry) => total + (entry.transferSize || 0), (nav && nav.transferSize) || 0) / 1024),
+        js_heap_mb: performance.memory ? Math.round(performance.memory.usedJSHeapSize / 1048576) : null,
+    };
+})()"""
+
+
+def log_page_load_metrics(send) -> None:
+    """Log load time, request count and bytes transferred for the current page."""
+    try:
+        metrics = cdp_evaluate(send, PAGE_LOAD_METRICS_JS).get("value") or {}
+    except Exception as e:
+        logger.debug(f"Failed to read page load metrics: {e}")
+        return
+    logger.info(
+        "Page load: %s ms (DOMContentLoaded %s ms), %s resources, %s KB transferred, JS heap %s MB",
+        metrics.get("load_ms"),
+        metrics.get("dom_content_loaded_ms"),
+        metrics.get("resources"),
+        metrics.get("transfer_kb"),
+        metrics.get("js_heap_mb"),
+    )
+
+
+def ensure_bookmarklet_installed(send, install_script: str) -> None:
+    """Install the bookmarklet in the current document if the page predates the session."""
+    result = cdp_evaluate(send, f"typeof {BOOKMARKLET_ENTRYPOINT} === 'function'")
+    if result.get("value") is True:
+        return
+    logger.info("Bookmarklet entrypoint missing on current page, installing it")
+    send("Runtime.evaluate", {"expression": install_script})
+
+
+FIND_FILE_INPUT_JS = """new Promise((resolve) => {
+    const find = () => {
+        const inputs = Array.from(document.querySelectorAll('input[type="file"]'));
+        return inputs.find((input) => !input.disabled && (input.accept.includes('image') || input.accept === '*' || input.accept === ''))
+            || inputs[0]
+            || null;
+    };
+    const found = find();
+    if (found) {
+        resolve(found);
+        return;
+    }
+    const observer = new MutationObserver(() => {
+        const input = find();
+        if (input) {
+            observer.disconnect();
+            resolve(input);
+        }
+    });
+    observer.observe(document.documentElement, { childList: true, subtree: true });
+    setTimeout(() => {
+        observer.disconnect();
+        resolve(find());
+    }, %d);
+})"""
+
+
+def attach_image_file(send, path: Path, timeout_ms: int = 15000) -> bool:
+    """
+    Attach a local image to ChatGPT's file input with DOM.setFileInputFiles.
+
+    Chrome reads the file straight from disk, so the image never travels through
+    the websocket or V8 as a base64 string. Requires Chrome to run on the same
+    machine as the worker.
+    """
+    result = send(
+        "Runtime.evaluate",
+        {"expression": FIND_FILE_INPUT_JS % timeout_ms, "awaitPromise": True},
     )
-    return result.get("value")
+    object_id = result.get("result", {}).get("objectId")
+    if not object_id:
+        return False
+    try:
+        send("DOM.setFileInputFiles", {"files": [str(path.resolve())], "objectId": object_id})
+    finally:
+        send("Runtime.releaseObject", {"objectId": object_id})
+    return True
+
+
+def forward_chunk(params: Dict[str, Any], on_chunk: Callable[[Dict[str, Any]], None]) -> None:
+    """Pass a streamed response delta from the page binding to `on_chunk`."""
+    if params.get("name") != STREAM_BINDING:
+        return
+    on_chunk(json.loads(params.get("payload") or "{}"))
+
 
+# Default of the bookmarklet's `response` wait (ms), used when a job does not override it
+DEFAULT_RESPONSE_TIMEOUT_MS = 1800000
+# Headroom (s) on top of the response wait for the phases before it (composer,
+# image upload, mode switch, submit) and the extraction after it
+JOB_SETUP_SECONDS = 300.0
 
-def wait_for_new_file(send, previous: List[str]) -> Optional[str]:
-    previous_set = set(previous)
-    while True:
-        current = get_saved_files(send)
-        if current:
-            for name in current:
-                if name not in previous_set:
-                    return name
-        time.sleep(1.0)
+
+def job_read_timeout(options: Dict[str, Any]) -> float:
+    """How long to wait for a bookmarklet job, which logs nothing while ChatGPT writes."""
+    response_ms = (options.get("timeouts") or {}).get("response", DEFAULT_RESPONSE_TIMEOUT_MS)
+    return response_ms / 1000 + JOB_SETUP_SECONDS
+
+
+def run_bookmarklet_job(session: CdpSession, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one job through the installed bookmarklet and return its response payload."""
+    result = session.send(
+        "Runtime.evaluate",
+        {
+            "expression": f"{BOOKMARKLET_ENTRYPOINT}({json.dumps(options)})",
+            "awaitPromise": True,
+            "returnByValue": True,
+        },
+        read_timeout=job_read_timeout(options),
+    )
+    exception = result.get("exceptionDetails")
+    if exception:
+        # Not one of the bookmarklet's own errors: a bug or an unexpected page
+        description = exception.get("exception", {}).get("description") or exception.get("text")
+        raise JobError(f"Bookmarklet failed: {description}")
+
+    payload = result.get("result", {}).get("value")
+    if not isinstance(payload, dict):
+        raise JobError("Bookmarklet finished without returning a response", "no_result")
+    if payload.get("failed"):
+        raise JobError(payload.get("error") or "Bookmarklet failed", payload.get("code"))
+    return payload
 
 
 def normalize_url_for_comparison(url: str) -> str:
@@ -129,17 +579,103 @@ def get_current_page_url(send) -> str:
         return ""
 
 
-def modify_chatgpt_url(send, model_mode: str, chatgpt_url: str, follow_up_chat_url: Optional[str] = None) -> None:
+SPA_NEW_CHAT_JS = """(async (targetUrl, timeoutMs) => {
+    const target = new URL(targetUrl, location.href);
+    if (target.origin !== location.origin || typeof window.__chatgptBookmarkletRun !== 'function') {
+        return { ok: false, method: null };
+    }
+    const isFreshChat = () => location.pathname.replace(/\\/$/, '') === target.pathname.replace(/\\/$/, '')
+        && !document.querySelector('[data-message-author-role]')
+        && document.querySelector('#prompt-textarea, div[contenteditable="true"], textarea');
+    const waitForFreshChat = () => new Promise((resolve) => {
+        if (isFreshChat()) {
+            resolve(true);
+            return;
+        }
+        const observer = new MutationObserver(() => {
+            if (isFreshChat()) {
+                observer.disconnect();
+                clearTimeout(timer);
+                resolve(true);
+            }
+        });
+        const timer = setTimeout(() => {
+            observer.disconnect();
+            resolve(Boolean(isFreshChat()));
+        }, timeoutMs);
+        observer.observe(document.documentElement, { childList: true, subtree: true });
+    });
+
+    // 1. Let the app's router handle the URL, query parameters included
+    history.pushState(history.state, '', target.pathname + target.search);
+    dispatchEvent(new PopStateEvent('popstate', { state: history.state }));
+    if (await waitForFreshChat()) {
+        return { ok: true, method: 'router' };
+    }
+
+    // 2. Click a link the app already renders for the target (sidebar project / new chat)
+    const link = Array.from(document.querySelectorAll('a[href]'))
+        .find((a) => new URL(a.href, location.href).pathname.replace(/\\/$/, '') === target.pathname.replace(/\\/$/, ''))
+        || document.querySelector('[data-testid="create-new-chat-button"]');
+    if (link) {
+        link.click();
+        if (await waitForFreshChat()) {
+            if (location.search !== target.search) {
+                history.replaceState(history.state, '', target.pathname + target.search);
+            }
+            return { ok: true, method: 'link' };
+        }
+    }
+    return { ok: false, method: null };
+})"""
+
+
+def start_chat_in_app(send, target_url: str, timeout_ms: int = 3000) -> Optional[str]:
+    """
+    Try to open a fresh conversation without reloading the page.
+
+    Returns the in-app method that worked, or None when the page is not a live
+    ChatGPT tab or no fresh conversation appeared in time.
+    """
+    try:
+        result = send(
+            "Runtime.evaluate",
+            {
+                "expression": f"{SPA_NEW_CHAT_JS}({json.dumps(target_url)}, {timeout_ms})",
+                "awaitPromise": True,
+                "returnByValue": True,
+            },
+        )
+    except RuntimeError as e:
+        logger.warning(f"In-app navigation failed: {e}")
+        return None
+    value = result.get("result", {}).get("value") or {}
+    return value.get("method") if value.get("ok") else None
+
+
+def modify_chatgpt_url(
+    send,
+    model_mode: str,
+    chatgpt_url: str,
+    follow_up_chat_url: Optional[str] = None,
+    spa_navigation: bool = False,
+) -> str:
     """
     Navigate to ChatGPT URL - either follow-up chat or default URL with model parameter.
     Optimized to skip navigation if already on the target page (only for follow-ups).
-    When follow_up_chat_url is null, always navigates to ensure a NEW chat is created.
+    When follow_up_chat_url is null, always navigates to ensure a NEW chat is created,
+    through the in-app router first when spa_navigation is enabled and the job
+    does not ask for a specific model.
     
     Args:
         send: CDP send function
         model_mode: Model mode (auto, thinking, instant)
         chatgpt_url: Default configured ChatGPT URL
         follow_up_chat_url: Optional URL of existing chat to continue (None means new chat)
+        spa_navigation: Try an in-app navigation before falling back to Page.navigate
+
+    Returns:
+        The path taken: "skipped", "spa-router", "spa-link" or "reload"
     """
     # Determine target URL
     if follow_up_chat_url:
@@ -181,7 +717,20 @@ def modify_chatgpt_url(send, model_mode: str, chatgpt_url: str, follow_up_chat_u
         # Skip navigation if already on the target page (only for follow-ups)
         if normalized_current == normalized_target:
             logger.info(f"Already on target page ({url_type}), skipping navigation: {target_url}")
-            return
+            return "skipped"
+    elif spa_navigation and model_mode:
+        # ChatGPT only reads ?model= on a full page load; an in-app navigation
+        # would keep whichever model the tab last used
+        logger.info(f"Model {model_mode} requested, starting the {url_type} with a full page load")
+    elif spa_navigation:
+        started = time.monotonic()
+        method = start_chat_in_app(send, target_url)
+        if method:
+            logger.info(
+                f"Started {url_type} in-app via {method} in {(time.monotonic() - started) * 1000:.0f} ms: {target_url}"
+            )
+            return f"spa-{method}"
+        logger.info("In-app navigation unavailable, falling back to a full page load")
     
     # Navigate to the URL
     logger.info(f"Navigating to {url_type}: {target_url}")
@@ -189,171 +738,145 @@ def modify_chatgpt_url(send, model_mode: str, chatgpt_url: str, follow_up_chat_u
     
     # Wait for page to load
     time.sleep(3)
-
-
-def fetch_and_encode_image(image_url: str) -> Optional[str]:
-    """Fetch an image URL and convert it to base64 data URI"""
-    try:
-        # If already a data URI, return as-is
-        if image_url.startswith('data:'):
-            logger.info("Image is already a data URI, using as-is")
-            return image_url
-        
-        # Fetch the image
-        logger.info(f"Fetching image from {image_url}")
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()
-        
-        # Get content type
-        content_type = response.headers.get('Content-Type', 'image/png')
-        
-        # Encode to base64
-        encoded = base64.b64encode(response.content).decode('utf-8')
-        data_uri = f"data:{content_type};base64,{encoded}"
-        
-        logger.info(f"Successfully converted image to base64 ({len(encoded)} bytes)")
-        return data_uri
-        
-    except Exception as e:
-        logger.error(f"Failed to fetch and encode image: {e}")
-        return None
-
-
-def rotate_vpn_if_needed(prompt_mode: Optional[str], vpn_enabled: bool, vpn_region: Optional[str] = None, vpn_max_retries: int = 2) -> None:
-    """
-    Rotate VPN connection if prompt_mode is 'search' and VPN rotation is enabled.
-    
-    Args:
-        prompt_mode: The prompt mode (e.g., 'search', 'study')
-        vpn_enabled: Whether VPN rotation is enabled via command-line flag
-        vpn_region: Optional region to prefer for VPN connection
-        vpn_max_retries: Maximum retry attempts for VPN connection
-    """
-    # Skip if VPN rotation is not enabled
-    if not vpn_enabled:
-        return
-    
-    # Skip if not in search mode
-    if prompt_mode != "search":
-        logger.debug(f"Skipping VPN rotation for prompt_mode={prompt_mode}")
-        return
-    
-    # Check if VPN module is available
-    if not VPN_AVAILABLE:
-        logger.warning("VPN rotation requested but vpn_rotate_min module is not available")
-        return
-    
-    logger.info("Search mode detected, rotating VPN to get fresh IP address...")
-    
-    try:
-        result = vpn_rotate_min.rotate(
-            region=vpn_region,
-            require_new=True,
-            max_retries=vpn_max_retries,
-            connect_timeout_s=20,
-        )
-        
-        if result["ok"]:
-            logger.info(
-                f"VPN rotation successful! Connected to: {result.get('server')} "
-                f"({result.get('country')}, {result.get('city')}) "
-                f"[{result.get('protocol')}] (retries: {result.get('retries', 0)})"
-            )
-        else:
-            logger.warning(
-                f"VPN rotation failed: {result.get('error', 'Unknown error')}. "
-                f"Continuing with current connection (retries: {result.get('retries', 0)})"
-            )
-    except Exception as e:
-        logger.error(f"Unexpected error during VPN rotation: {e}. Continuing with current connection")
-        # Don't raise - continue with the request even if VPN rotation fails
+    return "reload"
 
 
 def run_prompt(
-    ws_url: str, 
-    script: str, 
-    job: Dict[str, Any], 
-    timeout: float, 
+    session: CdpSession,
+    job: Dict[str, Any],
     chatgpt_url: str,
-    vpn_enabled: bool = False,
-    vpn_region: Optional[str] = None,
-    vpn_max_retries: int = 2,
+    vpn: Optional[VpnRotator] = None,
+    image: Optional["Future[CachedImage]"] = None,
+    spa_navigation: bool = False,
+    page_timeouts: Optional[Dict[str, int]] = None,
+    on_chunk: Optional[Callable[[Dict[str, Any]], None]] = None,
+    detach: bool = False,
+    deadline: Optional[float] = None,
+    cancelled: Optional[threading.Event] = None,
 ) -> Dict[str, Any]:
-    # Rotate VPN before running the prompt if needed (for search mode)
+    # Search jobs run on a fresh VPN exit, usually rotated while the worker was idle
     prompt_mode = job.get("prompt_mode")
-    rotate_vpn_if_needed(prompt_mode, vpn_enabled, vpn_region, vpn_max_retries)
-    
-    ws = websocket.create_connection(ws_url, timeout=timeout)
-    message_id = 0
+    vpn_exit = vpn.acquire_for_search() if vpn is not None and prompt_mode == "search" else None
 
-    def send(method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        nonlocal message_id
-        message_id += 1
-        return bookmarklet.call_cdp(ws, method, params, message_id)
+    send = session.send
 
-    try:
-        send("Runtime.enable")
-        saved_before = get_saved_files(send)
-
-        # Handle navigation - either to follow-up chat or new chat
-        model_mode = job.get("model_mode")
-        follow_up_chat_url = job.get("follow_up_chat_url")
-        
-        # Always navigate to ensure we're on the correct page
-        # - If follow_up_chat_url is provided: navigate to that specific chat
-        # - If follow_up_chat_url is null: navigate to chatgpt_url to start a new chat
-        modify_chatgpt_url(send, model_mode, chatgpt_url, follow_up_chat_url)
+    # Handle navigation - either to follow-up chat or new chat
+    model_mode = job.get("model_mode")
+    follow_up_chat_url = job.get("follow_up_chat_url")
+    
+    # Always navigate to ensure we're on the correct page
+    # - If follow_up_chat_url is provided: navigate to that specific chat
+    # - If follow_up_chat_url is null: navigate to chatgpt_url to start a new chat
+    navigation = modify_chatgpt_url(send, model_mode, chatgpt_url, follow_up_chat_url, spa_navigation)
+    if navigation == "reload":
         # Wait a bit longer for page to fully stabilize after navigation
         time.sleep(2)
+        log_page_load_metrics(send)
 
-        # Convert image URL to base64 BEFORE setting window variables
-        # This ensures the page is fully loaded when we set the image
-        converted_image = None
-        image_url = job.get("image_url")
-        if image_url:
-            # Convert external URLs to base64 to avoid CSP violations in ChatGPT
-            converted_image = fetch_and_encode_image(image_url)
-            if not converted_image:
-                logger.warning(f"Failed to convert image, skipping image upload")
-
-        # Now set all window variables after page is stable
-        prompt = job["prompt"]
-        send("Runtime.evaluate", {"expression": f"window.__chatgptBookmarkletPrompt = {json.dumps(prompt)};"})
-        
-        # Set prompt mode if available in the job
-        prompt_mode = job.get("prompt_mode")
-        if prompt_mode:
-            send("Runtime.evaluate", {"expression": f"window.__chatgptBookmarkletPromptMode = {json.dumps(prompt_mode)};"})
-        
-        # Set image URL if we successfully converted it
-        if converted_image:
-            send("Runtime.evaluate", {"expression": f"window.__chatgptBookmarkletImageUrl = {json.dumps(converted_image)};"})
-            logger.info("Image URL set in window, bookmarklet will upload it")
+    ensure_bookmarklet_installed(send, session.install_script)
+
+    # All job parameters travel in a single call to the installed entrypoint
+    options: Dict[str, Any] = {"prompt": job["prompt"]}
+    if prompt_mode:
+        options["promptMode"] = prompt_mode
+    if page_timeouts:
+        options["timeouts"] = page_timeouts
+    if detach:
+        # Return once the conversation has a URL instead of waiting for the answer
+        options["detach"] = True
+    if deadline is not None:
+        # The page stops waiting for the answer once nobody will read it
+        options["deadline"] = int(deadline * 1000)
+
+    # The image was prefetched while we navigated; attach the cached file
+    # directly and only fall back to a data URI if that is not possible.
+    # A prompt that needs an image is never sent without it: ImageFetchError
+    # fails (or retries) the job.
+    if image is not None:
+        cached_image = image.result()
+        if attach_image_file(send, cached_image.path):
+            options["imageAttached"] = True
+            logger.info("Image attached via file input (%s bytes)", cached_image.size)
+        else:
+            logger.warning("No file input found, sending image to the bookmarklet as a data URI")
+            options["imageUrl"] = cached_image.to_data_uri()
+
+    if cancelled is not None and cancelled.is_set():
+        # Cancelled while we navigated; do not send the prompt at all
+        return {"cancelled": True, "navigation": navigation}
+
+    if on_chunk is not None:
+        options["stream"] = True
+        session.on("Runtime.bindingCalled", lambda params: forward_chunk(params, on_chunk))
+    try:
+        payload = run_bookmarklet_job(session, options)
+    finally:
+        session.on("Runtime.bindingCalled", None)
+    payload["navigation"] = navigation
+    if vpn_exit is not None:
+        # Which exit served the search, to correlate results with VPN servers
+        payload["vpn_exit"] = {key: vpn_exit.get(key) for key in ("ok", "server", "country", "city")}
+    logger.info("Page phases (ms): %s", payload.get("timings"))
+    return payload
 
-        send(
-            "Runtime.evaluate",
-            {
-                "expression": script,
-                "awaitPromise": True,
-            },
-        )
 
-        new_file = wait_for_new_file(send, saved_before)
-        if not new_file:
-            raise RuntimeError("Timed out waiting for bookmarklet to persist response")
+# How long (ms) a harvest waits for a just-finished answer to render
+HARVEST_WAIT_MS = 5000
 
-        content = get_file_content(send, new_file)
-        if not content:
-            raise RuntimeError(f"LocalStorage entry {new_file} not found")
 
+def harvest_detached_jobs(
+    session: CdpSession,
+    store: DetachedJobStore,
+    reporter: "ResultReporter",
+    chatgpt_url: str,
+    interval: float,
+    max_age: float,
+    spa_navigation: bool = False,
+    page_timeouts: Optional[Dict[str, int]] = None,
+) -> None:
+    """Revisit the detached conversations that are due and report finished answers."""
+    for job in store.due():
+        age = time.time() - job.submitted_at
+        if job.deadline is not None and time.time() >= job.deadline:
+            logger.info("Detached request %s passed its deadline, giving up", job.request_id)
+            store.remove(job.request_id)
+            reporter.report_expire(job.request_id, "Deadline passed while the request was running")
+            continue
         try:
-            payload = json.loads(content)
-        except json.JSONDecodeError as exc:  # pragma: no cover
-            raise RuntimeError(f"Failed to parse JSON in {new_file}: {exc}") from exc
+            state = post_heartbeat(reporter.server, job.request_id, reporter.api_key)
+        except requests.RequestException as exc:
+            logger.debug("Heartbeat for detached request %s failed: %s", job.request_id, exc)
+            state = {}
+        if state is None or state.get("cancel"):
+            logger.info("Detached request %s was cancelled, dropping it", job.request_id)
+            store.remove(job.request_id)
+            if state is not None:
+                reporter.report_cancelled(job.request_id)
+            continue
+        try:
+            modify_chatgpt_url(session.send, None, chatgpt_url, job.chat_url, spa_navigation)
+            ensure_bookmarklet_installed(session.send, session.install_script)
+            options = {
+                "prompt": job.prompt,
+                "harvest": True,
+                "timeouts": {**(page_timeouts or {}), "response": HARVEST_WAIT_MS},
+            }
+            payload = run_bookmarklet_job(session, options)
+        except Exception as exc:
+            logger.warning("Harvesting request %s failed: %s", job.request_id, exc)
+            payload = {"pending": True}
 
-        return payload
-    finally:
-        ws.close()
+        if not payload.get("pending"):
+            logger.info("Harvested request %s after %.0fs", job.request_id, age)
+            store.remove(job.request_id)
+            reporter.report_completion(job.request_id, payload)
+        elif age > max_age:
+            logger.error("Detached request %s has no answer after %.0fs, giving up", job.request_id, age)
+            store.remove(job.request_id)
+            reporter.report_failure(job.request_id, f"No answer in {job.chat_url} after {age / 60:.0f} minutes")
+        else:
+            logger.info("Request %s still running (check %d)", job.request_id, job.checks + 1)
+            store.reschedule(job, interval)
 
 
 def resolve_target(args: argparse.Namespace) -> Dict[str, Any]:
@@ -374,45 +897,576 @@ def resolve_target(args: argparse.Namespace) -> Dict[str, Any]:
     return {"target": target, "ws_url": ws_url}
 
 
-def claim_request(server: str, worker_id: str, api_key: str) -> Optional[Dict[str, Any]]:
+def register_worker(
+    server: str,
+    worker_id: str,
+    api_key: str,
+    account: str,
+    model_modes: List[str],
+    prompt_modes: List[str],
+) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/register",
+        json={
+            "worker_id": worker_id,
+            "account": account,
+            "model_modes": model_modes,
+            "prompt_modes": prompt_modes,
+        },
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def first_page_target(host: str, port: int, timeout: float) -> Dict[str, Any]:
+    """Pick the first regular page of a Chrome the worker just started."""
+    for target in bookmarklet.fetch_targets(host, port, timeout):
+        if target.get("type") == "page" and target.get("webSocketDebuggerUrl"):
+            return {"target": target, "ws_url": target["webSocketDebuggerUrl"]}
+    raise RuntimeError("Chrome has no open page to attach to")
+
+
+def recycle_tab(
+    args: argparse.Namespace,
+    script: str,
+    blocked_urls: Optional[List[str]],
+    session: CdpSession,
+    target_info: Dict[str, Any],
+    supervisor: Optional[ChromeSupervisor] = None,
+) -> Tuple[CdpSession, Dict[str, Any]]:
+    """
+    Replace the worker tab with a fresh one and return a session for it.
+
+    A managed Chrome that died is restarted first; its startup tab is reused.
+    """
+    session.close()
+    if supervisor is not None and not supervisor.alive():
+        supervisor.ensure_running()
+        new_info = first_page_target(args.host, args.port, args.timeout)
+    else:
+        target = open_tab(args.host, args.port, "about:blank", args.timeout)
+        close_tab(args.host, args.port, target_info["target"]["id"], args.timeout)
+        new_info = {"target": target, "ws_url": target["webSocketDebuggerUrl"]}
+    new_session = CdpSession(new_info["ws_url"], args.timeout, script, blocked_urls, new_info["target"].get("id"))
+    return new_session, new_info
+
+
+def read_js_heap_mb(send) -> Optional[float]:
+    """Current JS heap usage of the tab in MB, from Performance.getMetrics."""
+    for metric in send("Performance.getMetrics").get("metrics", []):
+        if metric.get("name") == "JSHeapUsedSize":
+            return metric["value"] / (1024 * 1024)
+    return None
+
+
+class TabHealth:
+    """
+    Decides when the worker tab has served long enough to be replaced.
+
+    ChatGPT's page keeps growing over hundreds of conversations; a fresh tab
+    every `max_jobs` jobs, or once the JS heap has grown `heap_growth` times
+    past its size after the first job, keeps job times steady.
+    """
+
+    def __init__(self, max_jobs: int, heap_growth: float) -> None:
+        self.max_jobs = max_jobs
+        self.heap_growth = heap_growth
+        self.reset()
+
+    def reset(self) -> None:
+        self.jobs = 0
+        self.baseline_heap_mb: Optional[float] = None
+        self.heap_mb: Optional[float] = None
+
+    def record_job(self, heap_mb: Optional[float]) -> None:
+        self.jobs += 1
+        if heap_mb is not None:
+            if self.baseline_heap_mb is None:
+                self.baseline_heap_mb = heap_mb
+            self.heap_mb = heap_mb
+
+    def recycle_reason(self) -> Optional[str]:
+        if self.max_jobs > 0 and self.jobs >= self.max_jobs:
+            return f"served {self.jobs} jobs"
+        if (
+            self.heap_growth > 0
+            and self.baseline_heap_mb
+            and self.heap_mb
+            and self.heap_mb > self.baseline_heap_mb * self.heap_growth
+        ):
+            return f"JS heap grew from {self.baseline_heap_mb:.0f} MB to {self.heap_mb:.0f} MB"
+        return None
+
+
+def claim_request(
+    server: str,
+    worker_id: str,
+    api_key: str,
+    exclude_prompt_modes: Optional[List[str]] = None,
+    prefer_prompt_modes: Optional[List[str]] = None,
+    detach_modes: Optional[List[str]] = None,
+    max_detached: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
     headers = {"X-API-Key": api_key}
-    response = requests.post(f"{server.rstrip('/')}/worker/claim", json={"worker_id": worker_id}, headers=headers)
+    payload: Dict[str, Any] = {"worker_id": worker_id}
+    if exclude_prompt_modes:
+        payload["exclude_prompt_modes"] = exclude_prompt_modes
+    if prefer_prompt_modes:
+        payload["prefer_prompt_modes"] = prefer_prompt_modes
+    if detach_modes:
+        payload["detach_modes"] = detach_modes
+        payload["max_detached"] = max_detached
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/claim",
+        json=payload,
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
     if response.status_code == 404:
         return None
     response.raise_for_status()
     return response.json()
 
 
-def post_completion(server: str, request_id: int, result: Dict[str, Any], api_key: str) -> None:
-    headers = {"X-API-Key": api_key}
-    
-    # Extract chat_url from result if available
-    chat_url = result.get("url")
-    
+def completion_payload(result: Dict[str, Any]) -> Dict[str, Any]:
     payload = {
         "response": json.dumps(result)
     }
     
     # Include chat_url if present
+    chat_url = result.get("url")
     if chat_url:
         payload["chat_url"] = chat_url
-    
-    response = requests.post(
+    return payload
+
+
+def post_completion(server: str, request_id: int, result: Dict[str, Any], api_key: str, worker_id: str) -> None:
+    headers = {"X-API-Key": api_key}
+    payload = {**completion_payload(result), "worker_id": worker_id}
+    response = get_http_session().post(
         f"{server.rstrip('/')}/worker/{request_id}/complete",
         json=payload,
         headers=headers,
+        timeout=HTTP_TIMEOUT,
     )
     response.raise_for_status()
 
 
-def post_failure(server: str, request_id: int, message: str, api_key: str) -> None:
+def post_detach(server: str, request_id: int, chat_url: str, api_key: str) -> None:
     headers = {"X-API-Key": api_key}
-    response = requests.post(
-        f"{server.rstrip('/')}/worker/{request_id}/fail",
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/detach",
+        json={"chat_url": chat_url},
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def post_requeue(server: str, request_id: int, requeue: Dict[str, Any], api_key: str) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/requeue",
+        json=requeue,
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def post_expire(server: str, request_id: int, message: str, api_key: str) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/expire",
         json={"error": message},
         headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def post_results(server: str, results: List[Dict[str, Any]], api_key: str) -> Dict[str, Any]:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/results",
+        json={"results": results},
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
     )
     response.raise_for_status()
+    return response.json()
+
+
+def post_heartbeat(server: str, request_id: int, api_key: str) -> Optional[Dict[str, Any]]:
+    """Check in on a running request; None means it no longer exists."""
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/heartbeat",
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def post_cancelled(server: str, request_id: int, api_key: str) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/cancelled",
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def post_chunk(server: str, request_id: int, chunk: Dict[str, Any], api_key: str) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/chunk",
+        json=chunk,
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def post_failure(server: str, request_id: int, message: str, api_key: str, retryable: bool = False) -> None:
+    headers = {"X-API-Key": api_key}
+    response = get_http_session().post(
+        f"{server.rstrip('/')}/worker/{request_id}/fail",
+        json={"error": message, "retryable": retryable},
+        headers=headers,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+# Reports kept in the journal, and the /worker/results status each replays as
+RESULT_STATUSES = {
+    "completion": "completed",
+    "failure": "failed",
+    "expire": "expired",
+    "cancelled": "cancelled",
+    "retry": "retry",
+    "requeue": "requeued",
+    "detach": "detached",
+}
+# Journaled results replayed per /worker/results call
+RESULT_REPLAY_BATCH = 50
+# Seconds between replay attempts while the server is unreachable
+RESULT_REPLAY_INTERVAL = 15.0
+
+
+def result_item(entry: JournalEntry, worker_id: str) -> Dict[str, Any]:
+    """The /worker/results form of a journaled result of `worker_id`'s attempt."""
+    item: Dict[str, Any] = {"id": entry.request_id, "worker_id": worker_id, "status": RESULT_STATUSES[entry.kind]}
+    if entry.kind == "completion":
+        item.update(completion_payload(entry.data))
+    elif entry.kind == "detach":
+        item["chat_url"] = entry.data
+    elif entry.kind == "requeue":
+        item["error"] = entry.data["reason"]
+    elif entry.data is not None:
+        item["error"] = entry.data
+    return item
+
+
+def is_rejection(exc: requests.RequestException) -> bool:
+    """Whether the server answered and will never accept the report as sent."""
+    response = getattr(exc, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+class ResultReporter:
+    """
+    Posts job results to the relay server from a background thread.
+
+    The job loop hands results over and goes straight back to claiming and
+    navigating for the next job while the report is in flight. The queue is
+    bounded so a stalled server eventually applies backpressure to the loop.
+
+    Streamed response deltas share the queue, so they always reach the server
+    before the final result. Deltas that pile up while a post is in flight are
+    coalesced into a single chunk.
+
+    With a journal, every report but streamed deltas (final results, and the
+    retries, requeues and detaches that hand a request back) is written to it
+    before it is queued and retired once the server accepts it. Reports that
+    failed, and those a previous run left behind, are replayed in batches
+    until the server takes them.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        api_key: str,
+        worker_id: str,
+        max_pending: int = 32,
+        journal: Optional[ResultJournal] = None,
+    ) -> None:
+        self.server = server
+        self.api_key = api_key
+        self.worker_id = worker_id
+        self.journal = journal
+        self._queue: "queue.Queue[Optional[Tuple[str, int, Any, Optional[JournalEntry]]]]" = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="result-reporter", daemon=True)
+        self._chunks_lock = threading.Lock()
+        self._pending_chunks: Dict[int, List[Dict[str, Any]]] = {}
+        # Requests with a "chunk" item in the queue
+        self._queued_chunks: Set[int] = set()
+        # Journaled results waiting for a replay, by journal sequence number
+        self._unreported: Dict[int, JournalEntry] = {entry.seq: entry for entry in journal.pending()} if journal else {}
+        self._next_replay = 0.0
+
+    def start(self) -> "ResultReporter":
+        self._thread.start()
+        return self
+
+    def report_completion(self, request_id: int, result: Dict[str, Any]) -> None:
+        self._report("completion", request_id, result)
+
+    def report_failure(self, request_id: int, message: str) -> None:
+        self._report("failure", request_id, message)
+
+    def report_retry(self, request_id: int, message: str) -> None:
+        """Report a failed attempt that another attempt may get past."""
+        self._report("retry", request_id, message)
+
+    def report_detach(self, request_id: int, chat_url: str) -> None:
+        self._report("detach", request_id, chat_url)
+
+    def report_requeue(self, request_id: int, reason: str, retry_after_seconds: Optional[float] = None) -> None:
+        self._report("requeue", request_id, {"reason": reason, "retry_after_seconds": retry_after_seconds})
+
+    def report_expire(self, request_id: int, message: str) -> None:
+        self._report("expire", request_id, message)
+
+    def report_cancelled(self, request_id: int) -> None:
+        self._report("cancelled", request_id, None)
+
+    def _report(self, kind: str, request_id: int, data: Any) -> None:
+        entry = None
+        if self.journal is not None and kind in RESULT_STATUSES:
+            entry = self.journal.record(kind, request_id, data)
+        self._queue.put((kind, request_id, data, entry))
+
+    def report_chunk(self, request_id: int, chunk: Dict[str, Any]) -> None:
+        with self._chunks_lock:
+            self._pending_chunks.setdefault(request_id, []).append(chunk)
+            if request_id in self._queued_chunks:
+                # Already queued; this delta rides along with the earlier ones
+                return
+            self._queued_chunks.add(request_id)
+        self._queue.put(("chunk", request_id, None, None))
+
+    def _take_chunk(self, request_id: int) -> Optional[Dict[str, Any]]:
+        """Merge the deltas waiting for `request_id` into one chunk."""
+        with self._chunks_lock:
+            pending = self._pending_chunks.pop(request_id, [])
+            self._queued_chunks.discard(request_id)
+        if not pending:
+            return None
+        merged = {"seq": pending[-1].get("seq"), "delta": "", "reset": False}
+        for chunk in pending:
+            if chunk.get("reset"):
+                merged["delta"] = chunk.get("delta", "")
+                merged["reset"] = True
+            else:
+                merged["delta"] += chunk.get("delta", "")
+        return merged
+
+    def _restore_chunk(self, request_id: int, chunk: Dict[str, Any]) -> None:
+        """Put back a chunk the server did not take, ahead of newer deltas, so it goes out with the next one."""
+        with self._chunks_lock:
+            self._pending_chunks.setdefault(request_id, []).insert(0, chunk)
+
+    def _drop_chunks(self, request_id: int) -> None:
+        """Forget restored chunks of a request that is no longer streaming."""
+        with self._chunks_lock:
+            if request_id not in self._queued_chunks:
+                self._pending_chunks.pop(request_id, None)
+
+    def stop(self, timeout: float = HTTP_TIMEOUT) -> None:
+        """Flush queued reports and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self._replay_wait())
+            except queue.Empty:
+                self._replay()
+                continue
+            if item is None:
+                return
+            kind, request_id, data, entry = item
+            if kind == "chunk":
+                chunk = self._take_chunk(request_id)
+                if chunk is None:
+                    continue
+                try:
+                    post_chunk(self.server, request_id, chunk, self.api_key)
+                except requests.RequestException as exc:
+                    logger.error("Failed to report chunk for %s: %s", request_id, exc)
+                    if not is_rejection(exc):
+                        self._restore_chunk(request_id, chunk)
+                continue
+            self._drop_chunks(request_id)
+            try:
+                if kind == "completion":
+                    post_completion(self.server, request_id, data, self.api_key, self.worker_id)
+                    logger.info("Request %s completed", request_id)
+                elif kind == "retry":
+                    post_failure(self.server, request_id, data, self.api_key, retryable=True)
+                elif kind == "detach":
+                    post_detach(self.server, request_id, data, self.api_key)
+                elif kind == "requeue":
+                    post_requeue(self.server, request_id, data, self.api_key)
+                elif kind == "expire":
+                    post_expire(self.server, request_id, data, self.api_key)
+                    logger.info("Request %s expired", request_id)
+                elif kind == "cancelled":
+                    post_cancelled(self.server, request_id, self.api_key)
+                    logger.info("Request %s cancelled", request_id)
+                else:
+                    post_failure(self.server, request_id, data, self.api_key)
+            except requests.RequestException as exc:
+                logger.error("Failed to report %s for %s: %s", kind, request_id, exc)
+                if entry is not None and is_rejection(exc):
+                    self.journal.retire([entry])
+                elif entry is not None:
+                    if not self._unreported:
+                        self._next_replay = time.monotonic() + RESULT_REPLAY_INTERVAL
+                    self._unreported[entry.seq] = entry
+                continue
+            if entry is not None:
+                self.journal.retire([entry])
+            if self._unreported:
+                # The server is answering again; replay what it missed now
+                self._next_replay = 0.0
+
+    def _replay_wait(self) -> Optional[float]:
+        """How long to wait for the next report before replaying (None: no replay due)."""
+        if not self._unreported:
+            return None
+        return max(0.0, self._next_replay - time.monotonic())
+
+    def _replay(self) -> None:
+        """Send journaled reports through /worker/results in batches."""
+        entries = sorted(self._unreported.values(), key=lambda entry: entry.seq)
+        for start in range(0, len(entries), RESULT_REPLAY_BATCH):
+            batch = entries[start:start + RESULT_REPLAY_BATCH]
+            try:
+                outcome = post_results(self.server, [result_item(entry, self.worker_id) for entry in batch], self.api_key)
+            except requests.RequestException as exc:
+                logger.warning(
+                    "Replaying %d report(s) failed, retrying in %.0fs: %s",
+                    len(entries) - start,
+                    RESULT_REPLAY_INTERVAL,
+                    exc,
+                )
+                self._next_replay = time.monotonic() + RESULT_REPLAY_INTERVAL
+                return
+            # Skipped requests moved on (or were deleted) and are no longer ours to report
+            self.journal.retire(batch)
+            for entry in batch:
+                self._unreported.pop(entry.seq, None)
+            logger.info(
+                "Replayed %d report(s): %d recorded, %d skipped",
+                len(batch),
+                len(outcome.get("applied", [])),
+                len(outcome.get("skipped", [])),
+            )
+
+
+# Stops the running bookmarklet job; a no-op between jobs
+CANCEL_EXPRESSION = "window.__chatgptBookmarkletCancel && window.__chatgptBookmarkletCancel()"
+
+
+class CancelWatch:
+    """
+    Heartbeats a running request and stops it in the page once it is cancelled.
+
+    Runs next to the job on its own thread. When a heartbeat says the request
+    should stop (the client cancelled it, or deleted it), the watch calls the
+    bookmarklet's cancel hook over the CDP session: generation stops and the
+    job returns at once, so the tab goes back to claiming work.
+    """
+
+    def __init__(self, server: str, api_key: str, session: CdpSession, request_id: int, interval: float) -> None:
+        self.server = server
+        self.api_key = api_key
+        self.session = session
+        self.request_id = request_id
+        self.interval = interval
+        self.cancelled = threading.Event()
+        # The request was deleted, so there is nothing to confirm
+        self.gone = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"cancel-watch-{request_id}", daemon=True)
+
+    def start(self) -> "CancelWatch":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._done.set()
+
+    def _run(self) -> None:
+        while not self._done.wait(self.interval):
+            try:
+                state = post_heartbeat(self.server, self.request_id, self.api_key)
+            except requests.RequestException as exc:
+                logger.debug("Heartbeat for request %s failed: %s", self.request_id, exc)
+                continue
+            if state is not None and not state.get("cancel"):
+                continue
+            logger.info("Request %s was cancelled, stopping it", self.request_id)
+            self.gone = state is None
+            self.cancelled.set()
+            if not self._done.is_set():
+                try:
+                    self.session.notify("Runtime.evaluate", {"expression": CANCEL_EXPRESSION})
+                except Exception as exc:
+                    logger.warning("Could not stop request %s in the page: %s", self.request_id, exc)
+            return
+
+
+class ThrottleBackoff:
+    """
+    Keeps the worker from claiming jobs while ChatGPT throttles its account.
+
+    Uses the cooldown the page reported when there is one, otherwise backs off
+    exponentially from `base` up to `maximum` over consecutive throttles.
+    """
+
+    def __init__(self, base: float, maximum: float) -> None:
+        self.base = base
+        self.maximum = maximum
+        self.strikes = 0
+        self.until = 0.0
+
+    def throttled(self, retry_after_seconds: Optional[float] = None) -> float:
+        """Record a throttle and return how long the worker pauses."""
+        self.strikes += 1
+        if retry_after_seconds:
+            delay = float(retry_after_seconds)
+        else:
+            delay = min(self.maximum, self.base * 2 ** (self.strikes - 1))
+        self.until = time.time() + delay
+        return delay
+
+    def succeeded(self) -> None:
+        self.strikes = 0
+
+    def remaining(self) -> float:
+        return max(0.0, self.until - time.time())
 
 
 def main() -> int:
@@ -425,56 +1479,251 @@ def main() -> int:
         return 1
     script = bookmarklet.load_bookmarklet(script_path)
 
+    supervisor: Optional[ChromeSupervisor] = None
+    if args.manage_chrome:
+        supervisor = ChromeSupervisor(
+            args.chrome_binary,
+            args.port,
+            Path(args.chrome_profile),
+            headless=args.headless,
+            host=args.host,
+        )
+        try:
+            supervisor.start()
+        except (OSError, RuntimeError) as exc:
+            logger.error("Failed to start Chrome: %s", exc)
+            return 1
+
     try:
-        target_info = resolve_target(args)
+        target_info = first_page_target(args.host, args.port, args.timeout) if supervisor else resolve_target(args)
     except Exception as exc:  # pragma: no cover
         logger.error("Failed to resolve target tab: %s", exc)
         return 1
 
-    ws_url = target_info["ws_url"]
+    blocked_urls = build_blocked_urls(args.block_urls, args.allow_urls) if args.block_traffic else None
+    session = CdpSession(target_info["ws_url"], args.timeout, script, blocked_urls, target_info["target"].get("id"))
+    tab_health = TabHealth(args.recycle_after_jobs, args.recycle_heap_growth)
     logger.info("Worker %s targeting %s", args.worker_id, target_info["target"].get("url"))
 
-    while True:
-        try:
-            job = claim_request(args.server, args.worker_id, args.api_key)
-        except requests.RequestException as exc:
-            logger.error("Server communication error: %s", exc)
-            time.sleep(args.poll_interval)
-            continue
+    journal = ResultJournal(
+        Path(args.result_journal) if args.result_journal else DEFAULT_STATE_DIR / f"results-{args.worker_id}.jsonl"
+    )
+    reporter = ResultReporter(args.server, args.api_key, args.worker_id, journal=journal).start()
+    image_cache = ImageCache(
+        Path(args.image_cache_dir),
+        max_bytes=args.image_cache_max_mb * 1024 * 1024,
+        url_ttl=args.image_cache_ttl,
+    )
 
-        if job is None:
-            logger.debug("No work available. Sleeping for %.1fs", args.poll_interval)
-            time.sleep(args.poll_interval)
-            continue
+    vpn: Optional[VpnRotator] = None
+    if args.vpn_rotate:
+        if VPN_AVAILABLE:
+            vpn = VpnRotator(
+                vpn_rotate_min.rotate,
+                args.vpn_region,
+                args.vpn_max_retries,
+                args.vpn_max_age,
+                searches_per_exit=args.vpn_searches_per_exit,
+                status=vpn_rotate_min.status,
+            )
+        else:
+            logger.warning("VPN rotation requested but vpn_rotate_min module is not available")
 
-        request_id = job["id"]
-        prompt = job["prompt"]
-        logger.info("Processing request %s", request_id)
+    account = args.account or args.worker_id
+    registered = False
+    backoff = ThrottleBackoff(args.throttle_backoff, args.throttle_max_backoff)
+    detach_modes = split_modes(args.detach_modes) if args.max_detached > 0 else []
+    detached = DetachedJobStore(
+        Path(args.detached_state) if args.detached_state else DEFAULT_STATE_DIR / f"detached-{args.worker_id}.json"
+    )
+
+    try:
+        while True:
+            recycle_reason = session.crashed or tab_health.recycle_reason()
+            if recycle_reason:
+                logger.warning("Replacing worker tab: %s", recycle_reason)
+                try:
+                    session, target_info = recycle_tab(args, script, blocked_urls, session, target_info, supervisor)
+                except Exception as exc:
+                    logger.error("Could not replace the worker tab: %s", exc)
+                    time.sleep(args.poll_interval)
+                    continue
+                tab_health.reset()
+
+            if not registered:
+                try:
+                    register_worker(
+                        args.server,
+                        args.worker_id,
+                        args.api_key,
+                        account,
+                        split_modes(args.model_modes),
+                        split_modes(args.prompt_modes),
+                    )
+                    registered = True
+                    logger.info("Registered worker %s for account %s", args.worker_id, account)
+                except requests.RequestException as exc:
+                    logger.error("Worker registration failed: %s", exc)
+                    time.sleep(args.poll_interval)
+                    continue
+
+            if vpn is not None:
+                # Everything below needs the network, which is down mid-rotation
+                vpn.wait_until_settled()
+
+            if detached.due():
+                harvest_detached_jobs(
+                    session,
+                    detached,
+                    reporter,
+                    args.chatgpt_url,
+                    args.harvest_interval,
+                    args.detached_max_age,
+                    spa_navigation=args.spa_navigation,
+                    page_timeouts=args.page_timeouts,
+                )
+
+            cooldown = backoff.remaining()
+            if cooldown > 0:
+                logger.debug("Account throttled, %.0fs of cooldown left", cooldown)
+                if vpn is not None:
+                    vpn.on_idle()
+                time.sleep(min(args.poll_interval, cooldown))
+                continue
+
+            # Keep claiming searches while the current exit has some left, so
+            # they share its rotation instead of each paying for one
+            prefer_modes = ["search"] if vpn is not None and vpn.in_group() else None
 
-        try:
-            result = run_prompt(
-                ws_url, 
-                script, 
-                job, 
-                args.timeout, 
-                args.chatgpt_url,
-                vpn_enabled=args.vpn_rotate,
-                vpn_region=args.vpn_region,
-                vpn_max_retries=args.vpn_max_retries,
-            )
-        except Exception as exc:
-            logger.error("Prompt %s failed: %s", request_id, exc)
             try:
-                post_failure(args.server, request_id, str(exc), args.api_key)
-            except requests.RequestException as post_exc:
-                logger.error("Failed to report failure for %s: %s", request_id, post_exc)
-            continue
+                job = claim_request(
+                    args.server,
+                    args.worker_id,
+                    args.api_key,
+                    prefer_prompt_modes=prefer_modes,
+                    detach_modes=detach_modes,
+                    max_detached=args.max_detached,
+                )
+            except requests.RequestException as exc:
+                logger.error("Server communication error: %s", exc)
+                time.sleep(args.poll_interval)
+                continue
 
-        try:
-            post_completion(args.server, request_id, result, args.api_key)
-            logger.info("Request %s completed", request_id)
-        except requests.RequestException as exc:
-            logger.error("Failed to report completion for %s: %s", request_id, exc)
+            if job is None:
+                logger.debug("No work available. Sleeping for %.1fs", args.poll_interval)
+                if vpn is not None:
+                    # Get the next search job a fresh exit while the browser has nothing to do
+                    vpn.on_idle()
+                time.sleep(args.poll_interval)
+                continue
+
+            request_id = job["id"]
+            deadline = parse_deadline(job.get("deadline_at"))
+            if deadline is not None and time.time() >= deadline:
+                logger.info("Request %s is already past its deadline, skipping it", request_id)
+                reporter.report_expire(request_id, "Deadline passed before the worker started the request")
+                continue
+            logger.info("Processing request %s", request_id)
+
+            # Start the download now so it overlaps with navigation
+            image_url = job.get("image_url")
+            image = image_cache.prefetch(image_url, args.image_max_dimension, args.image_quality) if image_url else None
+
+            watch = CancelWatch(args.server, args.api_key, session, request_id, args.heartbeat_interval).start()
+            try:
+                result = run_prompt(
+                    session,
+                    job,
+                    args.chatgpt_url,
+                    vpn=vpn,
+                    image=image,
+                    spa_navigation=args.spa_navigation,
+                    page_timeouts=args.page_timeouts,
+                    on_chunk=(lambda chunk, request_id=request_id: reporter.report_chunk(request_id, chunk)) if args.stream else None,
+                    # The server only hands out a detach mode while the account has a slot free
+                    detach=job.get("prompt_mode") in detach_modes,
+                    deadline=deadline,
+                    cancelled=watch.cancelled,
+                )
+            except Exception as exc:
+                if session.crashed or isinstance(exc, TAB_LOST_ERRORS):
+                    # The tab is gone, not the job: another worker can take it
+                    # while this one replaces the tab
+                    logger.error("Lost the worker tab during request %s: %s", request_id, exc)
+                    session.crashed = session.crashed or str(exc)
+                    reporter.report_requeue(request_id, f"Worker tab lost: {exc}")
+                    continue
+                if not watch.cancelled.is_set():
+                    if is_retryable(exc):
+                        # Back to the queue at its position; the server decides
+                        # whether it has attempts left
+                        logger.warning("Prompt %s failed, handing it back for another attempt: %s", request_id, exc)
+                        reporter.report_retry(request_id, str(exc))
+                    else:
+                        logger.error("Prompt %s failed: %s", request_id, exc)
+                        reporter.report_failure(request_id, str(exc))
+                    continue
+                result = {"cancelled": True}
+            finally:
+                watch.stop()
+                if image is not None:
+                    # The page has uploaded the file (or given up); eviction may drop it now
+                    image_cache.release_prefetched(image)
+
+            try:
+                tab_health.record_job(read_js_heap_mb(session.send))
+            except Exception as exc:
+                logger.debug("Could not read tab metrics: %s", exc)
+                tab_health.record_job(None)
+
+            if result.get("cancelled") or watch.cancelled.is_set():
+                # Whatever the page produced, nobody wants it anymore
+                logger.info("Stopped request %s: cancelled by the client", request_id)
+                if not watch.gone:
+                    reporter.report_cancelled(request_id)
+                continue
+
+            if result.get("expired"):
+                logger.warning("Abandoned request %s: its deadline passed while it ran", request_id)
+                reporter.report_expire(request_id, "Deadline passed while the request was running")
+                continue
+
+            if result.get("throttled"):
+                delay = backoff.throttled(result.get("retry_after_seconds"))
+                logger.warning(
+                    "ChatGPT throttled request %s (%s), requeueing it and pausing for %.0fs",
+                    request_id,
+                    result.get("message"),
+                    delay,
+                )
+                reporter.report_requeue(request_id, result.get("message") or "throttled", result.get("retry_after_seconds"))
+                continue
+            backoff.succeeded()
+
+            if result.get("detached"):
+                now = time.time()
+                detached.add(DetachedJob(
+                    request_id=request_id,
+                    chat_url=result["url"],
+                    prompt=job["prompt"],
+                    prompt_mode=job.get("prompt_mode"),
+                    submitted_at=now,
+                    next_check_at=now + args.harvest_interval,
+                    deadline=deadline,
+                ))
+                reporter.report_detach(request_id, result["url"])
+                logger.info("Request %s detached at %s (%d outstanding)", request_id, result["url"], len(detached))
+                continue
+
+            # Reported in the background while we claim the next job
+            reporter.report_completion(request_id, result)
+    except KeyboardInterrupt:
+        logger.info("Worker %s shutting down", args.worker_id)
+    finally:
+        reporter.stop()
+        session.close()
+        if supervisor is not None:
+            supervisor.stop()
 
     return 0
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Chrome process and tab management for the relay worker.
+
+In supervisor mode the worker launches its own Chrome with remote debugging
+and a persistent profile directory (log the profile in once; the session is
+kept across restarts), restarts it if it dies, and opens fresh tabs to
+replace crashed or worn-out ones.
+"""
+
+from __future__ import annotations
+
+import logging
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = Path.home() / ".config" / "chrome-debug"
+
+# Same flags as start-chrome-debuger.sh: keep timers and rendering running
+# in background tabs and cap V8's heap on small machines
+CHROME_FLAGS = [
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+    "--disable-features=TranslateUI",
+    "--disable-ipc-flooding-protection",
+    "--memory-pressure-off",
+    "--js-flags=--max-old-space-size=512",
+]
+
+
+def open_tab(host: str, port: int, url: str = "about:blank", timeout: float = 5.0) -> Dict[str, Any]:
+    """Open a new tab and return its target description."""
+    endpoint = f"http://{host}:{port}/json/new?{quote(url, safe=':/')}"
+    # Recent Chrome versions only accept PUT here
+    response = requests.put(endpoint, timeout=timeout)
+    if response.status_code == 405:
+        response = requests.get(endpoint, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def close_tab(host: str, port: int, target_id: str, timeout: float = 5.0) -> None:
+    """Close a tab; a tab that is already gone is not an error."""
+    try:
+        requests.get(f"http://{host}:{port}/json/close/{target_id}", timeout=timeout)
+    except requests.RequestException as e:
+        logger.debug(f"Could not close tab {target_id}: {e}")
+
+
+class ChromeSupervisor:
+    """Launches and owns one Chrome process with remote debugging enabled."""
+
+    def __init__(
+        self,
+        binary: str,
+        port: int,
+        profile_dir: Path = DEFAULT_PROFILE_DIR,
+        headless: bool = False,
+        host: str = "localhost",
+        startup_timeout: float = 30.0,
+    ) -> None:
+        self.binary = binary
+        self.port = port
+        self.profile_dir = Path(profile_dir)
+        self.headless = headless
+        self.host = host
+        self.startup_timeout = startup_timeout
+        self.restarts = 0
+        self._process: Optional[subprocess.Popen] = None
+
+    def command(self) -> List[str]:
+        binary = shutil.which(self.binary) or self.binary
+        command = [
+            binary,
+            f"--remote-debugging-port={self.port}",
+            f"--remote-allow-origins=http://{self.host}:{self.port}",
+            f"--user-data-dir={self.profile_dir}",
+            *CHROME_FLAGS,
+        ]
+        if self.headless:
+            command.append("--headless=new")
+        command.append("about:blank")
+        return command
+
+    def start(self) -> None:
+        """Launch Chrome and wait until its debugging endpoint answers."""
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        logger.info("Starting Chrome on port %s with profile %s", self.port, self.profile_dir)
+        self._process = subprocess.Popen(
+            self.command(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"Chrome exited during startup with code {self._process.returncode}")
+            if self.responding():
+                logger.info("Chrome ready (PID %s)", self._process.pid)
+                return
+            time.sleep(0.5)
+        raise RuntimeError(f"Chrome did not open its debugging port within {self.startup_timeout:.0f}s")
+
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None and self.responding()
+
+    def responding(self) -> bool:
+        try:
+            response = requests.get(f"http://{self.host}:{self.port}/json/version", timeout=2)
+            return response.ok
+        except requests.RequestException:
+            return False
+
+    def ensure_running(self) -> None:
+        """Restart Chrome if the process died or stopped answering."""
+        if self.alive():
+            return
+        logger.warning("Chrome is not responding, restarting it")
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process = None
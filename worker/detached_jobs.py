@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Bookkeeping for long-running jobs the worker submitted but stopped watching.
+
+A detached job has been sent to ChatGPT and has a conversation URL; the worker
+revisits that conversation every so often to collect the answer. The list is
+kept on disk so a restarted worker picks up where it left off.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = Path.home() / ".cache" / "chatgpt-relay"
+
+
+@dataclass
+class DetachedJob:
+    request_id: int
+    chat_url: str
+    prompt: str
+    prompt_mode: Optional[str]
+    submitted_at: float
+    next_check_at: float
+    checks: int = 0
+    # Unix time after which nobody wants the answer any more
+    deadline: Optional[float] = None
+
+
+class DetachedJobStore:
+    """Detached jobs of one worker, persisted as a JSON file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._jobs: Dict[int, DetachedJob] = self._load()
+        if self._jobs:
+            logger.info("Resuming %d detached job(s) from %s", len(self._jobs), self.path)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def add(self, job: DetachedJob) -> None:
+        self._jobs[job.request_id] = job
+        self._save()
+
+    def remove(self, request_id: int) -> None:
+        if self._jobs.pop(request_id, None) is not None:
+            self._save()
+
+    def reschedule(self, job: DetachedJob, delay: float) -> None:
+        """Count a check that found no answer yet and schedule the next one."""
+        job.checks += 1
+        job.next_check_at = time.time() + delay
+        self._save()
+
+    def due(self, now: Optional[float] = None) -> List[DetachedJob]:
+        """Jobs whose next check is due, oldest submission first."""
+        now = time.time() if now is None else now
+        return sorted(
+            (job for job in self._jobs.values() if job.next_check_at <= now),
+            key=lambda job: job.submitted_at,
+        )
+
+    def _load(self) -> Dict[int, DetachedJob]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            jobs = (DetachedJob(**entry) for entry in data)
+            return {job.request_id: job for job in jobs}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Ignoring unreadable detached job file {self.path}: {e}")
+            return {}
+
+    def _save(self) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(job) for job in self._jobs.values()], f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+On-disk image cache for the relay worker.
+
+Image bytes are stored once per content hash and looked up by URL, so a
+reference image reused across a batch of prompts is downloaded only once.
+A URL entry older than its TTL is revalidated with a conditional GET, so an
+image replaced under the same URL is picked up. Entries are evicted
+least-recently-used first when the cache grows past its size or entry limits;
+blobs handed out to jobs that have not released them yet are never evicted.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Pillow is optional; without it images are uploaded at their original size
+try:
+    from PIL import Image, UnidentifiedImageError
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "chatgpt-relay" / "images"
+INDEX_FILE = "index.json"
+
+
+class ImageFetchError(RuntimeError):
+    """The image could not be downloaded or decoded."""
+
+    def __init__(self, message: str, retryable: bool) -> None:
+        super().__init__(message)
+        # A network error or server hiccup, as opposed to a missing or broken image
+        self.retryable = retryable
+
+
+@dataclass
+class CachedImage:
+    path: Path
+    content_type: str
+    sha256: str
+    size: int
+    # Original data URI when the job supplied one, so it never has to be re-encoded
+    data_uri: Optional[str] = None
+
+    def to_data_uri(self) -> str:
+        """Return the image as a base64 data URI."""
+        if self.data_uri is None:
+            encoded = base64.b64encode(self.path.read_bytes()).decode("ascii")
+            self.data_uri = f"data:{self.content_type};base64,{encoded}"
+        return self.data_uri
+
+
+def _is_transient(error: Exception) -> bool:
+    """Whether fetching the image again later may succeed."""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status >= 500 or status in (408, 429)
+    if PIL_AVAILABLE and isinstance(error, UnidentifiedImageError):
+        return False
+    return isinstance(error, (requests.RequestException, OSError))
+
+
+class _NotModified(Exception):
+    """The server confirmed the cached copy of a URL is still current."""
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _decode_data_uri(url: str) -> tuple[str, bytes]:
+    """Split a data URI into its content type and decoded bytes."""
+    header, _, data = url.partition(",")
+    content_type = header[len("data:"):].split(";", 1)[0] or "image/png"
+    if header.endswith(";base64"):
+        return content_type, base64.b64decode(data)
+    from urllib.parse import unquote_to_bytes
+    return content_type, unquote_to_bytes(data)
+
+
+class _HashingWriter:
+    """File wrapper that hashes and counts bytes as they are written."""
+
+    def __init__(self, raw: Any) -> None:
+        self._raw = raw
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._raw.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+
+class ImageCache:
+    """Content-addressed LRU cache of job images, keyed by URL."""
+
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entries: int = 512,
+        download_timeout: float = 30.0,
+        url_ttl: float = 300.0,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.download_timeout = download_timeout
+        self.url_ttl = url_ttl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+        # Blob file names handed out and not released yet, with how many holders each
+        self._reserved: Dict[str, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-prefetch")
+
+    def prefetch(self, url: str, max_dimension: int = 0, quality: int = 85) -> "Future[CachedImage]":
+        """Start fetching (and optionally downscaling) an image in the background; see get()."""
+        return self._executor.submit(self.get, url, max_dimension, quality)
+
+    def get(self, url: str, max_dimension: int = 0, quality: int = 85) -> CachedImage:
+        """
+        Return the cached image for `url`, downloading or decoding it on a miss.
+
+        When `max_dimension` is set, images larger than that on their longest side
+        are downscaled and recompressed; the resized copy is cached as well.
+        The returned blob is kept out of eviction until it is release()d.
+        Raises ImageFetchError when the image cannot be had.
+        """
+        image = None
+        try:
+            image = self._get_source(url)
+            if max_dimension > 0:
+                resized = self._downscale(image, max_dimension, quality)
+                if resized is not image:
+                    self.release(image)
+                    return resized
+            if url.startswith("data:"):
+                image.data_uri = url
+            return image
+        except Exception as e:
+            if image is not None:
+                self.release(image)
+            logger.error(f"Failed to fetch image: {e}")
+            raise ImageFetchError(f"Failed to fetch image: {e}", retryable=_is_transient(e)) from e
+
+    def release(self, image: CachedImage) -> None:
+        """Let eviction drop an image returned by get() once the job is done with it."""
+        with self._lock:
+            name = image.path.name
+            holders = self._reserved.get(name, 0) - 1
+            if holders > 0:
+                self._reserved[name] = holders
+            else:
+                self._reserved.pop(name, None)
+
+    def release_prefetched(self, image: "Future[CachedImage]") -> None:
+        """release() the image of a prefetch, whenever it finishes."""
+        def done(future: "Future[CachedImage]") -> None:
+            if not future.cancelled() and future.exception() is None:
+                self.release(future.result())
+        image.add_done_callback(done)
+
+    def _get_source(self, url: str) -> CachedImage:
+        """The image behind `url` as fetched, from the cache while it is fresh."""
+        key = _url_key(url)
+        with self._lock:
+            entry = self._index.get(key)
+            # Data URIs carry their content; only URLs can change behind our back
+            fresh = entry is not None and (
+                url.startswith("data:") or time.time() - entry.get("fetched_at", 0) < self.url_ttl
+            )
+            image = self._lookup(key) if fresh else None
+        if image is not None:
+            logger.info("Image cache hit (%s bytes)", image.size)
+            return image
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        validators: Dict[str, Any] = {}
+        try:
+            return self._store(key, lambda tmp: self._write_source(url, tmp, headers, validators), validators)
+        except _NotModified:
+            with self._lock:
+                image = self._lookup(key)
+                if image is not None:
+                    self._index[key]["fetched_at"] = time.time()
+                    self._save_index()
+            if image is not None:
+                logger.info("Image unchanged at its URL, using the cached copy (%s bytes)", image.size)
+                return image
+            # Evicted while we asked; fetch it in full
+            return self._store(key, lambda tmp: self._write_source(url, tmp, {}, validators), validators)
+
+    def _downscale(self, image: CachedImage, max_dimension: int, quality: int) -> CachedImage:
+        if not PIL_AVAILABLE:
+            logger.warning("Pillow is not installed, uploading image at original size")
+            return image
+        key = f"{image.sha256}:{max_dimension}:{quality}"
+        with self._lock:
+            cached = self._lookup(key)
+        if cached is not None:
+            return cached
+
+        with Image.open(image.path) as source:
+            if max(source.size) <= max_dimension:
+                return image
+            source.thumbnail((max_dimension, max_dimension))
+            buffer = io.BytesIO()
+            if source.mode in ("RGBA", "LA", "P"):
+                source.save(buffer, format="PNG", optimize=True)
+                content_type = "image/png"
+            else:
+                source.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+                content_type = "image/jpeg"
+
+        def write(tmp: Any) -> str:
+            tmp.write(buffer.getvalue())
+            return content_type
+
+        resized = self._store(key, write)
+        logger.info("Downscaled image from %s to %s bytes", image.size, resized.size)
+        return resized
+
+    def _write_source(self, url: str, tmp: Any, headers: Dict[str, str], validators: Dict[str, Any]) -> str:
+        """
+        Write the image behind `url` to `tmp` and return its content type.
+
+        `headers` may make the request conditional; _NotModified is raised when
+        the server answers 304. The response's ETag and Last-Modified go into
+        `validators` for the next revalidation.
+        """
+        if url.startswith("data:"):
+            content_type, data = _decode_data_uri(url)
+            tmp.write(data)
+            return content_type
+        logger.info(f"Fetching image from {url}")
+        with requests.get(url, timeout=self.download_timeout, stream=True, headers=headers) as response:
+            if response.status_code == 304:
+                raise _NotModified()
+            response.raise_for_status()
+            validators.update({
+                "fetched_at": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            })
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                tmp.write(chunk)
+            return response.headers.get("Content-Type", "image/png").split(";", 1)[0]
+
+    def _lookup(self, key: str) -> Optional[CachedImage]:
+        """The cached image for `key`, reserved for the caller; call with the lock held."""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        path = self.cache_dir / entry["file"]
+        if not path.exists():
+            del self._index[key]
+            return None
+        # Touch the blob so eviction sees it as recently used
+        os.utime(path)
+        self._reserved[path.name] = self._reserved.get(path.name, 0) + 1
+        return CachedImage(path=path, content_type=entry["content_type"], sha256=entry["sha256"], size=path.stat().st_size)
+
+    def _store(self, key: str, write: Callable[[Any], str], extra: Optional[Dict[str, Any]] = None) -> CachedImage:
+        """
+        Cache what `write` produces under `key`, reserved for the caller.
+
+        `extra` is added to the index entry once `write` has run.
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                tmp = _HashingWriter(raw)
+                content_type = write(tmp)
+            sha256 = tmp.digest.hexdigest()
+            # Keep a real extension: Chrome derives the upload's MIME type from it
+            extension = mimetypes.guess_extension(content_type) or ".png"
+            path = self.cache_dir / f"{sha256}{extension}"
+            # Identical content from another URL is stored only once
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._index[key] = {"sha256": sha256, "file": path.name, "content_type": content_type, **(extra or {})}
+            self._reserved[path.name] = self._reserved.get(path.name, 0) + 1
+            self._evict(keep=path.name)
+            self._save_index()
+        logger.info("Cached image %s (%s bytes)", sha256[:12], tmp.size)
+        return CachedImage(path=path, content_type=content_type, sha256=sha256, size=tmp.size)
+
+    def _evict(self, keep: str) -> None:
+        """
+        Drop least-recently-used blobs until the cache fits its limits.
+
+        Never evicts `keep` or a blob a job still holds (Chrome may be reading
+        it for DOM.setFileInputFiles); those count towards the limits all the same.
+        """
+        held: Set[str] = {keep, *self._reserved}
+        blobs = []
+        total = 0
+        pinned = 0
+        for path in self.cache_dir.iterdir():
+            if not path.is_file() or path.name.startswith(".") or path.name == INDEX_FILE:
+                continue
+            total += path.stat().st_size
+            if path.name in held:
+                pinned += 1
+            else:
+                blobs.append(path)
+        blobs.sort(key=lambda path: path.stat().st_mtime)
+        removed = set()
+        while blobs and (total > self.max_bytes or len(blobs) + pinned > self.max_entries):
+            oldest = blobs.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink()
+            removed.add(oldest.name)
+        if removed:
+            self._index = {key: entry for key, entry in self._index.items() if entry["file"] not in removed}
+            logger.info("Evicted %d image(s) from cache", len(removed))
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.cache_dir / INDEX_FILE, encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                return {}
+            return {key: entry for key, entry in data.items() if isinstance(entry, dict) and "file" in entry}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        tmp_path = self.cache_dir / f".{INDEX_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.cache_dir / INDEX_FILE)
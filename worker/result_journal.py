@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Write-ahead journal of job results the server has not acknowledged yet.
+
+Every final result (an answer, a failure, an expiry or a cancellation) is
+appended to the journal and synced to disk before the worker reports it, and
+retired once the server accepts it. So is every report that hands a request
+back (a retryable failure, a throttle requeue or a detach), which would
+otherwise leave it stuck in processing. Results whose report failed,
+including those left over from a previous run, stay in the journal and are
+replayed, so a server outage never costs a finished answer.
+
+The file holds JSON lines: an entry per recorded result and a marker per
+retired one. It is compacted to the outstanding entries on startup and once
+enough markers pile up.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Rewrite the file once it holds this many lines for retired entries
+COMPACT_AFTER = 500
+
+
+@dataclass
+class JournalEntry:
+    seq: int
+    kind: str
+    request_id: int
+    data: Any
+    recorded_at: float
+
+
+class ResultJournal:
+    """Unacknowledged results of one worker, persisted as JSON lines."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: Dict[int, JournalEntry] = self._load()
+        self._next_seq = max(self._entries, default=0) + 1
+        self._compact()
+        if self._entries:
+            logger.info("Found %d unreported result(s) in %s", len(self._entries), self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record(self, kind: str, request_id: int, data: Any) -> JournalEntry:
+        """Durably add a result before it is reported."""
+        with self._lock:
+            entry = JournalEntry(self._next_seq, kind, request_id, data, time.time())
+            self._next_seq += 1
+            self._entries[entry.seq] = entry
+            self._append([{"op": "add", **asdict(entry)}])
+        return entry
+
+    def retire(self, entries: Iterable[JournalEntry]) -> None:
+        """Drop results the server acknowledged (or will never accept)."""
+        with self._lock:
+            seqs = [entry.seq for entry in entries if self._entries.pop(entry.seq, None) is not None]
+            if not seqs:
+                return
+            self._append([{"op": "done", "seq": seq} for seq in seqs])
+            self._retired += len(seqs)
+            if self._retired >= COMPACT_AFTER:
+                self._compact()
+
+    def pending(self) -> List[JournalEntry]:
+        """Outstanding results, oldest first."""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda entry: entry.seq)
+
+    def _load(self) -> Dict[int, JournalEntry]:
+        entries: Dict[int, JournalEntry] = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                        if record.pop("op") == "add":
+                            entry = JournalEntry(**record)
+                            entries[entry.seq] = entry
+                        else:
+                            entries.pop(record["seq"], None)
+                    except (ValueError, TypeError, KeyError) as e:
+                        # Typically the last line, cut short by a crash mid-write
+                        logger.warning(f"Skipping unreadable line {number} of {self.path}: {e}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not read result journal {self.path}: {e}")
+        return entries
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in sorted(self._entries.values(), key=lambda entry: entry.seq):
+                f.write(json.dumps({"op": "add", **asdict(entry)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._retired = 0
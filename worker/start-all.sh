@@ -19,6 +19,19 @@ export CDP_TIMEOUT="600.0"
 export VPN_ROTATE="false"
 export VPN_REGION=""  # Optional: specify region (e.g., "france", "united_states")
 export VPN_MAX_RETRIES="2"
+export VPN_SEARCHES_PER_EXIT="1"  # Search jobs that may share one VPN exit
+
+# Block analytics, fonts, avatars and tracking requests in the worker tab
+export BLOCK_TRAFFIC="false"
+
+# ChatGPT account (Chrome profile) this worker drives; workers sharing an
+# account share its message caps. Defaults to the worker ID.
+export ACCOUNT=""
+
+# Prompt modes submitted without waiting for the answer (harvested later),
+# and how many of them may be outstanding for this account at once
+export DETACH_MODES="deep"
+export MAX_DETACHED="3"
 
 # Change to the project directory
 cd ~/eypiyay || exit 1
@@ -118,10 +131,27 @@ if [ "$VPN_ROTATE" = "true" ]; then
     if [ -n "$VPN_MAX_RETRIES" ]; then
         VPN_ARGS="$VPN_ARGS --vpn-max-retries $VPN_MAX_RETRIES"
     fi
+    if [ -n "$VPN_SEARCHES_PER_EXIT" ]; then
+        VPN_ARGS="$VPN_ARGS --vpn-searches-per-exit $VPN_SEARCHES_PER_EXIT"
+    fi
 else
     log "VPN rotation disabled"
 fi
 
+# Build network blocking arguments
+NETWORK_ARGS=""
+if [ "$BLOCK_TRAFFIC" = "true" ]; then
+    log "Blocking non-essential network traffic in the worker tab"
+    NETWORK_ARGS="--block-traffic"
+fi
+
+# Build account arguments
+ACCOUNT_ARGS=""
+if [ -n "$ACCOUNT" ]; then
+    log "Account: $ACCOUNT"
+    ACCOUNT_ARGS="--account $ACCOUNT"
+fi
+
 # Start the worker process
 log "Starting worker process..."
 log "Worker ID: $WORKER_ID"
@@ -143,7 +173,11 @@ python -m worker.cdp_worker \
   --poll-interval "$POLL_INTERVAL" \
   --chatgpt-url "$CHATGPT_URL" \
   --script bookmarklet.js \
+  --detach-modes "$DETACH_MODES" \
+  --max-detached "$MAX_DETACHED" \
   $VPN_ARGS \
+  $NETWORK_ARGS \
+  $ACCOUNT_ARGS \
   2>&1 | tee -a "$LOG_FILE"
 
 # If worker exits, log it
@@ -6,11 +6,25 @@ Handles disconnecting and reconnecting to ensure a fresh IP address.
 
 from __future__ import annotations
 
+import re
 import subprocess
+import threading
 import time
 import json
 from typing import Optional, Dict, Any, List
 
+# `nordvpn c` prints e.g. "You are connected to Germany #512 (de512.nordvpn.com)!"
+_CONNECTED_RE = re.compile(r"connected to .+?\((?P<hostname>[^)\s]+)\)", re.IGNORECASE)
+
+# How old (s) a cached status may be before it is refreshed
+STATUS_MAX_AGE_S = 30.0
+
+# Last parsed `nordvpn status` and when it was taken (time.monotonic())
+_status_lock = threading.Lock()
+_cached_status: Dict[str, Any] = {}
+_cached_at: Optional[float] = None
+_refreshing = False
+
 
 def _run(cmd: List[str], timeout: int = 20) -> subprocess.CompletedProcess:
     """Run a command with timeout and capture output."""
@@ -27,24 +41,76 @@ def _parse_status(text: str) -> Dict[str, Any]:
     return info
 
 
+def is_connected(info: Dict[str, Any]) -> bool:
+    """Whether a parsed status says connected ("Disconnected" does not count)."""
+    return (info.get("status") or "").strip().lower() == "connected"
+
+
 def _status() -> Dict[str, Any]:
     """Get current NordVPN status."""
     try:
         cp = _run(["nordvpn", "status"], timeout=5)
-        return _parse_status(cp.stdout)
+        info = _parse_status(cp.stdout)
     except Exception:
         return {}
+    _remember(info)
+    return info
+
+
+def _remember(info: Dict[str, Any]) -> None:
+    global _cached_status, _cached_at
+    with _status_lock:
+        _cached_status = dict(info)
+        _cached_at = time.monotonic()
+
+
+def _refresh_in_background() -> None:
+    global _refreshing
+    try:
+        _status()
+    finally:
+        with _status_lock:
+            _refreshing = False
+
+
+def _cached(max_age_s: float) -> Dict[str, Any]:
+    """The cached status if it is younger than `max_age_s`, else {}."""
+    with _status_lock:
+        if _cached_at is None or time.monotonic() - _cached_at > max_age_s:
+            return {}
+        return dict(_cached_status)
+
+
+def status(max_age_s: float = STATUS_MAX_AGE_S) -> Dict[str, Any]:
+    """
+    Last known NordVPN status, without waiting on the nordvpn CLI.
+
+    Returns the cached parse immediately (empty if there is none yet). If it is
+    older than `max_age_s` a single background refresh is started, so callers
+    that poll this never spawn more than one `nordvpn status` at a time.
+    """
+    global _refreshing
+    with _status_lock:
+        info = dict(_cached_status)
+        stale = _cached_at is None or time.monotonic() - _cached_at > max_age_s
+        if stale and not _refreshing:
+            _refreshing = True
+            threading.Thread(target=_refresh_in_background, name="vpn-status", daemon=True).start()
+    return info
 
 
 def _wait_connected(max_wait_s: float = 20.0) -> Dict[str, Any]:
     """Wait for VPN to reach connected state."""
     deadline = time.time() + max_wait_s
     last = {}
+    delay = 0.25
     while time.time() < deadline:
         last = _status()
-        if "connected" in last.get("status", "").lower():
+        if is_connected(last):
             return last
-        time.sleep(0.5)
+        # Back off so a slow handshake doesn't spawn dozens of status calls
+        time.sleep(min(delay, max(0.0, deadline - time.time())))
+        delay = min(delay * 2, 2.0)
     return last
 
 
@@ -71,8 +137,10 @@ def rotate(
     """
     result: Dict[str, Any] = {"ok": False, "retries": 0}
 
-    # Snapshot current server (if any) to avoid reconnecting to the same one
-    before = _status()
+    # Snapshot current server (if any) to avoid reconnecting to the same one;
+    # a recent status (e.g. from the previous rotation) saves a CLI call, an
+    # older one may predate an auto-reconnect
+    before = _cached(STATUS_MAX_AGE_S) or _status()
     before_server = (
         before.get("hostname")
         or before.get("current_server")
@@ -94,13 +162,19 @@ def rotate(
         cmd = ["nordvpn", "c"]
         if region:
             cmd.append(region)
-        _run(cmd, timeout=15)
+        try:
+            connect_output = _run(cmd, timeout=15).stdout
+        except subprocess.TimeoutExpired:
+            connect_output = ""
 
-        # Wait until connected (fast polling)
-        new_status = _wait_connected(max_wait_s=connect_timeout_s)
+        # `nordvpn c` only returns once connected and says so; a single status
+        # call then fills in the details. Poll only if it didn't confirm.
+        new_status = _status() if _CONNECTED_RE.search(connect_output) else {}
+        if not is_connected(new_status):
+            new_status = _wait_connected(max_wait_s=connect_timeout_s)
 
         # Check if we're connected
-        if "connected" not in (new_status.get("status", "").lower()):
+        if not is_connected(new_status):
             attempts += 1
             if attempts > max_retries:
                 break
@@ -135,7 +209,7 @@ def rotate(
         break
 
     result.update({
-        "ok": "connected" in new_status.get("status", "").lower(),
+        "ok": is_connected(new_status),
         "status": new_status.get("status"),
         "server": new_status.get("hostname")
                   or new_status.get("current_server")
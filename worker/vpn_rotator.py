@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Background VPN rotation for search jobs.
+
+Rotating takes several seconds of disconnect, reconnect and status polling.
+The rotator does it on a background thread while the worker is idle so a
+fresh exit is usually ready when a search job arrives; the job then only
+marks that exit as used instead of waiting for a reconnect.
+
+An exit may serve several searches before it is rotated away: at most
+`searches_per_exit` jobs, and none once it is older than `max_age`. While an
+exit has searches left the worker prefers search jobs when claiming, so a
+burst of searches shares one rotation.
+
+A reconnect drops every open connection on the machine, the browser's
+included, so rotation never starts while a job is using the browser, and
+browser work waits for a rotation that is already in flight to finish.
+
+With a `status` callable (vpn_rotate_min.status), an exit also stops being
+fresh as soon as the VPN reports a disconnect or a different server, and
+searches report the exit the VPN last said it was on.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class VpnRotator:
+    """Keeps a fresh VPN exit ready for the next search jobs."""
+
+    def __init__(
+        self,
+        rotate: Callable[..., Dict[str, Any]],
+        region: Optional[str] = None,
+        max_retries: int = 2,
+        max_age: float = 900.0,
+        connect_timeout_s: int = 20,
+        retry_delay: float = 60.0,
+        searches_per_exit: int = 1,
+        status: Optional[Callable[..., Dict[str, Any]]] = None,
+        status_max_age: float = 30.0,
+    ) -> None:
+        self._rotate_fn = rotate
+        # Cached, non-blocking VPN status; refreshed in the background once
+        # older than status_max_age
+        self._status_fn = status
+        self.status_max_age = status_max_age
+        self.region = region
+        self.max_retries = max_retries
+        # An exit older than this is rotated again before the next search
+        self.max_age = max_age
+        self.searches_per_exit = max(1, searches_per_exit)
+        self.connect_timeout_s = connect_timeout_s
+        # Idle rotations are not retried sooner than this after a failure
+        self.retry_delay = retry_delay
+        self._failed_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._rotating = False
+        # When the current exit was connected and how many searches used it
+        self._exit_since: Optional[float] = None
+        self._uses = 0
+        self.last_result: Dict[str, Any] = {}
+
+    def has_fresh(self) -> bool:
+        with self._cond:
+            return self._is_fresh()
+
+    def in_group(self) -> bool:
+        """True while the current exit has served searches and has some left."""
+        with self._cond:
+            return self._uses > 0 and self._is_fresh()
+
+    def on_idle(self) -> None:
+        """The browser is idle: start a rotation if no fresh exit is ready."""
+        with self._cond:
+            if self._rotating or self._is_fresh():
+                return
+            if self._failed_at is not None and time.time() - self._failed_at < self.retry_delay:
+                return
+            self._rotating = True
+        threading.Thread(target=self._rotate_and_release, name="vpn-rotation", daemon=True).start()
+
+    def wait_until_settled(self) -> None:
+        """Block until no rotation is in flight, so the network is up for browser work."""
+        with self._cond:
+            if self._rotating:
+                logger.info("Waiting for background VPN rotation to finish")
+            while self._rotating:
+                self._cond.wait()
+
+    def acquire_for_search(self) -> Dict[str, Any]:
+        """
+        Use the current exit for a search job, rotating now only if it is spent.
+
+        Returns the status of the exit the job runs on.
+        """
+        self.wait_until_settled()
+        with self._cond:
+            if self._is_fresh():
+                self._uses += 1
+                logger.info(
+                    "Using VPN exit %s for search %d/%d",
+                    self.last_result.get("server"),
+                    self._uses,
+                    self.searches_per_exit,
+                )
+                return self._current_exit()
+            self._rotating = True
+        logger.info("No fresh VPN exit ready, rotating before the search job")
+        self._rotate_and_release()
+        with self._cond:
+            if self._exit_since is not None:
+                self._uses = 1
+            return self._current_exit()
+
+    def _is_fresh(self) -> bool:
+        if self._exit_since is not None and not self._exit_unchanged():
+            # Spent for good; the next idle moment rotates again
+            self._exit_since = None
+        return (
+            self._exit_since is not None
+            and self._uses < self.searches_per_exit
+            and time.time() - self._exit_since <= self.max_age
+        )
+
+    def _live_status(self) -> Dict[str, Any]:
+        """The VPN's last reported status ({} when unknown or not tracked)."""
+        if self._status_fn is None:
+            return {}
+        try:
+            return self._status_fn(max_age_s=self.status_max_age)
+        except Exception as e:
+            logger.debug(f"Could not read VPN status: {e}")
+            return {}
+
+    def _exit_unchanged(self) -> bool:
+        """False once the VPN reports a disconnect or another server than we rotated to."""
+        live = self._live_status()
+        if not live:
+            return True
+        if (live.get("status") or "").strip().lower() != "connected":
+            logger.info("VPN reports %s, the current exit is no longer usable", live.get("status") or "no connection")
+            return False
+        server = live.get("hostname") or live.get("current_server") or live.get("server")
+        if server and self.last_result.get("server") and server != self.last_result.get("server"):
+            logger.info("VPN moved from %s to %s on its own", self.last_result.get("server"), server)
+            return False
+        return True
+
+    def _current_exit(self) -> Dict[str, Any]:
+        """The exit a search runs on: the rotation result, or after a failed rotation what the VPN reports."""
+        current = dict(self.last_result)
+        live = self._live_status()
+        if not current.get("ok") and live:
+            current.update({
+                "server": live.get("hostname") or live.get("current_server") or live.get("server"),
+                "country": live.get("country"),
+                "city": live.get("city"),
+            })
+        return current
+
+    def _rotate_and_release(self) -> None:
+        started = time.monotonic()
+        try:
+            result = self._rotate_fn(
+                region=self.region,
+                require_new=True,
+                max_retries=self.max_retries,
+                connect_timeout_s=self.connect_timeout_s,
+            )
+        except Exception as e:
+            # Don't raise - jobs continue on the current connection
+            logger.error(f"Unexpected error during VPN rotation: {e}. Continuing with current connection")
+            result = {"ok": False, "error": str(e)}
+
+        with self._cond:
+            self.last_result = result
+            self._uses = 0
+            if result.get("ok"):
+                self._exit_since = time.time()
+                self._failed_at = None
+                logger.info(
+                    f"VPN rotation successful in {time.monotonic() - started:.1f}s! Connected to: {result.get('server')} "
+                    f"({result.get('country')}, {result.get('city')}) "
+                    f"[{result.get('protocol')}] (retries: {result.get('retries', 0)})"
+                )
+            else:
+                self._exit_since = None
+                self._failed_at = time.time()
+                logger.warning(
+                    f"VPN rotation failed: {result.get('error', 'Unknown error')}. "
+                    f"Continuing with current connection (retries: {result.get('retries', 0)})"
+                )
+            self._rotating = False
+            self._cond.notify_all()